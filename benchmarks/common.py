@@ -0,0 +1,95 @@
+"""
+Shared helpers of the benchmark scripts.
+"""
+import json
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "data")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+# signed headers captured from a signify-ts integration run, the stub verifier accepts them
+AID = "EP4kdoVrDh4Mpzh2QbocUYIv4IjLZLDU367UO0b40f6x"
+LEI = "875500ELOZEL05BVXV37"
+SIGNED_HEADERS = {
+    "SIGNATURE": 'indexed="?0";signify="0BBbeeBw3lVmQWYBpcFH9KmRXZocrqLH_LZL4aqg5W9-NMdXqIYJ-Sao7colSTJOuYllMXFfggoMhkfpTKnvPhUF"',
+    "SIGNATURE-INPUT": 'signify=("@method" "@path" "signify-resource" "signify-timestamp");created=1714854033;keyid="BPoZo2b3r--lPBpURvEDyjyDkS65xBEpmpQhHQvrwlBE";alg="ed25519"',
+    "SIGNIFY-RESOURCE": AID,
+    "SIGNIFY-TIMESTAMP": "2024-05-04T20:20:33.730000+00:00",
+}
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of values (pct in 0-100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(name, latencies, elapsed, errors=0):
+    """
+    Throughput and latency percentiles (milliseconds) of a run.
+    """
+    count = len(latencies)
+    return {
+        "name": name,
+        "requests": count,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+def rate(name, count, elapsed):
+    """
+    Summary of a bulk operation where only the total time is known.
+    """
+    mean_ms = round(elapsed / count * 1000, 3) if count else 0.0
+    return {
+        "name": name,
+        "requests": count,
+        "errors": 0,
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": mean_ms,
+        "p99_ms": mean_ms,
+        "mean_ms": mean_ms,
+    }
+
+
+def print_results(results):
+    columns = ("name", "requests", "errors", "throughput", "p50_ms", "p99_ms", "mean_ms")
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result.get(c, "")).ljust(w) for c, w in zip(columns, widths)))
+
+
+def write_results(path, results):
+    if path:
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def check_thresholds(results, max_p99_ms=None, min_throughput=None):
+    """
+    Returns the failed thresholds, so CI can fail on a regression.
+    """
+    failures = []
+    for result in results:
+        if max_p99_ms is not None and result["p99_ms"] > max_p99_ms:
+            failures.append(f"{result['name']}: p99 {result['p99_ms']}ms > {max_p99_ms}ms")
+        if min_throughput is not None and result["throughput"] < min_throughput:
+            failures.append(f"{result['name']}: {result['throughput']}/s < {min_throughput}/s")
+        if result.get("errors"):
+            failures.append(f"{result['name']}: {result['errors']} errors")
+    return failures
@@ -0,0 +1,208 @@
+"""
+End-to-end load generator. Starts the stub verifier/filer and the API (or targets a
+running API with --url), drives each scenario with concurrent clients and reports
+throughput and p50/p99 latency.
+
+    python benchmarks/load.py --scenarios ping,checklogin,status,upload \
+        --concurrency 50 --requests 5000 --stub-latency-ms 20 --workers 2
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import common
+from common import AID, DATA, ROOT, SIGNED_HEADERS, summarize
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, process, timeout=30):
+    expires = time.monotonic() + timeout
+    while time.monotonic() < expires:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def start_services(args):
+    """
+    Start the stub services and the API as subprocesses, returns the API url and the
+    processes to stop.
+    """
+    stub_port = free_port()
+    stub_cmd = [sys.executable, os.path.join(HERE, "stub_services.py"), "--port", str(stub_port)]
+    stub_cmd += args.stub_args
+    stub = subprocess.Popen(stub_cmd)
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    wait_ready(f"{stub_url}/docs", stub)
+
+    api_port = free_port()
+    env = dict(os.environ)
+    env.update(
+        PYTHONPATH=os.path.join(ROOT, "src"),
+        LOG_LEVEL=env.get("LOG_LEVEL", "WARNING"),
+        VERIFIER_AUTHORIZATIONS=f"{stub_url}/authorizations/",
+        VERIFIER_PRESENTATIONS=f"{stub_url}/presentations/",
+        VERIFIER_REQUESTS=f"{stub_url}/request/verify/",
+        VERIFIER_ADD_ROT=f"{stub_url}/root_of_trust/",
+        FILER_REPORTS=f"{stub_url}/reports/",
+        FILER_ADMIN_UPLOAD_STATUSES=f"{stub_url}/admin/upload_statuses/",
+        FILER_UPLOAD_POLL_INITIAL_DELAY=env.get("FILER_UPLOAD_POLL_INITIAL_DELAY", "0.01"),
+    )
+    for item in args.api_env:
+        key, value = item.split("=", 1)
+        env[key] = value
+    if args.workers > 1 and env.get("REPORTS_DB_BACKEND", "memory").lower() == "memory":
+        # every worker must see the AID registered by the setup checklogin
+        env["REPORTS_DB_BACKEND"] = "sqlite"
+        env["REPORTS_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="regps-load-"), "reports.db")
+    api_cmd = [
+        sys.executable, "-m", "regps.app.cli.regps", "start",
+        "--host", "127.0.0.1", "--port", str(api_port), "--workers", str(args.workers),
+        "--no-access-log",
+    ]
+    api = subprocess.Popen(api_cmd, env=env)
+    api_url = f"http://127.0.0.1:{api_port}"
+    wait_ready(f"{api_url}/ping", api)
+    return api_url, [api, stub]
+
+
+def scenario_requests(name):
+    """
+    Returns a function building the (method, path, kwargs) of the i-th request.
+    """
+    if name == "ping":
+        return lambda i: ("GET", "/ping", {})
+    if name == "checklogin":
+        return lambda i: ("GET", f"/checklogin/{AID}", {"headers": SIGNED_HEADERS})
+    if name == "status":
+        return lambda i: ("GET", f"/status/{AID}", {"headers": SIGNED_HEADERS, "params": {"limit": 100}})
+    if name == "upload":
+        with open(os.path.join(DATA, "report.zip"), "rb") as f:
+            report = f.read()
+        run = uuid.uuid4().hex
+
+        def upload(i):
+            # unique content per request, so every upload goes through the filer
+            body = report + f"{run}-{i}".encode()
+            dig = f"sha256-{hashlib.sha256(body).hexdigest()}"
+            files = {"upload": ("report.zip", body, "application/zip")}
+            return "POST", f"/upload/{AID}/{dig}", {"headers": SIGNED_HEADERS, "files": files}
+
+        return upload
+    raise ValueError(f"Unknown scenario {name}")
+
+
+async def register_aid(url, workers, timeout):
+    """
+    Log the benchmark AID in before timing, uploads need its LEI in the reports db. New
+    connections are spread over the workers, so each one also has it cached.
+    """
+    for _ in range(max(workers, 1) * 4):
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            res = await client.get(f"/checklogin/{AID}", headers=SIGNED_HEADERS)
+        if not 200 <= res.status_code < 300:
+            raise RuntimeError(f"setup: checklogin answered {res.status_code} {res.text}")
+    # let the registration be committed before other workers read it
+    await asyncio.sleep(0.5)
+
+
+async def run_scenario(url, name, requests, concurrency, timeout):
+    build = scenario_requests(name)
+    latencies = []
+    errors = {"count": 0}
+    counter = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+
+        async def worker():
+            for i in counter:
+                method, path, kwargs = build(i)
+                start = time.perf_counter()
+                try:
+                    res = await client.request(method, path, **kwargs)
+                    ok = 200 <= res.status_code < 300
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors["count"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(name, latencies, elapsed, errors["count"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reg pilot api load generator")
+    parser.add_argument("--url", help="Target a running API instead of starting one with stubs")
+    parser.add_argument("--scenarios", default="ping,checklogin,status,upload")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=50, help="Requests per scenario before measuring")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=1, help="API workers when starting the API")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--stub-arg",
+        action="append",
+        default=[],
+        help="Option of the stub services, e.g. --stub-arg=--error-rate=0.01, repeatable",
+    )
+    parser.add_argument("--api-env", action="append", default=[], help="KEY=VALUE environment of the API")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail when any p99 is above")
+    parser.add_argument("--min-throughput", type=float, help="Fail when any throughput is below")
+    args = parser.parse_args()
+    args.stub_args = ["--latency-ms", str(args.stub_latency_ms)] + args.stub_arg
+
+    processes = []
+    try:
+        url = args.url
+        if url is None:
+            url, processes = start_services(args)
+        asyncio.run(register_aid(url, args.workers, args.timeout))
+        results = []
+        for name in args.scenarios.split(","):
+            if args.warmup:
+                asyncio.run(run_scenario(url, name, args.warmup, args.concurrency, args.timeout))
+            results.append(
+                asyncio.run(run_scenario(url, name, args.requests, args.concurrency, args.timeout))
+            )
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(10)
+
+    common.print_results(results)
+    common.write_results(args.json, results)
+    failures = common.check_thresholds(results, args.max_p99_ms, args.min_throughput)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
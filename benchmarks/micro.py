@@ -0,0 +1,224 @@
+"""
+Micro-benchmarks of the request hot path: signed header parsing, report digest
+verification and reports db operations.
+
+    python benchmarks/micro.py --sizes 10000,100000,1000000 --backends memory,sqlite
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import common
+from common import AID, DATA, SIGNED_HEADERS, summarize
+
+import fastapi
+from keri.end import ending
+from starlette.datastructures import Headers
+
+from regps.app.api.digest_verifier import verify_digest
+from regps.app.api.upload_stream import MultipartDigestTap
+from regps.app.api.signed_headers_verifier import VerifySignedHeaders, parse_signature_input
+from regps.app.api.utils.reports_db import ReportsDB
+from regps.app.api.utils.reports_store import MemoryReportsStore, SqliteReportsStore
+
+
+def timed(name, fn, iterations):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    return summarize(name, latencies, time.perf_counter() - start)
+
+
+async def atimed(name, fn, iterations):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(name, latencies, time.perf_counter() - start)
+
+
+def signed_requests(count):
+    """
+    Requests like a signify client sends them, each with its own created time.
+    """
+    requests = []
+    for i in range(count):
+        headers = dict(SIGNED_HEADERS)
+        headers["SIGNATURE-INPUT"] = headers["SIGNATURE-INPUT"].replace(
+            "created=1714854033", f"created={1714854033 + i}"
+        )
+        scope = dict(
+            type="http",
+            headers=Headers(headers).raw,
+            method="POST",
+            path=f"/upload/{AID}/sha256-00",
+        )
+        requests.append(fastapi.Request(scope))
+    return requests
+
+
+def bench_handle_headers(iterations):
+    requests = signed_requests(iterations)
+    it = iter(requests)
+
+    def uncached():
+        # the signature base built from a full Signature-Input parse on every request
+        req = next(it)
+        template, created = parse_signature_input(req.headers["SIGNATURE-INPUT"])
+        template.serialize(req, created)
+        ending.designature(req.headers["SIGNATURE"])
+
+    results = [timed("handle_headers uncached", uncached, iterations)]
+    it = iter(requests)
+    results.append(
+        timed("handle_headers", lambda: VerifySignedHeaders.handle_headers(next(it)), iterations)
+    )
+    return results
+
+
+def bench_verify_digest(iterations):
+    results = []
+    for path in sorted(glob.glob(os.path.join(DATA, "*.zip"))):
+        with open(path, "rb") as f:
+            report = f.read()
+        dig = f"sha256-{hashlib.sha256(report).hexdigest()}"
+        name = f"verify_digest {os.path.basename(path)} ({len(report)} bytes)"
+        results.append(timed(name, lambda: verify_digest(report, dig), iterations))
+    return results
+
+
+async def stream_uploads(uploads, size, threads):
+    """
+    Stream uploads concurrent reports of size bytes through the multipart digest tap.
+    """
+    boundary = "----regpsbench"
+    report = os.urandom(size)
+    dig = f"sha256-{hashlib.sha256(report).hexdigest()}"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"upload\"; filename=\"report.zip\"\r\n\r\n"
+    ).encode() + report + f"\r\n--{boundary}--\r\n".encode()
+    chunk = 64 * 1024
+
+    async def chunks():
+        for i in range(0, len(body), chunk):
+            yield body[i:i + chunk]
+            # let the other uploads receive, as they would from the network
+            await asyncio.sleep(0)
+
+    async def upload():
+        tap = MultipartDigestTap(f"multipart/form-data; boundary={boundary}", dig)
+        if not threads:
+            tap.hasher.thread_min_bytes = float("inf")
+        async for _ in tap.stream(chunks()):
+            pass
+
+    await asyncio.gather(*(upload() for _ in range(uploads)))
+
+
+def bench_concurrent_digests(uploads, size_mb):
+    results = []
+    for threads in (False, True):
+        start = time.perf_counter()
+        asyncio.run(stream_uploads(uploads, size_mb * 1024 * 1024, threads))
+        name = f"{uploads} concurrent {size_mb}MB uploads, hashing {'in threads' if threads else 'on the loop'}"
+        results.append(common.rate(name, uploads, time.perf_counter() - start))
+    return results
+
+
+def make_store(backend, directory):
+    if backend == "sqlite":
+        return SqliteReportsStore(path=os.path.join(directory, "bench.db"))
+    if backend == "redis":
+        from regps.app.api.utils.reports_store import RedisReportsStore
+
+        return RedisReportsStore(prefix=f"regps-bench-{os.getpid()}")
+    return MemoryReportsStore()
+
+
+async def bench_reports_db(backend, size, iterations):
+    """
+    Fill the db with size reports spread over 100 AIDs of 10 LEIs, then time the
+    operations the status and upload routes run.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db = ReportsDB(make_store(backend, directory))
+        aids = [f"EAID{i:040d}" for i in range(100)]
+        for i, aid in enumerate(aids):
+            await db.register_aid(aid, f"LEI{i % 10:017d}")
+        start = time.perf_counter()
+        for i in range(size):
+            await db.add_report(aids[i % 100], f"sha256-{i:064x}", {"status": "verified", "n": i})
+        await db.store.flush()
+        fill = time.perf_counter() - start
+        label = f"{backend} {size}"
+        results = [
+            common.rate(f"reports_db fill {label}", size, fill),
+            await atimed(
+                f"reports_db add_report {label}",
+                lambda i: db.add_report(aids[i % 100], f"sha256-new{i:060x}", {"n": i}),
+                iterations,
+            ),
+            await atimed(
+                f"reports_db authorized_to_check_status {label}",
+                lambda i: db.authorized_to_check_status(aids[i % 100], f"sha256-{i:064x}"),
+                iterations,
+            ),
+            await atimed(
+                f"reports_db status page {label}",
+                lambda i: db.get_reports_page(aids[i % 100], "aid", 0, 100),
+                iterations,
+            ),
+            await atimed(
+                f"reports_db lei status page {label}",
+                lambda i: db.get_reports_page(aids[i % 100], "lei", 0, 100),
+                iterations,
+            ),
+        ]
+        await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reg pilot api micro-benchmarks")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--sizes", default="10000,100000", help="Reports db sizes, e.g. 10000,100000,1000000")
+    parser.add_argument("--backends", default="memory,sqlite", help="Reports db backends: memory,sqlite,redis")
+    parser.add_argument("--uploads", type=int, default=8, help="Concurrent uploads of the digest benchmark")
+    parser.add_argument("--upload-mb", type=int, default=64, help="Report size of the digest benchmark")
+    parser.add_argument("--only", choices=["headers", "digest", "reports_db"], action="append")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail when any p99 is above")
+    args = parser.parse_args()
+
+    only = set(args.only or ["headers", "digest", "reports_db"])
+    results = []
+    if "headers" in only:
+        results += bench_handle_headers(args.iterations)
+    if "digest" in only:
+        results += bench_verify_digest(args.iterations)
+        results += bench_concurrent_digests(args.uploads, args.upload_mb)
+    if "reports_db" in only:
+        for backend in args.backends.split(","):
+            for size in (int(s) for s in args.sizes.split(",")):
+                results += asyncio.run(bench_reports_db(backend, size, args.iterations))
+
+    common.print_results(results)
+    common.write_results(args.json, results)
+    failures = common.check_thresholds(results, args.max_p99_ms)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
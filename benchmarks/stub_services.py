@@ -0,0 +1,252 @@
+"""
+Stand-in verifier and filer for load tests, speaking the same HTTP contracts as
+gleif/vlei-verifier and gleif/reg-pilot-filer, with tunable latency distributions,
+error injection and slow report ingestion.
+
+    python benchmarks/stub_services.py --port 7676 --latency lognormal:20,0.5 \
+        --endpoint-latency upload=uniform:50,200 --error-rate 0.01 \
+        --ingest-kbps 2048 --processing uniform:100,500
+
+Latency specs (milliseconds): fixed:MS, uniform:LOW,HIGH, normal:MEAN,STDDEV,
+lognormal:MEDIAN,SIGMA, exponential:MEAN. Endpoints: authorizations, presentations,
+verify, root_of_trust, upload, upload_status, upload_statuses.
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from dataclasses import dataclass, field
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+ENDPOINTS = (
+    "authorizations",
+    "presentations",
+    "verify",
+    "root_of_trust",
+    "upload",
+    "upload_status",
+    "upload_statuses",
+)
+
+
+class Latency:
+    """
+    Latency distribution parsed from a spec like "lognormal:20,0.5", sampled in seconds.
+    """
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p] or [0.0]
+        if kind not in ("fixed", "uniform", "normal", "lognormal", "exponential"):
+            raise ValueError(f"Unknown latency distribution {spec}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            ms = p[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            ms = random.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            ms = random.lognormvariate(math.log(p[0]), p[1]) if p[0] > 0 else 0.0
+        else:
+            ms = random.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+        return max(ms, 0.0) / 1000
+
+    def __repr__(self):
+        return f"Latency({self.spec})"
+
+
+@dataclass
+class StubConfig:
+    latency: Latency = field(default_factory=Latency)
+    endpoint_latency: dict = field(default_factory=dict)
+    error_rate: float = 0.0
+    endpoint_error_rate: dict = field(default_factory=dict)
+    error_status: int = 503
+    hang_rate: float = 0.0
+    hang_seconds: float = 60.0
+    # report ingestion speed in KiB/s, 0 reads the body as fast as it comes
+    ingest_kbps: float = 0.0
+    # time between the upload and its status becoming available (404 before)
+    processing: Latency = field(default_factory=Latency)
+
+
+class Faults:
+    """
+    Applies the configured latency and failures to an endpoint call, and counts calls.
+    """
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.calls = {name: 0 for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+
+    async def __call__(self, endpoint: str):
+        """
+        Wait the sampled latency, then returns an error response to send instead of the
+        normal one, or None.
+        """
+        config = self.config
+        self.calls[endpoint] += 1
+        if config.hang_rate and random.random() < config.hang_rate:
+            await asyncio.sleep(config.hang_seconds)
+        delay = config.endpoint_latency.get(endpoint, config.latency).sample()
+        if delay:
+            await asyncio.sleep(delay)
+        rate = config.endpoint_error_rate.get(endpoint, config.error_rate)
+        if rate and random.random() < rate:
+            self.errors[endpoint] += 1
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"msg": f"injected {endpoint} failure"},
+            )
+        return None
+
+
+def create_app(config: StubConfig = None) -> FastAPI:
+    config = config or StubConfig()
+    app = FastAPI(title="reg pilot stub verifier and filer")
+    faults = Faults(config)
+    app.state.faults = faults
+    uploads = {}
+
+    # verifier
+
+    @app.get("/authorizations/{aid}")
+    async def authorizations(aid: str):
+        if error := await faults("authorizations"):
+            return error
+        return JSONResponse(
+            status_code=200,
+            content={"aid": aid, "said": "EStubCredentialSaid", "lei": "875500ELOZEL05BVXV37"},
+        )
+
+    @app.put("/presentations/{said}")
+    async def presentations(said: str, request: Request):
+        await request.body()
+        if error := await faults("presentations"):
+            return error
+        return JSONResponse(status_code=202, content={"said": said, "msg": f"{said} is a valid credential"})
+
+    @app.post("/request/verify/{aid}")
+    async def verify(aid: str, sig: str = "", data: str = ""):
+        if error := await faults("verify"):
+            return error
+        if not sig or not data:
+            return JSONResponse(status_code=400, content={"msg": "request missing sig or data"})
+        return JSONResponse(status_code=202, content={"aid": aid, "msg": "Signature Valid"})
+
+    @app.post("/root_of_trust/{aid}")
+    async def root_of_trust(aid: str, request: Request):
+        await request.body()
+        if error := await faults("root_of_trust"):
+            return error
+        return JSONResponse(status_code=202, content={"aid": aid, "msg": "Successfully added root of trust"})
+
+    # filer
+
+    @app.post("/reports/{aid}/{dig}")
+    async def upload(aid: str, dig: str, request: Request):
+        size = 0
+        start = time.monotonic()
+        rate = config.ingest_kbps * 1024
+        async for chunk in request.stream():
+            size += len(chunk)
+            if rate:
+                # throttle to the ingest rate
+                ahead = size / rate - (time.monotonic() - start)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        if error := await faults("upload"):
+            return error
+        uploads[(aid, dig)] = (
+            time.monotonic() + config.processing.sample(),
+            {
+                "submitter": aid,
+                "filename": "report.zip",
+                "status": "verified",
+                "contentType": "application/zip",
+                "size": size,
+                "message": "All 1 files in report package have been signed by submitter",
+            },
+        )
+        return JSONResponse(status_code=200, content={"submitter": aid, "dig": dig, "msg": "uploaded"})
+
+    @app.get("/reports/{aid}/{dig}")
+    async def upload_status(aid: str, dig: str):
+        if error := await faults("upload_status"):
+            return error
+        upload = uploads.get((aid, dig))
+        if upload is None or upload[0] > time.monotonic():
+            return JSONResponse(status_code=404, content={"msg": f"upload status not found for {dig}"})
+        return JSONResponse(status_code=200, content=upload[1])
+
+    @app.get("/admin/upload_statuses/{aid}/{lei}")
+    async def upload_statuses(aid: str, lei: str):
+        if error := await faults("upload_statuses"):
+            return error
+        now = time.monotonic()
+        return JSONResponse(status_code=200, content=[s for ready, s in uploads.values() if ready <= now])
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {"calls": faults.calls, "errors": faults.errors, "uploads": len(uploads)}
+
+    return app
+
+
+def _endpoint_values(items, parse):
+    values = {}
+    for item in items:
+        name, value = item.split("=", 1)
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name}, expected one of {', '.join(ENDPOINTS)}")
+        values[name] = parse(value)
+    return values
+
+
+def config_from_args(args) -> StubConfig:
+    latency = Latency(args.latency)
+    if args.latency_ms:
+        latency = Latency(f"fixed:{args.latency_ms}")
+    return StubConfig(
+        latency=latency,
+        endpoint_latency=_endpoint_values(args.endpoint_latency, Latency),
+        error_rate=args.error_rate,
+        endpoint_error_rate=_endpoint_values(args.endpoint_error_rate, float),
+        error_status=args.error_status,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        ingest_kbps=args.ingest_kbps,
+        processing=Latency(args.processing),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub verifier and filer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7676)
+    parser.add_argument("--latency", default="fixed:0", help="Latency of every endpoint, e.g. lognormal:20,0.5")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Shortcut for --latency fixed:MS")
+    parser.add_argument("--endpoint-latency", action="append", default=[], help="ENDPOINT=SPEC, repeatable")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with --error-status")
+    parser.add_argument("--endpoint-error-rate", action="append", default=[], help="ENDPOINT=RATE, repeatable")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of calls that hang for --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--ingest-kbps", type=float, default=0.0, help="Report ingestion speed in KiB/s, 0 is unthrottled")
+    parser.add_argument("--processing", default="fixed:0", help="Delay before an upload status is available")
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
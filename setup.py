@@ -81,16 +81,21 @@ setup(
         "keri==1.2.0-dev12",
         "fastapi>=0.111.1",
         "requests>=2.32.3",
-        "python-multipart"
+        "httpx>=0.27.0",
+        "python-multipart",
+        "multicommand>=1.0.0",
     ],
     extras_require={
         # eg:
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
+        "redis": ["redis>=5.0.1"],
+        "speedups": ["uvloop>=0.19.0", "httptools>=0.6.0", "blake3>=0.4.0"],
     },
     tests_require=[
         "coverage>=5.5",
         "pytest>=6.2.4",
+        "fakeredis>=2.20.0",
     ],
     setup_requires=[],
     entry_points={
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures so calls fail fast, lets
+    half_open_calls trial calls through after reset_timeout seconds and closes again
+    when they succeed.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, half_open_calls: int = 1, timer=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.timer = timer
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if self.timer() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self.trials = 0
+        if self.state == HALF_OPEN:
+            if self.trials >= self.half_open_calls:
+                return False
+            self.trials += 1
+        return True
+
+    def release_trial(self):
+        """
+        Give back a half open trial slot taken by a call that never got an answer.
+        """
+        if self.state == HALF_OPEN and self.trials > 0:
+            self.trials -= 1
+
+    def retry_after(self) -> float:
+        return max(self.reset_timeout - (self.timer() - self.opened_at), 0.0)
+
+    def record_success(self):
+        self.failures = 0
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = self.timer()
+
+
+class BulkheadFull(Exception):
+    pass
+
+
+class Bulkhead:
+    """
+    Limits the concurrent calls to one upstream. At most max_queue callers wait for a
+    slot, for at most queue_timeout seconds; others are rejected right away.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = None
+        self._loop = None
+
+    def _sem(self):
+        # semaphores are bound to the event loop that first waits on them
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            self.active = 0
+            self.waiting = 0
+        return self._semaphore
+
+    async def acquire(self):
+        sem = self._sem()
+        if sem.locked():
+            if self.waiting >= self.max_queue:
+                raise BulkheadFull()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(sem.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise BulkheadFull()
+            finally:
+                self.waiting -= 1
+        else:
+            await sem.acquire()
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+
+class LatencyTracker:
+    """
+    Recent call latencies of an operation, to derive a timeout from their percentile.
+    """
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def __len__(self):
+        return len(self.samples)
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+import httpx
+
+from regps.app.adapters.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Bulkhead,
+    BulkheadFull,
+    CircuitBreaker,
+    LatencyTracker,
+)
+from regps.app.api.exceptions import UpstreamUnavailableException
+from regps.app.api.utils.metrics import (
+    UPSTREAM_BREAKER_STATE,
+    UPSTREAM_BREAKER_TRIPS,
+    UPSTREAM_ERRORS,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_REJECTED,
+    UPSTREAM_REQUEST_SECONDS,
+    UPSTREAM_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamClient:
+    """
+    Persistent, connection-pooled async HTTP client for a single upstream service.
+
+    Pool sizes and timeouts are read from environment variables prefixed with the
+    upstream name, e.g. VERIFIER_MAX_CONNECTIONS or FILER_TIMEOUT.
+
+    Each upstream is its own bulkhead (at most MAX_CONCURRENCY calls, MAX_QUEUE waiting)
+    behind a circuit breaker, so a slow or failing filer can't take the verifier calls
+    down with it. The read timeout of an operation follows its observed latency:
+    TIMEOUT_MULTIPLIER times the TIMEOUT_PERCENTILE, between TIMEOUT_MIN and TIMEOUT.
+    """
+
+    BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, transport: httpx.AsyncBaseTransport = None):
+        self.name = name
+        prefix = name.upper()
+        self.limits = httpx.Limits(
+            max_connections=int(os.environ.get(f"{prefix}_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(
+                os.environ.get(f"{prefix}_MAX_KEEPALIVE_CONNECTIONS", 20)
+            ),
+            keepalive_expiry=float(os.environ.get(f"{prefix}_KEEPALIVE_EXPIRY", 30)),
+        )
+        self.timeout = httpx.Timeout(
+            float(os.environ.get(f"{prefix}_TIMEOUT", 30)),
+            connect=float(os.environ.get(f"{prefix}_CONNECT_TIMEOUT", 5)),
+            pool=float(os.environ.get(f"{prefix}_POOL_TIMEOUT", 10)),
+        )
+        self.bulkhead = Bulkhead(
+            max_concurrency=int(
+                os.environ.get(f"{prefix}_MAX_CONCURRENCY", self.limits.max_connections)
+            ),
+            max_queue=int(os.environ.get(f"{prefix}_MAX_QUEUE", 100)),
+            queue_timeout=float(
+                os.environ.get(f"{prefix}_QUEUE_TIMEOUT", self.timeout.pool)
+            ),
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.environ.get(f"{prefix}_BREAKER_FAILURES", 5)),
+            reset_timeout=float(os.environ.get(f"{prefix}_BREAKER_RESET", 30)),
+        )
+        self.adaptive_timeout = os.environ.get(
+            f"{prefix}_ADAPTIVE_TIMEOUT", "true"
+        ).lower() in ("true", "1", "yes")
+        self.timeout_percentile = float(os.environ.get(f"{prefix}_TIMEOUT_PERCENTILE", 99))
+        self.timeout_multiplier = float(os.environ.get(f"{prefix}_TIMEOUT_MULTIPLIER", 3))
+        self.timeout_min = float(os.environ.get(f"{prefix}_TIMEOUT_MIN", 1))
+        self.timeout_min_samples = int(os.environ.get(f"{prefix}_TIMEOUT_MIN_SAMPLES", 20))
+        self.latencies = {}
+        UPSTREAM_BREAKER_STATE.set(0, upstream=name)
+        self.transport = transport
+        self._client: httpx.AsyncClient = None
+        self._loop = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Opened lazily so the adapters also work when the app lifespan is not run.
+        # Pooled connections are bound to the event loop that opened them.
+        if (
+            self._client is None
+            or self._client.is_closed
+            or self._loop is not _running_loop()
+        ):
+            self._client = None
+            self.open()
+        return self._client
+
+    def open(self):
+        if self._client is None or self._client.is_closed:
+            logger.info("opening %s connection pool %s", self.name, self.limits)
+            self._client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, transport=self.transport
+            )
+            self._loop = _running_loop()
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            logger.info("closing %s connection pool", self.name)
+            await self._client.aclose()
+        self._client = None
+
+    def read_timeout(self, operation: str) -> float:
+        """
+        Read timeout of the next call of the operation, the configured TIMEOUT until
+        enough latencies were observed.
+        """
+        configured = self.timeout.read
+        tracker = self.latencies.get(operation)
+        if not self.adaptive_timeout or tracker is None or len(tracker) < self.timeout_min_samples:
+            return configured
+        derived = tracker.percentile(self.timeout_percentile) * self.timeout_multiplier
+        return min(max(derived, self.timeout_min), configured)
+
+    def _set_breaker_state(self):
+        UPSTREAM_BREAKER_STATE.set(self.BREAKER_STATES[self.breaker.state], upstream=self.name)
+
+    def _reject(self, reason: str, detail: str, retry_after: float):
+        UPSTREAM_REJECTED.inc(upstream=self.name, reason=reason)
+        logger.warning("%s call rejected: %s", self.name, detail)
+        raise UpstreamUnavailableException(
+            {"msg": detail, "retry_after": retry_after}, retry_after=retry_after
+        )
+
+    async def request(
+        self, method: str, url: str, operation: str = "", adaptive_timeout: bool = True, **kwargs
+    ) -> httpx.Response:
+        """
+        Send a request on the pool, recording its latency and errors under the operation
+        name (e.g. check_login) since upstream URLs embed AIDs and digests.
+
+        adaptive_timeout=False keeps the configured TIMEOUT for calls whose latency depends
+        on their payload, e.g. report uploads, rather than on how the upstream is doing.
+
+        Raises UpstreamUnavailableException without calling the upstream when its breaker
+        is open or its bulkhead is full, and when the call times out or fails to connect.
+        """
+        labels = {"upstream": self.name, "operation": operation}
+        if not self.breaker.allow():
+            self._reject(
+                "breaker",
+                f"{self.name} is unavailable, retry later",
+                math.ceil(self.breaker.retry_after()),
+            )
+        self._set_breaker_state()
+        try:
+            await self.bulkhead.acquire()
+        except BulkheadFull:
+            # a trial call that never ran must not keep the breaker half open
+            self.breaker.release_trial()
+            self._reject("bulkhead", f"{self.name} is overloaded, retry later", 1)
+        try:
+            res = await self._send(method, url, labels, adaptive_timeout, kwargs)
+        except BaseException:
+            self.breaker.release_trial()
+            raise
+        finally:
+            self.bulkhead.release()
+        return res
+
+    async def _send(self, method, url, labels, adaptive_timeout, kwargs):
+        operation = labels["operation"]
+        # the half open trial call gets the configured TIMEOUT, the upstream may have
+        # become slower than the latency derived timeout and must be able to recover
+        adaptive_timeout = adaptive_timeout and self.breaker.state != HALF_OPEN
+        read = None
+        if "timeout" not in kwargs:
+            read = self.read_timeout(operation) if adaptive_timeout else self.timeout.read
+            UPSTREAM_TIMEOUT.set(read, **labels)
+            kwargs["timeout"] = httpx.Timeout(
+                read, connect=self.timeout.connect, pool=self.timeout.pool, write=self.timeout.write
+            )
+        start = time.perf_counter()
+        with UPSTREAM_IN_FLIGHT.track(upstream=self.name), UPSTREAM_REQUEST_SECONDS.time(
+            method=method, **labels
+        ):
+            try:
+                res = await self.client.request(method, url, **kwargs)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                UPSTREAM_ERRORS.inc(status="error", **labels)
+                if adaptive_timeout and read is not None and isinstance(e, httpx.TimeoutException):
+                    # the call took at least the timeout, so the derived timeout grows
+                    # with the latency instead of staying at the old fast samples
+                    self.latencies.setdefault(operation, LatencyTracker()).observe(read)
+                self._record_failure()
+                raise UpstreamUnavailableException(
+                    {"msg": f"{self.name} {operation or method} failed: {type(e).__name__}"},
+                    retry_after=1,
+                ) from e
+            except httpx.HTTPError:
+                UPSTREAM_ERRORS.inc(status="error", **labels)
+                raise
+        if res.status_code >= 400:
+            UPSTREAM_ERRORS.inc(status=res.status_code, **labels)
+        if res.status_code >= 500:
+            self._record_failure()
+        else:
+            self.breaker.record_success()
+            self._set_breaker_state()
+            if adaptive_timeout:
+                self.latencies.setdefault(operation, LatencyTracker()).observe(
+                    time.perf_counter() - start
+                )
+        return res
+
+    def _record_failure(self):
+        was_open = self.breaker.state == OPEN
+        self.breaker.record_failure()
+        if self.breaker.state == OPEN and not was_open:
+            UPSTREAM_BREAKER_TRIPS.inc(upstream=self.name)
+            logger.warning(
+                "%s circuit opened after %s failures", self.name, self.breaker.failures
+            )
+        self._set_breaker_state()
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
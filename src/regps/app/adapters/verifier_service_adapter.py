@@ -1,23 +1,18 @@
-from time import sleep
-import json
+import asyncio
 import logging
 import os
-import requests
-import sys
+import httpx
 
-# Create a logger object.
-logger = logging.getLogger(__name__)
-
-# Configure the logger to write messages to stdout.
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
+from regps.app.adapters.upstream_client import UpstreamClient
+from regps.app.api.utils.logging_config import Preview
+from regps.app.api.utils.metrics import STAGE_SECONDS
 
-# Set the log level to include all messages.
-logger.setLevel(logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 
 class VerifierServiceAdapter:
-    def __init__(self):
+    def __init__(self, transport: httpx.AsyncBaseTransport = None):
+        self.client = UpstreamClient("verifier", transport)
         # TODO: take only base url for the verifier service from the environment variable
         self.auths_url = os.environ.get(
             "VERIFIER_AUTHORIZATIONS", "http://127.0.0.1:7676/authorizations/"
@@ -34,108 +29,161 @@ class VerifierServiceAdapter:
         self.add_rot_url = os.environ.get(
             "VERIFIER_ADD_ROT", "http://localhost:7676/root_of_trust/"
         )
+        # Optional OOBI url template, e.g. http://witness:5642/oobi/{aid}, to resolve key state
+        self.key_state_oobi_url = os.environ.get("KEY_STATE_OOBI_URL")
+
+    async def aclose(self):
+        await self.client.aclose()
 
-    def check_login_request(self, aid: str) -> requests.Response:
-        logger.info(f"checking login: {aid}")
-        logger.info(f"getting from {self.auths_url}{aid}")
-        res = requests.get(
-            f"{self.auths_url}{aid}", headers={"Content-Type": "application/json"}
+    async def check_login_request(self, aid: str) -> httpx.Response:
+        logger.debug("checking login: %s", aid)
+        res = await self.client.get(
+            f"{self.auths_url}{aid}",
+            headers={"Content-Type": "application/json"},
+            operation="check_login",
         )
-        logger.info(f"login status: {json.dumps(res.json())}")
+        logger.debug("login status: %s", Preview(res))
         return res
 
-    def verify_vlei_request(self, said: str, vlei: str) -> requests.Response:
-        logger.info(f"Verify vlei task started {said} {vlei[:50]}")
-        logger.info(f"presenting vlei ecr to url {self.presentations_url}{said}")
-        res = requests.put(
+    async def verify_vlei_request(self, said: str, vlei: str) -> httpx.Response:
+        logger.info("Verify vlei task started %s %s", said, Preview(vlei, 50))
+        res = await self.client.put(
             f"{self.presentations_url}{said}",
             headers={"Content-Type": "application/json+cesr"},
-            data=vlei,
+            content=vlei,
+            operation="verify_vlei",
         )
-        logger.info(f"verify vlei task response {json.dumps(res.json())}")
+        logger.info("verify vlei task response %s", Preview(res))
         return res
 
-    def verify_cig_request(self, aid, cig, ser) -> requests.Response:
-        logger.info(
-            "Verify header sig started aid = {}, cig = {}, ser = {}....".format(
-                aid, cig, ser
-            )
+    async def verify_cig_request(self, aid, cig, ser) -> httpx.Response:
+        logger.debug("Verify header sig started aid = %s, cig = %s, ser = %s", aid, cig, ser)
+        res = await self.client.post(
+            self.request_url + aid, params={"sig": cig, "data": ser}, operation="verify_cig"
         )
-        logger.info("posting to {}".format(self.request_url + f"{aid}"))
-        res = requests.post(self.request_url + aid, params={"sig": cig, "data": ser})
-        logger.info(f"Verify sig response {json.dumps(res.json())}")
+        logger.debug("Verify sig response %s", Preview(res))
         return res
 
-    def add_root_of_trust_request(self, aid, vlei, oobi) -> requests.Response:
-        logger.info("Add root of trust request")
-        logger.info(f"Posting to {self.add_rot_url}{aid}")
+    async def add_root_of_trust_request(self, aid, vlei, oobi) -> httpx.Response:
+        logger.info("Add root of trust request for %s", aid)
         data = {
             "vlei": vlei,
             "oobi": oobi
         }
-        res = requests.post(f"{self.add_rot_url}{aid}", headers={"Content-Type": "application/json"}, json=data)
-        logger.info(f"Add root of trust response {json.dumps(res.json())}")
+        res = await self.client.post(f"{self.add_rot_url}{aid}", headers={"Content-Type": "application/json"}, json=data, operation="add_root_of_trust")
+        logger.info("Add root of trust response %s", Preview(res))
+        return res
+
+
+    async def key_state_oobi_request(self, aid: str) -> httpx.Response:
+        url = self.key_state_oobi_url.format(aid=aid)
+        logger.debug("Resolving key state for %s from %s", aid, url)
+        res = await self.client.get(
+            url, headers={"Accept": "application/json+cesr"}, operation="key_state_oobi"
+        )
+        logger.debug("Key state OOBI response %s", res.status_code)
         return res
 
 
 class FilerServiceAdapter:
-    def __init__(self):
+    def __init__(self, transport: httpx.AsyncBaseTransport = None):
+        self.client = UpstreamClient("filer", transport)
         self.reports_url = os.environ.get(
             "FILER_REPORTS", "http://localhost:7878/reports/"
         )
         self.upload_statuses_admin_url = os.environ.get(
             "FILER_ADMIN_UPLOAD_STATUSES", "http://localhost:7878/admin/upload_statuses/"
         )
+        # Upload confirmation polling: exponential backoff bounded by a deadline
+        self.poll_initial_delay = float(
+            os.environ.get("FILER_UPLOAD_POLL_INITIAL_DELAY", 0.25)
+        )
+        self.poll_max_delay = float(os.environ.get("FILER_UPLOAD_POLL_MAX_DELAY", 2))
+        self.poll_deadline = float(os.environ.get("FILER_UPLOAD_POLL_DEADLINE", 10))
 
+    async def aclose(self):
+        await self.client.aclose()
 
-    def upload_statuses_admin_request(self, aid: str, lei: str="") -> requests.Response:
-        logger.info(f"checking upload statuses by Data Admin: aid {aid} and dig {lei}")
-        logger.info(f"getting from {self.upload_statuses_admin_url}{aid}/{lei}")
-        res = requests.get(
+    async def upload_statuses_admin_request(self, aid: str, lei: str="") -> httpx.Response:
+        logger.debug("checking upload statuses by Data Admin: aid %s and lei %s", aid, lei)
+        res = await self.client.get(
             f"{self.upload_statuses_admin_url}{aid}/{lei}",
             headers={"Content-Type": "application/json"},
+            operation="upload_statuses_admin",
         )
-        logger.info(f"upload statuses: {json.dumps(res.json())}")
+        logger.debug("upload statuses: %s", Preview(res))
         return res
 
-    def check_upload_request(self, aid: str, dig: str) -> requests.Response:
-        logger.info(f"checking upload: aid {aid} and dig {dig}")
-        logger.info(f"getting from {self.reports_url}{aid}/{dig}")
-        res = requests.get(
+    async def check_upload_request(self, aid: str, dig: str) -> httpx.Response:
+        logger.debug("checking upload: aid %s and dig %s", aid, dig)
+        res = await self.client.get(
             f"{self.reports_url}{aid}/{dig}",
             headers={"Content-Type": "application/json"},
+            operation="check_upload",
         )
-        logger.info(f"upload status: {json.dumps(res.json())}")
+        logger.debug("upload status: %s", Preview(res))
         return res
 
-    def upload_request(
-        self, aid: str, dig: str, contype: str, report
-    ) -> requests.Response:
-        logger.info(f"upload report type {type(report)}")
+    async def upload_request(
+        self, aid: str, dig: str, contype: str, report, wait: bool = True, content_length=None
+    ) -> httpx.Response:
+        """
+        Post the report to the filer. The report may be bytes or an async iterator of
+        chunks, in which case it is streamed. When wait is False the 202 accepted response
+        is returned as soon as the filer accepts the body, without waiting for the upload
+        status to be confirmed.
+        """
         # first check to see if we've already uploaded
-        cres = self.check_upload_request(aid, dig)
+        cres = await self.check_upload_request(aid, dig)
         if cres.status_code == 200:
-            logger.info(f"upload already uploaded: {json.dumps(cres.json())}")
+            logger.info("upload already uploaded: %s", Preview(cres))
             return cres
         else:
-            logger.info(f"upload posting to {self.reports_url}{aid}/{dig}")
-            cres = requests.post(
+            logger.debug("upload posting %s %s", aid, dig)
+            headers = {"Content-Type": contype}
+            if content_length is not None:
+                headers["Content-Length"] = str(content_length)
+            cres = await self.client.post(
                 f"{self.reports_url}{aid}/{dig}",
-                headers={"Content-Type": contype},
-                data=report,
+                headers=headers,
+                content=report,
+                operation="upload",
+                # upload latency grows with the report size and filer ingest time
+                adaptive_timeout=False,
             )
-            logger.info(f"post response {json.dumps(cres.json())}")
+            logger.debug("post response %s", Preview(cres))
             if cres.status_code < 300:
-                cres = self.check_upload_request(aid, dig)
-                if cres.status_code != 200:
-                    logger.info(f"Checking upload status.... {json.dumps(cres.json())}")
-                    for i in range(10):
-                        if cres is None or cres.status_code == 404:
-                            cres = self.check_upload_request(aid, dig)
-                            print(f"polling result for {aid} and {dig}: {cres.text}")
-                            sleep(1)
-                            i += 1
-                        else:
-                            break
-        logger.info(f"Checked upload result: {json.dumps(cres.json())}")
+                if not wait:
+                    return httpx.Response(
+                        202,
+                        json={"submitter": aid, "dig": dig, "status": "accepted"},
+                        request=cres.request,
+                    )
+                cres = await self.wait_for_upload(aid, dig)
+        logger.info("Checked upload result: %s", Preview(cres))
+        return cres
+
+    async def wait_for_upload(
+        self, aid: str, dig: str, deadline: float = None
+    ) -> httpx.Response:
+        """
+        Poll the filer until the upload status is available or the deadline (seconds) passes.
+        """
+        with STAGE_SECONDS.time(stage="filer_poll"):
+            return await self._wait_for_upload(aid, dig, deadline)
+
+    async def _wait_for_upload(self, aid: str, dig: str, deadline: float = None):
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + (self.poll_deadline if deadline is None else deadline)
+        delay = self.poll_initial_delay
+        cres = await self.check_upload_request(aid, dig)
+        while cres.status_code == 404:
+            remaining = expires - loop.time()
+            if remaining <= 0:
+                logger.info("upload status for %s and %s not confirmed before deadline", aid, dig)
+                break
+            logger.debug("polling upload status for %s and %s in %ss", aid, dig, delay)
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.poll_max_delay)
+            cres = await self.check_upload_request(aid, dig)
         return cres
@@ -1,71 +1,259 @@
-import requests
+import asyncio
+import logging
+import os
+import httpx
 from regps.app.adapters.verifier_service_adapter import VerifierServiceAdapter, FilerServiceAdapter
 from regps.app.api.exceptions import (
     VerifierServiceException,
-    DigestVerificationFailedException,
 )
-from regps.app.api.digest_verifier import verify_digest
+from regps.app.api.key_state import KeyStateCache
+from regps.app.api import upload_stream
+from regps.app.api.upload_stream import MultipartDigestTap, UploadMemoryBudget, UploadSpool
+from regps.app.api.utils.metrics import UPSTREAM_COALESCED
+from regps.app.api.utils.single_flight import SingleFlight
+from regps.app.api.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 
 class APIController:
     def __init__(self):
         self.verifier_adapter = VerifierServiceAdapter()
         self.filer_adapter = FilerServiceAdapter()
-
-    def check_login(self, aid: str):
-        verifier_response: requests.Response = (
-            self.verifier_adapter.check_login_request(aid)
+        # "local" verifies signed headers against cached key state and only calls the
+        # verifier on a cache miss or key rotation; "remote" always calls the verifier
+        self.local_verification = (
+            os.environ.get("SIGNED_HEADERS_VERIFICATION", "remote").lower() == "local"
         )
-        if verifier_response.status_code != 200:
-            raise VerifierServiceException(
-                verifier_response.json(), verifier_response.status_code
+        self.key_states = KeyStateCache()
+        # check login results by AID: successful logins are kept for the TTL and
+        # failures (e.g. login still pending) only for the short negative TTL. A
+        # revocation only invalidates the entry in the worker that presented it, so
+        # with several workers the default TTL is short
+        workers = int(os.environ.get("REGPS_WORKERS", 1))
+        self.login_cache = TTLCache(
+            float(os.environ.get("CHECK_LOGIN_CACHE_TTL", 60 if workers <= 1 else 5)),
+            int(os.environ.get("CHECK_LOGIN_CACHE_SIZE", 10000)),
+        )
+        self.login_negative_ttl = float(os.environ.get("CHECK_LOGIN_NEGATIVE_TTL", 2))
+        # the verifier processes revocations asynchronously: a check login answered
+        # while it does may still be authorized, so it isn't cached for this long
+        self.revocations = TTLCache(
+            float(os.environ.get("CHECK_LOGIN_REVOCATION_GRACE", 30)),
+            int(os.environ.get("CHECK_LOGIN_CACHE_SIZE", 10000)),
+        )
+        # identical concurrent check login, check upload and upload statuses calls share
+        # one upstream call
+        self.in_flight = SingleFlight()
+        self.upload_budget = UploadMemoryBudget()
+        self.upload_status_batch_concurrency = int(
+            os.environ.get("UPLOAD_STATUS_BATCH_CONCURRENCY", 10)
+        )
+        self.batch_concurrency = int(os.environ.get("BATCH_CONCURRENCY", 20))
+
+    def open(self):
+        self.verifier_adapter.client.open()
+        self.filer_adapter.client.open()
+
+    async def aclose(self):
+        await self.verifier_adapter.aclose()
+        await self.filer_adapter.aclose()
+        self.key_states.close()
+
+    async def coalesce(self, upstream: str, operation: str, key, fn):
+        """
+        Run fn, or share the result of the identical call already in flight.
+        """
+        key = (operation, key)
+        if self.in_flight.pending(key):
+            UPSTREAM_COALESCED.inc(upstream=upstream, operation=operation)
+        return await self.in_flight.do(key, fn)
+
+    async def check_login(self, aid: str):
+        cached = self.login_cache.get(aid)
+        if cached is None:
+            cached = await self.coalesce(
+                "verifier", "check_login", aid, lambda: self._check_login(aid)
             )
-        return verifier_response.json()
+        status_code, body = cached
+        if status_code != 200:
+            raise VerifierServiceException(body, status_code)
+        return body
+
+    async def _check_login(self, aid: str):
+        verifier_response: httpx.Response = (
+            await self.verifier_adapter.check_login_request(aid)
+        )
+        cached = (verifier_response.status_code, verifier_response.json())
+        if verifier_response.status_code == 200:
+            if aid in self.revocations:
+                return cached
+            self.login_cache.set(aid, cached)
+            if self.local_verification:
+                self.key_states.update_from_authorization(aid, cached[1])
+        elif verifier_response.status_code < 500:
+            self.login_cache.set(aid, cached, self.login_negative_ttl)
+        return cached
 
-    def login(self, said: str, vlei: str):
-        verifier_response = self.verifier_adapter.verify_vlei_request(said, vlei)
+    def invalidate_login(self, aid: str):
+        self.login_cache.pop(aid)
+        self.revocations.set(aid, True)
+        self.key_states.invalidate(aid)
+
+    def _login_authorized(self, aid: str) -> bool:
+        cached = self.login_cache.peek(aid)
+        return cached is not None and cached[0] == 200
+
+    def cache_stats(self):
+        return {
+            "check_login": self.login_cache.stats(),
+            "key_state": self.key_states.keys.stats(),
+        }
+
+    async def login(self, said: str, vlei: str):
+        verifier_response = await self.verifier_adapter.verify_vlei_request(said, vlei)
         if verifier_response.status_code != 202:
             raise VerifierServiceException(
                 verifier_response.json(), verifier_response.status_code
             )
         return verifier_response.json()
 
-    def add_root_of_trust(self, aid, vlei, oobi):
-        verifier_response = self.verifier_adapter.add_root_of_trust_request(aid, vlei, oobi)
+    async def add_root_of_trust(self, aid, vlei, oobi):
+        verifier_response = await self.verifier_adapter.add_root_of_trust_request(aid, vlei, oobi)
         if verifier_response.status_code != 202:
             raise VerifierServiceException(
                 verifier_response.json(), verifier_response.status_code
             )
         return verifier_response.json()
 
-    def verify_cig(self, aid, cig, ser):
-        verifier_response = self.verifier_adapter.verify_cig_request(aid, cig, ser)
+    async def fan_out(self, calls):
+        """
+        Run the calls concurrently, at most BATCH_CONCURRENCY at a time, and yield
+        (index, status code, body) for each as it completes. A failed call yields its
+        error, it doesn't stop the others. Calls still pending are cancelled when the
+        consumer goes away.
+        """
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def run(index, call):
+            async with semaphore:
+                try:
+                    return index, 202, await call()
+                except VerifierServiceException as e:
+                    return index, e.status_code, e.detail
+                except Exception as e:
+                    logger.error(f"Batch item {index}: Exception: {e}")
+                    return index, 500, str(e)
+
+        tasks = [asyncio.ensure_future(run(index, call)) for index, call in enumerate(calls)]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def verify_cig(self, aid, cig, ser, keyid=None):
+        # cached key state is only trusted while the AID has a live authorized login, so
+        # a revoked AID goes back to the verifier
+        if self.local_verification and keyid is not None and self._login_authorized(aid):
+            verified = self.key_states.verify(aid, keyid, cig, ser)
+            if verified is None and await self.resolve_key_state(aid):
+                verified = self.key_states.verify(aid, keyid, cig, ser)
+            if verified is True:
+                return {"aid": aid, "msg": "Signature Valid"}
+            if verified is False:
+                raise VerifierServiceException(
+                    {"msg": f"Signature for {aid} is invalid"}, 401
+                )
+        verifier_response = await self.verifier_adapter.verify_cig_request(aid, cig, ser)
         if verifier_response.status_code != 202:
             raise VerifierServiceException(
                 verifier_response.json(), verifier_response.status_code
             )
+        if self.local_verification and keyid is not None:
+            self.key_states.learn(aid, keyid, cig, ser)
         return verifier_response.json()
 
-    def check_upload(self, aid: str, dig: str):
-        verifier_response = self.filer_adapter.check_upload_request(aid, dig)
+    async def resolve_key_state(self, aid) -> bool:
+        if not self.verifier_adapter.key_state_oobi_url:
+            return False
+        res = await self.verifier_adapter.key_state_oobi_request(aid)
+        if res.status_code != 200:
+            return False
+        await self.key_states.resolve_kel(aid, res.content)
+        return self.key_states.get(aid) is not None
+
+    async def check_upload(self, aid: str, dig: str):
+        verifier_response = await self.coalesce(
+            "filer",
+            "check_upload",
+            (aid, dig),
+            lambda: self.filer_adapter.check_upload_request(aid, dig),
+        )
         if verifier_response.status_code != 200:
             raise VerifierServiceException(
                 verifier_response.json(), verifier_response.status_code
             )
         return verifier_response.json()
 
-    def get_upload_statuses_admin(self, aid: str, lei: str):
-        verifier_response = self.filer_adapter.upload_statuses_admin_request(aid, lei)
+    async def check_uploads(self, aid: str, digs):
+        """
+        Upload statuses of several digests, fetched from the filer concurrently (at most
+        UPLOAD_STATUS_BATCH_CONCURRENCY at a time). Returns {dig: (status code, body)}.
+        """
+        semaphore = asyncio.Semaphore(self.upload_status_batch_concurrency)
+
+        async def check(dig):
+            async with semaphore:
+                try:
+                    return dig, (200, await self.check_upload(aid, dig))
+                except VerifierServiceException as e:
+                    return dig, (e.status_code, e.detail)
+
+        return dict(await asyncio.gather(*(check(dig) for dig in digs)))
+
+    async def get_upload_statuses_admin(self, aid: str, lei: str):
+        verifier_response = await self.coalesce(
+            "filer",
+            "upload_statuses_admin",
+            (aid, lei),
+            lambda: self.filer_adapter.upload_statuses_admin_request(aid, lei),
+        )
         if verifier_response.status_code != 200:
             raise VerifierServiceException(
                 verifier_response.json(), verifier_response.status_code
             )
         return verifier_response.json()
 
-    def upload(self, aid: str, dig: str, report: bytes, contype: str, raw):
-        if not verify_digest(report, dig):
-            raise DigestVerificationFailedException(
-                "Report digest verification failed", 400
-            )
-        verifier_response = self.filer_adapter.upload_request(aid, dig, contype, raw)
+    async def upload(self, aid: str, dig: str, contype: str, body, content_length=None, wait=True):
+        """
+        Stream the multipart body to the filer while verifying the report digest, or
+        spool and verify it first with UPLOAD_MODE=spool. Raises UploadCapacityException
+        when the upload memory budget is used up.
+        """
+        length = int(content_length) if str(content_length).isdigit() else None
+        # the reservation and the spool are only held while the body is sent, the filer
+        # is polled for the upload status after they are released
+        if upload_stream.UPLOAD_MODE == "spool":
+            with self.upload_budget.reserve(UploadSpool.memory(length)):
+                spool = UploadSpool(contype, dig)
+                try:
+                    await spool.receive(body)
+                    verifier_response = await self.filer_adapter.upload_request(
+                        aid, dig, contype, spool.replay(), False, spool.size
+                    )
+                finally:
+                    spool.close()
+        else:
+            with self.upload_budget.reserve(MultipartDigestTap.memory(length)):
+                tap = MultipartDigestTap(contype, dig)
+                verifier_response = await self.filer_adapter.upload_request(
+                    aid, dig, contype, tap.stream(body), False, content_length
+                )
+        if wait and verifier_response.status_code == 202:
+            verifier_response = await self.wait_for_upload(aid, dig)
         return verifier_response
+
+    async def wait_for_upload(self, aid: str, dig: str, deadline: float = None):
+        return await self.filer_adapter.wait_for_upload(aid, dig, deadline)
@@ -1,18 +1,137 @@
-from hashlib import sha256
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from regps.app.api.exceptions import DigestVerificationFailedException
+from regps.app.api.utils.metrics import STAGE_SECONDS
 
+# Report digests are "<algorithm>-<hex digest>", e.g. sha256-9f86d0...
+DIGEST_ALGORITHMS = {
+    "sha256": hashlib.sha256,
+    "sha512": hashlib.sha512,
+    "sha3_256": hashlib.sha3_256,
+    "blake2b": hashlib.blake2b,
+    "blake2s": hashlib.blake2s,
+}
 
-def get_non_prefixed_digest(dig):
+try:
+    from blake3 import blake3
+
+    DIGEST_ALGORITHMS["blake3"] = blake3
+except ImportError:
+    pass
+
+# Report data is hashed in a thread pool once this many bytes are pending, hashlib
+# releases the GIL so concurrent uploads are hashed on several cores
+DIGEST_THREAD_MIN_BYTES = int(os.environ.get("DIGEST_THREAD_MIN_BYTES", 1024 * 1024))
+DIGEST_THREADS = int(os.environ.get("DIGEST_THREADS", os.cpu_count() or 1))
+
+_executor = None
+
+
+def digest_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(DIGEST_THREADS, thread_name_prefix="regps-digest")
+    return _executor
+
+
+def register_digest_algorithm(prefix: str, factory):
+    """
+    Accept digests prefixed with prefix, hashed with the hashlib-like object factory() returns.
+    """
+    DIGEST_ALGORITHMS[prefix.lower()] = factory
+
+
+def parse_digest(dig):
+    """
+    Split a prefixed digest into its hash factory and hex digest.
+    """
     try:
         prefix, digest = dig.split("-", 1)
     except ValueError:
         raise DigestVerificationFailedException(
             f"Digest ({dig}) must start with prefix", 400
         )
-    return digest
+    factory = DIGEST_ALGORITHMS.get(prefix.lower())
+    if factory is None:
+        raise DigestVerificationFailedException(
+            f"Digest algorithm {prefix} is not supported, expected one of "
+            f"{', '.join(sorted(DIGEST_ALGORITHMS))}",
+            400,
+        )
+    return factory, digest.lower()
+
+
+def get_non_prefixed_digest(dig):
+    return parse_digest(dig)[1]
+
+
+class DigestHasher:
+    """
+    Incrementally hashes a report and checks it against the expected prefixed digest.
+
+    update() hashes right away. feed() queues the data and drain() hashes it in the
+    digest thread pool once DIGEST_THREAD_MIN_BYTES are pending, one batch at a time so
+    the order is kept, while the caller goes on receiving.
+    """
+
+    def __init__(self, dig: str, thread_min_bytes: int = None):
+        factory, self.expected = parse_digest(dig)
+        self.hasher = factory()
+        self.thread_min_bytes = (
+            DIGEST_THREAD_MIN_BYTES if thread_min_bytes is None else thread_min_bytes
+        )
+        self._pending = []
+        self._pending_size = 0
+        self._batch = None
+
+    def update(self, data):
+        self.hasher.update(data)
+
+    def feed(self, data):
+        self._pending.append(data)
+        self._pending_size += len(data)
+
+    async def drain(self, force: bool = False):
+        if not self._pending or (not force and self._pending_size < self.thread_min_bytes):
+            return
+        if self._batch is not None:
+            await asyncio.wrap_future(self._batch)
+            self._batch = None
+        pending, size = self._pending, self._pending_size
+        self._pending, self._pending_size = [], 0
+        if size < self.thread_min_bytes:
+            self._update_all(pending)
+        else:
+            self._batch = digest_executor().submit(self._update_all, pending)
+
+    async def finish(self):
+        """
+        Hash everything fed so far.
+        """
+        await self.drain(force=True)
+        if self._batch is not None:
+            await asyncio.wrap_future(self._batch)
+            self._batch = None
+
+    def _update_all(self, pending):
+        for data in pending:
+            self.hasher.update(data)
+
+    def verify(self) -> bool:
+        if self._batch is not None:
+            self._batch.result()
+            self._batch = None
+        self._update_all(self._pending)
+        self._pending, self._pending_size = [], 0
+        return self.hasher.hexdigest() == self.expected
 
 
 def verify_digest(file: bytes, digest: str):
-    digest = get_non_prefixed_digest(digest)
-    actual_digest = sha256(file).hexdigest()
-    return actual_digest == digest
+    with STAGE_SECONDS.time(stage="verify_digest"):
+        hasher = DigestHasher(digest)
+        hasher.update(file)
+        return hasher.verify()
+
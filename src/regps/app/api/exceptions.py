@@ -11,6 +11,34 @@ class VerifySignedHeadersException(HTTPException):
         super().__init__(status_code=status_code, detail=detail)
 
 
+class UpstreamUnavailableException(VerifierServiceException):
+    """
+    The upstream is failing (circuit open) or saturated (bulkhead full), the call was not made.
+    """
+
+    def __init__(self, detail, retry_after: float = None):
+        super().__init__(detail, 503)
+        self.retry_after = retry_after
+        if retry_after is not None:
+            self.headers = {"Retry-After": str(retry_after)}
+
+
+class UploadCapacityException(HTTPException):
+    """
+    Admitting the upload would exceed the upload memory budget.
+    """
+
+    def __init__(self, detail, retry_after: float):
+        super().__init__(
+            status_code=503, detail=detail, headers={"Retry-After": str(retry_after)}
+        )
+
+
+class ReportValidationException(HTTPException):
+    def __init__(self, detail, status_code: int):
+        super().__init__(status_code=status_code, detail=detail)
+
+
 class DigestVerificationFailedException(HTTPException):
     def __init__(self, detail: str, status_code: int):
         super().__init__(status_code=status_code, detail=detail)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from keri.core import coring, eventing, parsing
+from keri.db import basing
+
+from regps.app.api.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class KeyStateCache:
+    """
+    Cache of the current signing keys of AIDs, used to verify signed headers locally.
+
+    Key state is only learned from trusted sources: KELs from OOBI resolution, verifier
+    authorization responses that carry key state, and signatures the verifier has
+    confirmed. KELs in client presentations are not used, the verifier accepting a
+    presentation for processing doesn't mean it verified them. Entries expire after a
+    TTL so rotations are picked up.
+    """
+
+    def __init__(self, ttl: float = None, maxsize: int = None):
+        self.keys = TTLCache(
+            float(os.environ.get("KEY_STATE_CACHE_TTL", 300)) if ttl is None else ttl,
+            int(os.environ.get("KEY_STATE_CACHE_SIZE", 10000)) if maxsize is None else maxsize,
+        )
+        self._db = None
+        self._kvy = None
+        # KELs are parsed into LMDB off the event loop, one at a time
+        self._executor = None
+
+    def get(self, aid: str):
+        return self.keys.get(aid)
+
+    def update(self, aid: str, keys):
+        """
+        Replace the signing keys of an AID. Keys are qb64 verfers.
+        """
+        raws = frozenset(coring.Verfer(qb64=key).raw for key in keys)
+        if raws:
+            self.keys.set(aid, raws)
+
+    def invalidate(self, aid: str):
+        self.keys.pop(aid)
+
+    def update_from_authorization(self, aid: str, auth: dict):
+        """
+        Use the key state of a verifier authorization response, if it includes any.
+        """
+        if not isinstance(auth, dict):
+            return
+        keys = auth.get("keys") or (auth.get("state") or {}).get("k")
+        if keys:
+            self.update(aid, keys)
+
+    async def resolve_kel(self, aid: str, ims: bytes):
+        """
+        update_from_kel in the key state thread, so parsing doesn't block the event loop.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="regps-key-state")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.update_from_kel, aid, ims)
+
+    def update_from_kel(self, aid: str, ims: bytes):
+        """
+        Process the KEL events in a CESR stream of a trusted source and cache the
+        resulting key state of aid. Other AIDs the stream carries are not cached, nor
+        are non KEL messages (credentials, etc.).
+        """
+        if self._kvy is None:
+            self._db = basing.Baser(name="regps-key-state", temp=True, reopen=True)
+            self._kvy = eventing.Kevery(db=self._db, lax=True, local=False)
+        if isinstance(ims, str):
+            ims = ims.encode("utf-8")
+        try:
+            parsing.Parser().parse(ims=bytearray(ims), kvy=self._kvy)
+        except Exception as e:
+            logger.info(f"key state: unable to process KEL stream: {e}")
+        kever = self._kvy.kevers.get(aid)
+        if kever is not None:
+            self.update(aid, [verfer.qb64 for verfer in kever.verfers])
+
+    def learn(self, aid: str, keyid: str, cig: str, ser: str):
+        """
+        Record keyid as the current signing key of aid after the verifier accepted a
+        signature that keyid produced.
+        """
+        if verify_signature(keyid, cig, ser):
+            self.keys.set(aid, frozenset([coring.Verfer(qb64=keyid).raw]))
+
+    def verify(self, aid: str, keyid: str, cig: str, ser: str):
+        """
+        Returns True or False when the signature can be checked against cached key state,
+        or None when the AID or key is unknown (cache miss or possible rotation).
+        """
+        keys = self.keys.get(aid)
+        if keys is None or keyid is None:
+            return None
+        try:
+            if coring.Verfer(qb64=keyid).raw not in keys:
+                return None
+        except Exception:
+            return False
+        return verify_signature(keyid, cig, ser)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._db.close(clear=True)
+        self._db = None
+        self._kvy = None
+
+
+def verify_signature(keyid: str, cig: str, ser: str) -> bool:
+    try:
+        verfer = coring.Verfer(qb64=keyid)
+        cigar = coring.Cigar(qb64=cig)
+        return verfer.verify(cigar.raw, ser.encode("utf-8"))
+    except Exception as e:
+        logger.info(f"key state: unable to verify signature: {e}")
+        return False
@@ -0,0 +1,63 @@
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayGuard:
+    """
+    Rejects signed requests whose signature was created outside of window seconds from
+    now, or that were already seen.
+
+    Seen signatures are bucketed by the window their created time falls in, and a bucket
+    is dropped once no fresh signature can fall in it anymore, so memory is bounded by
+    the request rate over about three windows, and by max_entries per bucket (the oldest
+    entries are evicted past it).
+    """
+
+    def __init__(self, window: float = None, max_entries: int = None, timer=time.time):
+        self.window = float(os.environ.get("REPLAY_WINDOW", 300)) if window is None else window
+        self.max_entries = (
+            int(os.environ.get("REPLAY_CACHE_SIZE", 100000)) if max_entries is None else max_entries
+        )
+        self.timer = timer
+        self._buckets = {}
+        self.evictions = 0
+
+    def check(self, sig: str, created) -> str:
+        """
+        Claim the signature, returns None when the request is fresh and was not seen
+        before, otherwise the reason to reject it: "stale" or "replayed".
+        """
+        now = self.timer()
+        if created is None or abs(now - created) > self.window:
+            return "stale"
+        self._expire(now)
+        seen = self._buckets.setdefault(int(created // self.window), {})
+        if sig in seen:
+            return "replayed"
+        seen[sig] = None
+        if len(seen) > self.max_entries:
+            del seen[next(iter(seen))]
+            self.evictions += 1
+            if self.evictions % self.max_entries == 1:
+                logger.warning("replay cache full, evicting seen signatures early")
+        return None
+
+    def release(self, sig: str, created):
+        """
+        Forget a claimed signature, e.g. when its verification could not complete, so
+        the client can retry the same request.
+        """
+        seen = self._buckets.get(int(created // self.window))
+        if seen is not None:
+            seen.pop(sig, None)
+
+    def _expire(self, now):
+        oldest = int((now - self.window) // self.window)
+        for bucket in [b for b in self._buckets if b < oldest]:
+            del self._buckets[bucket]
+
+    def __len__(self):
+        return sum(len(seen) for seen in self._buckets.values())
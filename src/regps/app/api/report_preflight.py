@@ -0,0 +1,149 @@
+import io
+import logging
+import os
+import zipfile
+from collections import deque
+
+from regps.app.api.exceptions import ReportValidationException
+
+logger = logging.getLogger(__name__)
+
+# Validate report archives while they stream, before the filer gets all of them
+REPORT_PREFLIGHT = os.environ.get("REPORT_PREFLIGHT", "false").lower() in ("true", "1")
+REPORT_MAX_BYTES = int(os.environ.get("REPORT_MAX_BYTES", 512 * 1024 * 1024))
+REPORT_MAX_ENTRIES = int(os.environ.get("REPORT_MAX_ENTRIES", 10000))
+REPORT_MAX_UNCOMPRESSED_BYTES = int(
+    os.environ.get("REPORT_MAX_UNCOMPRESSED_BYTES", 2 * 1024 * 1024 * 1024)
+)
+REPORT_MAX_COMPRESSION_RATIO = float(os.environ.get("REPORT_MAX_COMPRESSION_RATIO", 100))
+# Manifest every report must carry, at the root or in the report's top level directory
+REPORT_MANIFEST = os.environ.get("REPORT_MANIFEST", "META-INF/reports.json")
+# The end of the archive is kept to read the central directory: the 64 KiB comment
+# limit of the end record plus this much central directory
+REPORT_CENTRAL_DIRECTORY_BYTES = int(
+    os.environ.get("REPORT_CENTRAL_DIRECTORY_BYTES", 1024 * 1024)
+)
+
+# entries smaller than this are not checked for their compression ratio, tiny and
+# repetitive files legitimately compress very well
+RATIO_MIN_BYTES = 1024 * 1024
+
+_ZIP_SIGNATURES = (b"PK\x03\x04", b"PK\x05\x06")
+
+
+class _TailFile(io.RawIOBase):
+    """
+    Seekable view of an archive of size bytes of which only the last bytes are kept,
+    enough for zipfile to read the end record and central directory.
+    """
+
+    def __init__(self, tail: bytes, size: int):
+        self.tail = tail
+        self.size = size
+        self.start = size - len(tail)
+        self.pos = 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n=-1):
+        if self.pos < self.start:
+            raise ReportValidationException(
+                {"msg": "Report zip central directory is too large"}, 400
+            )
+        end = self.size if n is None or n < 0 else min(self.pos + n, self.size)
+        data = self.tail[self.pos - self.start:end - self.start]
+        self.pos += len(data)
+        return data
+
+
+class ZipPreflight:
+    """
+    Validates a zip report from its bytes as they stream by, without extracting it:
+    the zip signature and size as soon as they are known, then from the central
+    directory the entry count, total and per-entry compression ratio (zip bombs),
+    entry paths and the presence of the signature manifest.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.keep = REPORT_CENTRAL_DIRECTORY_BYTES + (1 << 16) + 22
+        self._head = b""
+        self._tail = deque()
+        self._tail_size = 0
+
+    def feed(self, data):
+        if len(self._head) < 4:
+            self._head += bytes(data[:4 - len(self._head)])
+            if len(self._head) == 4 and self._head not in _ZIP_SIGNATURES:
+                self._reject("Report must be a zip archive")
+        self.size += len(data)
+        if REPORT_MAX_BYTES and self.size > REPORT_MAX_BYTES:
+            self._reject(f"Report is larger than {REPORT_MAX_BYTES} bytes", 413)
+        self._tail.append(data)
+        self._tail_size += len(data)
+        while self._tail_size - len(self._tail[0]) >= self.keep:
+            self._tail_size -= len(self._tail.popleft())
+
+    def finish(self):
+        """
+        Check the central directory, returns the archive's entries.
+        """
+        if len(self._head) < 4:
+            self._reject("Report must be a zip archive")
+        tail = b"".join(self._tail)
+        self._tail.clear()
+        try:
+            with zipfile.ZipFile(_TailFile(tail, self.size)) as archive:
+                entries = archive.infolist()
+        except (zipfile.BadZipFile, ValueError, EOFError) as e:
+            self._reject(f"Report is not a valid zip archive: {e}")
+        if REPORT_MAX_ENTRIES and len(entries) > REPORT_MAX_ENTRIES:
+            self._reject(f"Report has more than {REPORT_MAX_ENTRIES} entries")
+        total = 0
+        for entry in entries:
+            name = entry.filename
+            if name.startswith("/") or ".." in name.split("/") or "\\" in name:
+                self._reject(f"Report entry {name} has an unsafe path")
+            total += entry.file_size
+            if (
+                REPORT_MAX_COMPRESSION_RATIO
+                and entry.file_size >= RATIO_MIN_BYTES
+                and entry.file_size > entry.compress_size * REPORT_MAX_COMPRESSION_RATIO
+            ):
+                self._reject(f"Report entry {name} exceeds the compression ratio limit")
+        if REPORT_MAX_UNCOMPRESSED_BYTES and total > REPORT_MAX_UNCOMPRESSED_BYTES:
+            self._reject(f"Report uncompresses to more than {REPORT_MAX_UNCOMPRESSED_BYTES} bytes")
+        if REPORT_MANIFEST and not any(self._is_manifest(entry.filename) for entry in entries):
+            self._reject(f"Report is missing its {REPORT_MANIFEST} manifest")
+        logger.debug("report preflight passed: %s entries, %s bytes uncompressed", len(entries), total)
+        return entries
+
+    @staticmethod
+    def _is_manifest(name):
+        # at the root or one directory down, e.g. <report name>/META-INF/reports.json
+        if name == REPORT_MANIFEST:
+            return True
+        head, _, rest = name.partition("/")
+        return bool(head) and rest == REPORT_MANIFEST
+
+    @staticmethod
+    def _reject(msg, status_code=400):
+        logger.info("report preflight failed: %s", msg)
+        raise ReportValidationException({"msg": msg}, status_code)
@@ -1,16 +1,17 @@
+import functools
 import json
+import os
+import re
 from typing import Any, Dict, List
 import logging
 from regps.app.api.exceptions import VerifySignedHeadersException
-import sys
 from fastapi import Request
 from keri.end import ending
 
-# Configure the logger
+from regps.app.api.replay_guard import ReplayGuard
+from regps.app.api.utils.metrics import SIGNED_HEADERS_REJECTED, STAGE_SECONDS
+
 logger = logging.getLogger(__name__)
-handler = logging.StreamHandler(sys.stdout)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
 
 uploadStatus: Dict[str, List[Dict[str, Any]]] = {}
 
@@ -18,16 +19,27 @@ uploadStatus: Dict[str, List[Dict[str, Any]]] = {}
 class VerifySignedHeaders:
     DefaultFields = ["Signify-Resource", "@method", "@path", "Signify-Timestamp"]
 
-    def __init__(self, api_controller):
+    def __init__(self, api_controller, replay_guard: ReplayGuard = None):
         self.api_controller = api_controller
+        # stale and replayed signatures are rejected before any verifier call
+        if replay_guard is None and os.environ.get("REPLAY_PROTECTION", "false").lower() in ("true", "1"):
+            replay_guard = ReplayGuard()
+        self.replay_guard = replay_guard
 
-    def process_request(self, req: Request, raid, verify_for_upload=True):
+    async def process_request(self, req: Request, raid, verify_for_upload=True):
         try:
-            logger.info(f"Processing signed header verification request {req}")
-            aid, cig, ser = self.handle_headers(req)
+            with STAGE_SECONDS.time(stage="signature_base"):
+                aid, cig, ser, keyid, created = self._handle_headers(req)
             if not verify_for_upload or aid == raid:
-                res = self.api_controller.verify_cig(aid, cig, ser)
-                logger.info(f"VerifySignedHeaders.on_post: response {res}")
+                self._check_replay(aid, cig, created)
+                try:
+                    with STAGE_SECONDS.time(stage="verify_signature"):
+                        res = await self.api_controller.verify_cig(aid, cig, ser, keyid)
+                except BaseException:
+                    if self.replay_guard is not None:
+                        self.replay_guard.release(cig, created)
+                    raise
+                logger.debug("VerifySignedHeaders.on_post: response %s", res)
                 return res
             else:
                 raise VerifySignedHeadersException(
@@ -39,10 +51,27 @@ class VerifySignedHeaders:
         except VerifySignedHeadersException as e:
             raise e
 
+    def _check_replay(self, aid, cig, created):
+        if self.replay_guard is None:
+            return
+        reason = self.replay_guard.check(cig, created)
+        if reason is not None:
+            SIGNED_HEADERS_REJECTED.inc(reason=reason)
+            logger.info("rejected %s signed headers for %s", reason, aid)
+            msg = (
+                "Signature already used"
+                if reason == "replayed"
+                else "Signature created outside of the accepted time window"
+            )
+            raise VerifySignedHeadersException(json.dumps({"msg": msg}), 401)
+
     @staticmethod
     def handle_headers(req):
-        logger.info(f"processing header req {req}")
+        aid, sig, ser, _, _ = VerifySignedHeaders._handle_headers(req)
+        return aid, sig, ser
 
+    @staticmethod
+    def _handle_headers(req):
         headers = req.headers
         if (
             "SIGNATURE-INPUT" not in headers
@@ -54,60 +83,103 @@ class VerifySignedHeaders:
                 json.dumps({"msg": "Incorrect Headers"}), 401
             )
 
-        siginput = headers["SIGNATURE-INPUT"]
-        signature = headers["SIGNATURE"]
-        resource = headers["SIGNIFY-RESOURCE"]
-
-        inputs = ending.desiginput(siginput.encode("utf-8"))
-        inputs = [i for i in inputs if i.name == "signify"]
-
-        if not inputs:
+        template, created = signature_input(headers["SIGNATURE-INPUT"])
+        if template is None:
             raise VerifySignedHeadersException(
                 json.dumps({"msg": "Incorrect Headers"}), 401
             )
-
-        for inputage in inputs:
-            items = []
-            for field in inputage.fields:
-                if field.startswith("@"):
-                    if field == "@method":
-                        items.append(f'"{field}": {req.method}')
-                    elif field == "@path":
-                        items.append(f'"{field}": {req.url.path}')
-
-                else:
-                    key = field.upper()
-                    field = field.lower()
-                    if key not in headers:
-                        continue
-
-                    value = ending.normalize(headers[key])
-                    items.append(f'"{field}": {value}')
-
-            values = [f"({' '.join(inputage.fields)})", f"created={inputage.created}"]
-            if inputage.expires is not None:
-                values.append(f"expires={inputage.expires}")
-            if inputage.nonce is not None:
-                values.append(f"nonce={inputage.nonce}")
-            if inputage.keyid is not None:
-                values.append(f"keyid={inputage.keyid}")
-            if inputage.context is not None:
-                values.append(f"context={inputage.context}")
-            if inputage.alg is not None:
-                values.append(f"alg={inputage.alg}")
-
-            params = ";".join(values)
-
-            items.append(f'"@signature-params: {params}"')
-            ser = "\n".join(items)
-
-            signages = ending.designature(signature)
-            cig = signages[0].markers[inputage.name]
-            assert len(signages) == 1
-            assert signages[0].indexed is False
-            assert "signify" in signages[0].markers
-
-            aid = resource
-            sig = cig.qb64
-            logger.info(f"verification input aid={aid} ser={ser} cig={sig}")
-            return aid, sig, ser
+        ser = template.serialize(req, created)
+
+        signages = ending.designature(headers["SIGNATURE"])
+        cig = signages[0].markers[template.name]
+        assert len(signages) == 1
+        assert signages[0].indexed is False
+        assert "signify" in signages[0].markers
+
+        aid = headers["SIGNIFY-RESOURCE"]
+        sig = cig.qb64
+        logger.debug("verification input aid=%s ser=%s cig=%s", aid, ser, sig)
+        return aid, sig, ser, template.keyid, created
+
+
+class SignatureTemplate:
+    """
+    Signature base of a signify Signature-Input, pre-rendered except for the created
+    time and the values of the covered headers, which are filled in per request.
+    """
+
+    __slots__ = ("name", "fields", "head", "tail", "keyid")
+
+    def __init__(self, inputage):
+        self.name = inputage.name
+        # (header to read or derived component, line prefix)
+        fields = []
+        for field in inputage.fields:
+            if field.startswith("@"):
+                if field in ("@method", "@path"):
+                    fields.append((field, f'"{field}": '))
+            else:
+                fields.append((field.upper(), f'"{field.lower()}": '))
+        self.fields = tuple(fields)
+        values = []
+        if inputage.expires is not None:
+            values.append(f"expires={inputage.expires}")
+        if inputage.nonce is not None:
+            values.append(f"nonce={inputage.nonce}")
+        if inputage.keyid is not None:
+            values.append(f"keyid={inputage.keyid}")
+        if inputage.context is not None:
+            values.append(f"context={inputage.context}")
+        if inputage.alg is not None:
+            values.append(f"alg={inputage.alg}")
+        covered = " ".join(inputage.fields)
+        self.head = f'"@signature-params: ({covered});created='
+        self.tail = "".join(f";{value}" for value in values) + '"'
+        self.keyid = inputage.keyid
+
+    def serialize(self, req, created) -> str:
+        headers = req.headers
+        items = []
+        for key, prefix in self.fields:
+            if key == "@method":
+                items.append(prefix + req.method)
+            elif key == "@path":
+                items.append(prefix + req.url.path)
+            else:
+                value = headers.get(key)
+                if value is not None:
+                    items.append(prefix + ending.normalize(value))
+        items.append(f"{self.head}{created}{self.tail}")
+        return "\n".join(items)
+
+
+def parse_signature_input(siginput: str):
+    """
+    Template of the first signify input of a Signature-Input header and its created
+    time, (None, None) when there is none.
+    """
+    inputs = [i for i in ending.desiginput(siginput.encode("utf-8")) if i.name == "signify"]
+    if not inputs:
+        return None, None
+    return SignatureTemplate(inputs[0]), inputs[0].created
+
+
+# Signify clients send a handful of Signature-Input shapes that only differ in the
+# created time, so templates are cached by the header with created zeroed.
+cached_signature_input = functools.lru_cache(
+    maxsize=int(os.environ.get("SIGNATURE_INPUT_CACHE_SIZE", 1024))
+)(parse_signature_input)
+
+_CREATED = re.compile(r";created=(\d+)")
+
+
+def signature_input(siginput: str):
+    match = _CREATED.search(siginput)
+    if match is not None:
+        template, created = cached_signature_input(
+            f"{siginput[:match.start(1)]}0{siginput[match.end(1):]}"
+        )
+        # otherwise the match was not the created parameter, e.g. inside a quoted value
+        if created == 0:
+            return template, int(match.group(1))
+    return parse_signature_input(siginput)
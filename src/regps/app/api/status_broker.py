@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import AsyncIterator, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Max number of undelivered events kept per subscriber, older ones are dropped
+UPLOAD_STATUS_QUEUE_SIZE = int(os.environ.get("UPLOAD_STATUS_QUEUE_SIZE", 100))
+
+
+class UploadStatusBroker:
+    """
+    Fans out upload status transitions to the subscribers of an AID or of an LEI, and
+    makes sure there is a single upstream poll loop per in-flight digest no matter how
+    many clients are waiting for it.
+
+    Subscriptions are process local; each worker publishes the transitions it sees.
+    """
+
+    def __init__(self, queue_size: int = None):
+        self.queue_size = UPLOAD_STATUS_QUEUE_SIZE if queue_size is None else queue_size
+        self._subscribers = defaultdict(set)
+        self._pollers = {}
+
+    def subscribe(self, scope: str, key: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[(scope, key)].add(queue)
+        return queue
+
+    def unsubscribe(self, scope: str, key: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get((scope, key))
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[(scope, key)]
+
+    def subscriber_count(self, scope: str, key: str) -> int:
+        return len(self._subscribers.get((scope, key), ()))
+
+    def publish(self, aid: str, lei: str, event: dict):
+        """
+        Deliver event to the subscribers of aid and of lei. Slow subscribers lose their
+        oldest events rather than blocking the publisher.
+        """
+        queues = self._subscribers.get(("aid", aid), set()) | self._subscribers.get(
+            ("lei", lei), set()
+        )
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def events(
+        self, scope: str, key: str, heartbeat: float, queue: asyncio.Queue = None
+    ) -> AsyncIterator[dict]:
+        """
+        Yields the events published for scope/key, or None every heartbeat seconds
+        without events, until the consumer stops iterating.
+        """
+        queue = queue or self.subscribe(scope, key)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.unsubscribe(scope, key, queue)
+
+    def watch(self, aid: str, dig: str, poll: Callable[[], Awaitable]) -> asyncio.Task:
+        """
+        Run poll for the digest unless a poll loop is already running for it, and return
+        the running task. Await it through asyncio.shield so one caller giving up does not
+        cancel the poll for the others.
+        """
+        task = self._pollers.get((aid, dig))
+        if task is None:
+            logger.info(f"status broker: polling upload status for {aid} {dig}")
+            task = asyncio.create_task(poll())
+            self._pollers[(aid, dig)] = task
+            task.add_done_callback(lambda _: self._pollers.pop((aid, dig), None))
+        return task
+
+    def watching(self, aid: str, dig: str) -> bool:
+        return (aid, dig) in self._pollers
+
+    def in_flight(self) -> int:
+        return len(self._pollers)
+
+    async def aclose(self):
+        for task in list(self._pollers.values()):
+            task.cancel()
+        self._pollers.clear()
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator
+
+from regps.app.api import digest_verifier, report_preflight
+from regps.app.api.digest_verifier import DigestHasher
+from regps.app.api.exceptions import DigestVerificationFailedException, UploadCapacityException
+from regps.app.api.utils.metrics import (
+    STAGE_SECONDS,
+    UPLOAD_BYTES,
+    UPLOAD_MEMORY_RESERVED,
+    UPLOAD_REJECTED,
+    UPLOAD_REPORT_BYTES,
+    UPLOAD_SPOOLED_BYTES,
+)
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # pragma: no cover - older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Max number of request chunks buffered between the client and the filer
+UPLOAD_STREAM_BUFFER_CHUNKS = int(os.environ.get("UPLOAD_STREAM_BUFFER_CHUNKS", 8))
+# "stream" forwards the body to the filer while it is received, "spool" receives and
+# verifies the whole body first, spilling it to a temporary file past UPLOAD_SPOOL_MEMORY
+UPLOAD_MODE = os.environ.get("UPLOAD_MODE", "stream").lower()
+UPLOAD_SPOOL_MEMORY = int(os.environ.get("UPLOAD_SPOOL_MEMORY", 1024 * 1024))
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+# Memory all uploads in progress may hold, 0 for no limit
+UPLOAD_MEMORY_BUDGET = int(os.environ.get("UPLOAD_MEMORY_BUDGET", 256 * 1024 * 1024))
+UPLOAD_RETRY_AFTER = int(os.environ.get("UPLOAD_RETRY_AFTER", 5))
+# Upper bound of an ASGI request body chunk, for memory estimates
+CHUNK_SIZE = 64 * 1024
+
+_END = object()
+
+
+class MultipartDigestTap:
+    """
+    Parses a multipart/form-data body chunk by chunk and incrementally hashes the
+    report part, so the digest can be verified without buffering the body. The
+    request chunks are forwarded as they are, boundary included, and the report part
+    is hashed through memoryviews of them, so the report is never copied. Large
+    reports are hashed in the digest thread pool, overlapping with receiving the body.
+    With preflight (REPORT_PREFLIGHT by default) the report part is also validated as
+    a zip archive, see ZipPreflight.
+    """
+
+    def __init__(self, contype: str, dig: str, field: str = "upload", preflight: bool = None):
+        ctype, params = parse_options_header(contype)
+        if ctype != b"multipart/form-data" or b"boundary" not in params:
+            raise DigestVerificationFailedException(
+                f"Upload content type must be multipart/form-data, got {contype}", 400
+            )
+        self.field = field.encode("utf-8")
+        self.hasher = DigestHasher(dig)
+        if preflight is None:
+            preflight = report_preflight.REPORT_PREFLIGHT
+        self.preflight = report_preflight.ZipPreflight() if preflight else None
+        self.size = 0
+        self.elapsed = 0.0
+        self.found = False
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._in_report = False
+        self.parser = MultipartParser(
+            params[b"boundary"],
+            callbacks={
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def feed(self, chunk: bytes):
+        start = time.perf_counter()
+        self.parser.write(chunk)
+        self.elapsed += time.perf_counter() - start
+        UPLOAD_BYTES.inc(len(chunk))
+
+    async def finish(self):
+        """
+        Wait for the report data still being hashed, then verify.
+        """
+        start = time.perf_counter()
+        await self.hasher.finish()
+        self.elapsed += time.perf_counter() - start
+        self.verify()
+
+    def verify(self):
+        self.parser.finalize()
+        # parsing and hashing time of the whole body, observed once per upload
+        STAGE_SECONDS.observe(self.elapsed, stage="multipart_digest")
+        UPLOAD_REPORT_BYTES.inc(self.size)
+        if not self.found:
+            raise DigestVerificationFailedException(
+                f"Upload is missing the {self.field.decode()} form field", 400
+            )
+        if not self.hasher.verify():
+            raise DigestVerificationFailedException(
+                "Report digest verification failed", 400
+            )
+        if self.preflight is not None:
+            with STAGE_SECONDS.time(stage="report_preflight"):
+                self.preflight.finish()
+        logger.debug("verified report digest for %s bytes", self.size)
+
+    async def stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Forward the body chunks unchanged through a bounded buffer while hashing the
+        report part. The last chunk is held back until the digest is verified, so a
+        report that fails verification is never delivered in full.
+        """
+        queue = asyncio.Queue(maxsize=UPLOAD_STREAM_BUFFER_CHUNKS)
+
+        async def produce():
+            try:
+                async for chunk in chunks:
+                    if chunk:
+                        self.feed(chunk)
+                        await self.hasher.drain()
+                        await queue.put(chunk)
+                await self.finish()
+                await queue.put(_END)
+            except Exception as e:
+                await queue.put(e)
+
+        producer = asyncio.create_task(produce())
+        try:
+            held = None
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if held is not None:
+                    yield held
+                if item is _END:
+                    break
+                held = item
+        finally:
+            producer.cancel()
+
+    @staticmethod
+    def memory(content_length: int = None) -> int:
+        """
+        Most memory a streamed upload holds: the chunk buffer and the digest batches.
+        """
+        held = UPLOAD_STREAM_BUFFER_CHUNKS * CHUNK_SIZE + _report_memory()
+        return held if content_length is None else min(content_length, held)
+
+    def _on_part_begin(self):
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._in_report = options.get(b"name") == self.field
+        if self._in_report:
+            self.found = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_report:
+            # a view instead of a slice copy, request chunks are immutable bytes
+            if isinstance(data, bytes):
+                data = memoryview(data)[start:end]
+            else:
+                data = bytes(data[start:end])
+            self.hasher.feed(data)
+            if self.preflight is not None:
+                self.preflight.feed(data)
+            self.size += end - start
+
+    def _on_part_end(self):
+        self._in_report = False
+
+
+def _report_memory():
+    # digest batches, and the archive tail kept for the zip preflight
+    held = 2 * digest_verifier.DIGEST_THREAD_MIN_BYTES
+    if report_preflight.REPORT_PREFLIGHT:
+        held += report_preflight.REPORT_CENTRAL_DIRECTORY_BYTES + (1 << 16)
+    return held
+
+
+class UploadSpool:
+    """
+    Receives a multipart body into a temporary file, kept in memory up to
+    UPLOAD_SPOOL_MEMORY bytes, while verifying the report digest, then replays it to the
+    filer. The filer only sees reports that passed verification, and only for as long
+    as it takes to send them, however slow the client.
+    """
+
+    def __init__(self, contype: str, dig: str, max_memory: int = None):
+        self.tap = MultipartDigestTap(contype, dig)
+        self.max_memory = UPLOAD_SPOOL_MEMORY if max_memory is None else max_memory
+        self.file = tempfile.SpooledTemporaryFile(max_size=self.max_memory, dir=UPLOAD_SPOOL_DIR)
+        self.size = 0
+
+    async def receive(self, chunks: AsyncIterator[bytes]):
+        async for chunk in chunks:
+            if chunk:
+                self.tap.feed(chunk)
+                await self.tap.hasher.drain()
+                self.file.write(chunk)
+                self.size += len(chunk)
+        await self.tap.finish()
+        if self.size > self.max_memory:
+            UPLOAD_SPOOLED_BYTES.inc(self.size)
+        logger.debug("spooled %s bytes", self.size)
+
+    async def replay(self, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        self.file.seek(0)
+        while chunk := self.file.read(chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def memory(content_length: int = None) -> int:
+        held = UPLOAD_SPOOL_MEMORY + _report_memory()
+        return held if content_length is None else min(content_length, held)
+
+
+class UploadMemoryBudget:
+    """
+    Admission control for uploads: each upload reserves the memory it may hold and is
+    turned away with a 503 when the uploads in progress already hold the budget.
+    """
+
+    def __init__(self, budget: int = None):
+        self.budget = UPLOAD_MEMORY_BUDGET if budget is None else budget
+        self.reserved = 0
+
+    @contextmanager
+    def reserve(self, size: int):
+        if self.budget and self.reserved and self.reserved + size > self.budget:
+            UPLOAD_REJECTED.inc()
+            logger.warning(
+                "upload rejected, %s of %s upload bytes reserved", self.reserved, self.budget
+            )
+            raise UploadCapacityException(
+                {"msg": "Too many uploads in progress, retry later", "retry_after": UPLOAD_RETRY_AFTER},
+                UPLOAD_RETRY_AFTER,
+            )
+        self.reserved += size
+        UPLOAD_MEMORY_RESERVED.inc(size)
+        try:
+            yield
+        finally:
+            self.reserved -= size
+            UPLOAD_MEMORY_RESERVED.dec(size)
@@ -0,0 +1,192 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+
+from regps.app.api.utils.metrics import route_path
+
+# Max number of characters of request/response bodies included in log records
+LOG_BODY_PREVIEW = int(os.environ.get("LOG_BODY_PREVIEW", 256))
+
+# per request logging context, set by LoggingContextMiddleware
+request_id = contextvars.ContextVar("regps_request_id", default=None)
+request_route = contextvars.ContextVar("regps_request_route", default=None)
+request_sampled = contextvars.ContextVar("regps_request_sampled", default=True)
+
+_STANDARD_ATTRS = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line with the time, level, logger, message, request context and
+    any extra fields passed to the log call.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid is not None:
+            entry["request_id"] = rid
+            entry["route"] = record.route
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key not in ("request_id", "route"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds the request id and route to records and drops records below WARNING of
+    requests that were not sampled.
+    """
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and not request_sampled.get():
+            return False
+        record.request_id = request_id.get()
+        record.route = request_route.get()
+        return True
+
+
+class Preview:
+    """
+    Lazily formatted, size capped preview of a body or httpx response for log messages,
+    so nothing is decoded or serialized unless the record is actually emitted.
+    """
+
+    __slots__ = ("data", "limit")
+
+    def __init__(self, data, limit: int = None):
+        self.data = data
+        self.limit = LOG_BODY_PREVIEW if limit is None else limit
+
+    def __str__(self):
+        data = self.data
+        if hasattr(data, "status_code") and hasattr(data, "content"):
+            return f"{data.status_code} {_truncate(data.content, self.limit)}"
+        return _truncate(data, self.limit)
+
+
+def _truncate(data, limit):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        size = len(data)
+        text = bytes(data[:limit]).decode("utf-8", "replace")
+    else:
+        text = data if isinstance(data, str) else str(data)
+        size = len(text)
+        text = text[:limit]
+    return text if size <= limit else f"{text}...({size} bytes)"
+
+
+def parse_sample_rates(value: str) -> dict:
+    """
+    Parses LOG_SAMPLE_RATES, e.g. "/upload/{aid}/{dig}=0.1,/status/{aid}=0.01", into
+    {route template: rate}.
+    """
+    rates = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            route, rate = item.rsplit("=", 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level: str = None, fmt: str = None, stream=None):
+    """
+    Configure the regps loggers once: records go through a queue to a background thread
+    that formats and writes them, so request handlers never block on stdout.
+    LOG_LEVEL (INFO), LOG_FORMAT (json or text) and LOG_QUEUE (true) tune it.
+    """
+    global _listener
+    root = logging.getLogger("regps")
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "json")).lower()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s %(request_id)s %(message)s")
+        )
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+
+    if os.environ.get("LOG_QUEUE", "true").lower() in ("true", "1"):
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+    handler.addFilter(RequestContextFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    root.propagate = False
+
+
+def flush_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(flush_logging)
+
+
+class LoggingContextMiddleware:
+    """
+    ASGI middleware that gives each request an id (X-Request-ID if the client sent one)
+    and decides whether its debug/info records are logged, using the per route sample
+    rates of LOG_SAMPLE_RATES.
+    """
+
+    def __init__(self, app, router, sample_rates: dict = None):
+        self.app = app
+        self.router = router
+        self.sample_rates = (
+            parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+            if sample_rates is None
+            else sample_rates
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_path(self.router, scope)
+        rid = dict(scope.get("headers") or ()).get(b"x-request-id")
+        rate = self.sample_rates.get(route, 1.0)
+        tokens = (
+            request_id.set(rid.decode("latin-1") if rid else uuid.uuid4().hex[:16]),
+            request_route.set(route),
+            request_sampled.set(rate >= 1 or random.random() < rate),
+        )
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_sampled.reset(tokens[2])
+            request_route.reset(tokens[1])
+            request_id.reset(tokens[0])
@@ -0,0 +1,311 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from starlette.routing import Match
+
+# Latency buckets in seconds, from sub-millisecond local work to slow upstream calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}"]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per bucket counts (last one is +Inf), sum
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        counts = self._values.get(self._key(labels))
+        return sum(counts[0]) if counts else 0
+
+    def _render_value(self, key, value):
+        buckets, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), buckets):
+            cumulative += count
+            lines.append(
+                f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {cumulative}"
+            )
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds metrics and collectors (callables returning rendered lines for values computed
+    at scrape time) and renders them in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "regps_http_request_duration_seconds",
+    "Time to serve a request, by route",
+    ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "regps_http_requests_in_flight", "Requests being served, by route", ("method", "route")
+)
+UPSTREAM_REQUEST_SECONDS = REGISTRY.histogram(
+    "regps_upstream_request_duration_seconds",
+    "Time of calls to the verifier and filer",
+    ("upstream", "method", "operation"),
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "regps_upstream_requests_in_flight", "Calls in progress, by upstream", ("upstream",)
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "regps_upstream_errors_total",
+    "Upstream responses with an error status or failed calls (status error)",
+    ("upstream", "operation", "status"),
+)
+UPSTREAM_COALESCED = REGISTRY.counter(
+    "regps_upstream_coalesced_total",
+    "Upstream calls saved by sharing an identical call already in flight",
+    ("upstream", "operation"),
+)
+UPSTREAM_BREAKER_STATE = REGISTRY.gauge(
+    "regps_upstream_breaker_state",
+    "Circuit breaker state by upstream: 0 closed, 1 half open, 2 open",
+    ("upstream",),
+)
+UPSTREAM_BREAKER_TRIPS = REGISTRY.counter(
+    "regps_upstream_breaker_trips_total", "Times the circuit breaker opened", ("upstream",)
+)
+UPSTREAM_REJECTED = REGISTRY.counter(
+    "regps_upstream_rejected_total",
+    "Calls failed fast without reaching the upstream (reason breaker or bulkhead)",
+    ("upstream", "reason"),
+)
+UPSTREAM_TIMEOUT = REGISTRY.gauge(
+    "regps_upstream_timeout_seconds",
+    "Current read timeout of upstream calls, derived from observed latency",
+    ("upstream", "operation"),
+)
+SIGNED_HEADERS_REJECTED = REGISTRY.counter(
+    "regps_signed_headers_rejected_total",
+    "Signed requests rejected locally as stale or replayed",
+    ("reason",),
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "regps_stage_duration_seconds", "Time spent in request processing stages", ("stage",)
+)
+UPLOAD_BYTES = REGISTRY.counter(
+    "regps_upload_bytes_total", "Upload request body bytes streamed to the filer"
+)
+UPLOAD_REPORT_BYTES = REGISTRY.counter(
+    "regps_upload_report_bytes_total", "Report bytes hashed for digest verification"
+)
+UPLOAD_MEMORY_RESERVED = REGISTRY.gauge(
+    "regps_upload_memory_reserved_bytes", "Memory reserved by the uploads in progress"
+)
+UPLOAD_REJECTED = REGISTRY.counter(
+    "regps_upload_rejected_total", "Uploads turned away because the memory budget was used up"
+)
+UPLOAD_SPOOLED_BYTES = REGISTRY.counter(
+    "regps_upload_spooled_bytes_total", "Upload bytes spilled to temporary files"
+)
+
+
+def cache_collector(stats):
+    """
+    Collector for the hit/miss counters and hit ratio of the caches returned by stats(),
+    a callable returning {cache name: TTLCache.stats()}.
+    """
+
+    def collect():
+        lines = []
+        caches = stats()
+        for name, documentation, field in (
+            ("regps_cache_hits_total", "Cache hits", "hits"),
+            ("regps_cache_misses_total", "Cache misses", "misses"),
+            ("regps_cache_evictions_total", "Cache evictions", "evictions"),
+            ("regps_cache_size", "Cache entries", "size"),
+        ):
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {'gauge' if field == 'size' else 'counter'}")
+            for cache, values in caches.items():
+                lines.append(f'{name}{{cache="{cache}"}} {values[field]}')
+        lines.append("# HELP regps_cache_hit_ratio Cache hits over lookups")
+        lines.append("# TYPE regps_cache_hit_ratio gauge")
+        for cache, values in caches.items():
+            lookups = values["hits"] + values["misses"]
+            ratio = values["hits"] / lookups if lookups else 0
+            lines.append(f'regps_cache_hit_ratio{{cache="{cache}"}} {ratio}')
+        return lines
+
+    return collect
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per route latency and in-flight requests. Routes are
+    labelled with their path template so AIDs and digests do not explode cardinality.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = route_path(self.router, scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(method=method, route=route)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(method=method, route=route)
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=method, route=route, status=status["code"]
+            )
+
+
+def route_path(router, scope) -> str:
+    """
+    Path template of the route matching the request, computed once per request.
+    """
+    path = scope.get("regps.route")
+    if path is None:
+        path = "unmatched"
+        for route in router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                path = getattr(route, "path", "unmatched")
+                break
+        scope["regps.route"] = path
+    return path
@@ -1,9 +1,12 @@
+import os
+from typing import Annotated, List
+
 from fastapi import Header
 from pydantic import BaseModel, Field
 from regps.app.api.utils.swagger_examples import (
     login_examples,
     check_login_examples,
-    upload_examples, revoke_examples, add_rot_examples,
+    upload_examples, revoke_examples, add_rot_examples, check_upload_examples,
 )
 
 
@@ -55,6 +58,16 @@ class AddRootOfTrustRequest(BaseModel):
     vlei: str = Field(examples=add_rot_examples["request"]["vlei"])
     oobi: str = Field(examples=add_rot_examples["request"]["oobi"])
 
+
+BATCH_MAX = int(os.environ.get("BATCH_MAX", 1000))
+
+LoginBatchRequest = Annotated[List[LoginRequest], Field(min_length=1, max_length=BATCH_MAX)]
+
+AddRootOfTrustBatchRequest = Annotated[
+    List[AddRootOfTrustRequest], Field(min_length=1, max_length=BATCH_MAX)
+]
+
+
 class LoginResponse(BaseModel):
     aid: str = Field(examples=login_examples["response"]["aid"])
     said: str = Field(examples=login_examples["response"]["said"])
@@ -80,5 +93,13 @@ class UploadResponse(BaseModel):
     message: str = Field(examples=upload_examples["response"]["message"])
 
 
+class UploadStatusBatchRequest(BaseModel):
+    digests: List[str] = Field(
+        min_length=1,
+        max_length=int(os.environ.get("UPLOAD_STATUS_BATCH_MAX", 100)),
+        examples=[[check_upload_examples["request"]["dig"]]],
+    )
+
+
 class CheckUploadResponse(BaseModel):
     pass
@@ -1,33 +1,103 @@
-from collections import defaultdict
+import os
+
+from regps.app.api.utils.reports_store import (
+    ReportsStore,
+    MemoryReportsStore,
+    SqliteReportsStore,
+    RedisReportsStore,
+)
+
+# Filer upload statuses that are final: a retried upload of a digest whose stored report
+# has one of them is answered from the reports DB, any other status goes to the filer
+UPLOAD_FINAL_STATUSES = frozenset(
+    status.strip()
+    for status in os.environ.get("UPLOAD_FINAL_STATUSES", "verified").split(",")
+    if status.strip()
+)
+
+
+def create_store(backend: str = None) -> ReportsStore:
+    backend = (backend or os.environ.get("REPORTS_DB_BACKEND", "memory")).lower()
+    if backend == "memory":
+        return MemoryReportsStore()
+    if backend == "sqlite":
+        return SqliteReportsStore()
+    if backend == "redis":
+        return RedisReportsStore()
+    raise ValueError(f"Unknown reports db backend {backend}")
 
 
 class ReportsDB:
-    def __init__(self):
-        self.aid_reports = defaultdict(list)
-        self.lei_reports = defaultdict(list)
-        self.aid_to_lei_mapping = dict()
-        self.lei_digests = defaultdict(set)
-
-    def register_aid(self, aid, lei):
-        self.aid_to_lei_mapping[aid] = lei
-
-    def add_report(self, aid, dig, report):
-        lei = self.aid_to_lei_mapping[aid] or "-"
-        self.aid_reports[aid].append(report)
-        self.lei_reports[lei].append(report)
-        self.lei_digests[lei].add(dig)
-
-    def drop_status(self, aid):
-        self.aid_reports[aid] = []
+    def __init__(self, store: ReportsStore = None):
+        self.store = store or create_store()
+
+    async def _lei(self, aid):
+        return await self.store.get_lei(aid) or "-"
+
+    async def get_lei(self, aid):
+        return await self._lei(aid)
+
+    async def register_aid(self, aid, lei):
+        await self.store.register_aid(aid, lei)
+
+    async def register_digest(self, aid, dig):
+        await self.store.add_digest(await self._lei(aid), dig)
+
+    async def add_report(self, aid, dig, report):
+        await self.store.add_report(aid, await self._lei(aid), dig, report)
+
+    async def drop_status(self, aid):
+        await self.store.drop_reports(aid)
         return True
 
-    def get_reports_for_aid(self, aid):
-        return self.aid_reports[aid]
+    async def get_reports_for_aid(self, aid):
+        return await self.store.get_reports_for_aid(aid)
+
+    async def get_reports_for_lei(self, aid):
+        return await self.store.get_reports_for_lei(await self._lei(aid))
+
+    async def authorized_to_check_status(self, aid, dig):
+        return await self.store.has_digest(await self._lei(aid), dig)
+
+    async def authorized_digests(self, aid, digs):
+        """
+        The digests of digs the AID may check the status of, in one lookup.
+        """
+        return await self.store.has_digests(await self._lei(aid), digs)
+
+    async def get_completed_upload(self, aid, dig):
+        """
+        The stored report of an upload of dig by the AID that already completed with a
+        final status (UPLOAD_FINAL_STATUSES), or None.
+        """
+        report = await self.store.get_upload(aid, dig)
+        if isinstance(report, dict) and report.get("status") in UPLOAD_FINAL_STATUSES:
+            return report
+        return None
+
+    async def _scope_key(self, aid, scope):
+        return aid if scope == "aid" else await self._lei(aid)
+
+    async def get_reports_version(self, aid, scope="aid"):
+        """
+        Version of the AID's (scope "aid") or its LEI's (scope "lei") report list.
+        """
+        return await self.store.get_version(scope, await self._scope_key(aid, scope))
 
-    def get_reports_for_lei(self, aid):
-        lei = self.aid_to_lei_mapping[aid] or "-"
-        return self.lei_reports[lei]
+    async def get_reports_page(self, aid, scope="aid", after=0, limit=None):
+        """
+        Returns the reports added after sequence number after, at most limit of them, the
+        sequence number of the last one returned and whether more reports follow.
+        """
+        key = await self._scope_key(aid, scope)
+        items = await self.store.get_report_page(
+            scope, key, after, None if limit is None else limit + 1
+        )
+        more = limit is not None and len(items) > limit
+        if more:
+            items = items[:limit]
+        last_seq = items[-1][0] if items else after
+        return [report for _, report in items], last_seq, more
 
-    def authorized_to_check_status(self, aid, dig):
-        lei = self.aid_to_lei_mapping[aid] or "-"
-        return dig in self.lei_digests[lei]
\ No newline at end of file
+    async def close(self):
+        await self.store.close()
@@ -0,0 +1,576 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from regps.app.api.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class ReportsStore(ABC):
+    """
+    Storage interface behind ReportsDB.
+
+    get_lei raises KeyError for AIDs that were never registered. Reports are kept in
+    insertion order per AID and per LEI ("aid" and "lei" scopes). Every report gets an
+    increasing sequence number, and every list has a version that changes on each write.
+    """
+
+    @abstractmethod
+    async def register_aid(self, aid: str, lei: str):
+        ...
+
+    @abstractmethod
+    async def get_lei(self, aid: str):
+        ...
+
+    @abstractmethod
+    async def add_digest(self, lei: str, dig: str):
+        ...
+
+    @abstractmethod
+    async def add_report(self, aid: str, lei: str, dig: str, report):
+        ...
+
+    @abstractmethod
+    async def drop_reports(self, aid: str):
+        ...
+
+    @abstractmethod
+    async def get_reports_for_aid(self, aid: str) -> list:
+        ...
+
+    @abstractmethod
+    async def get_reports_for_lei(self, lei: str) -> list:
+        ...
+
+    @abstractmethod
+    async def has_digest(self, lei: str, dig: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def has_digests(self, lei: str, digs: list) -> set:
+        """
+        The digests of digs registered for the LEI.
+        """
+
+    @abstractmethod
+    async def get_upload(self, aid: str, dig: str):
+        """
+        Returns the latest report added for the AID's upload of dig, None if the upload
+        never completed or the AID's reports were dropped since.
+        """
+
+    @abstractmethod
+    async def get_report_page(self, scope: str, key: str, after: int = 0, limit: int = None) -> list:
+        """
+        Returns (seq, report) tuples of the scope's list with seq > after, oldest first.
+        """
+
+    @abstractmethod
+    async def get_version(self, scope: str, key: str) -> int:
+        ...
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryReportsStore(ReportsStore):
+    """
+    Process local store. State is lost on restart and not shared between workers.
+    """
+
+    def __init__(self):
+        self.aid_reports = defaultdict(list)
+        self.lei_reports = defaultdict(list)
+        self.aid_to_lei_mapping = dict()
+        self.lei_digests = defaultdict(set)
+        # completed uploads: aid -> {dig: report}
+        self.uploads = defaultdict(dict)
+        # sequence numbers parallel to the report lists, for cursor lookups
+        self.seqs = {"aid": defaultdict(list), "lei": defaultdict(list)}
+        self.versions = defaultdict(int)
+        self.seq = 0
+
+    async def register_aid(self, aid, lei):
+        self.aid_to_lei_mapping[aid] = lei
+
+    async def get_lei(self, aid):
+        return self.aid_to_lei_mapping[aid]
+
+    async def add_digest(self, lei, dig):
+        self.lei_digests[lei].add(dig)
+
+    async def add_report(self, aid, lei, dig, report):
+        self.seq += 1
+        self.aid_reports[aid].append(report)
+        self.lei_reports[lei].append(report)
+        self.lei_digests[lei].add(dig)
+        self.uploads[aid][dig] = report
+        self.seqs["aid"][aid].append(self.seq)
+        self.seqs["lei"][lei].append(self.seq)
+        self.versions[("aid", aid)] += 1
+        self.versions[("lei", lei)] += 1
+
+    async def drop_reports(self, aid):
+        self.aid_reports[aid] = []
+        self.uploads.pop(aid, None)
+        self.seqs["aid"][aid] = []
+        self.versions[("aid", aid)] += 1
+
+    async def get_reports_for_aid(self, aid):
+        return self.aid_reports[aid]
+
+    async def get_reports_for_lei(self, lei):
+        return self.lei_reports[lei]
+
+    async def has_digest(self, lei, dig):
+        return dig in self.lei_digests[lei]
+
+    async def has_digests(self, lei, digs):
+        return self.lei_digests[lei].intersection(digs)
+
+    async def get_upload(self, aid, dig):
+        uploads = self.uploads.get(aid)
+        return uploads.get(dig) if uploads else None
+
+    async def get_report_page(self, scope, key, after=0, limit=None):
+        reports = self.aid_reports[key] if scope == "aid" else self.lei_reports[key]
+        seqs = self.seqs[scope][key]
+        start = bisect.bisect_right(seqs, after)
+        end = len(seqs) if limit is None else start + limit
+        return list(zip(seqs[start:end], reports[start:end]))
+
+    async def get_version(self, scope, key):
+        return self.versions[(scope, key)]
+
+
+class SqliteReportsStore(ReportsStore):
+    """
+    Embedded SQLite store with indexes on (aid), (lei) and (lei, dig).
+
+    All SQLite calls run in a dedicated thread. Writes are batched and committed in a
+    single transaction once batch_size writes are pending or after flush_interval
+    seconds; reads wait for the pending writes to be committed, so they see them. Reads
+    go through a bounded in-memory cache.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS aids (
+            aid TEXT PRIMARY KEY,
+            lei TEXT
+        );
+        CREATE TABLE IF NOT EXISTS reports (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            aid TEXT NOT NULL,
+            lei TEXT NOT NULL,
+            dig TEXT NOT NULL,
+            report TEXT NOT NULL,
+            dropped INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS reports_aid ON reports (aid, seq);
+        CREATE INDEX IF NOT EXISTS reports_lei ON reports (lei, seq);
+        CREATE INDEX IF NOT EXISTS reports_upload ON reports (aid, dig, seq);
+        CREATE TABLE IF NOT EXISTS lei_digests (
+            lei TEXT NOT NULL,
+            dig TEXT NOT NULL,
+            PRIMARY KEY (lei, dig)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS versions (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID;
+    """
+
+    BUMP_VERSION = (
+        "INSERT INTO versions (scope, key, version) VALUES (?, ?, 1) "
+        "ON CONFLICT(scope, key) DO UPDATE SET version = version + 1"
+    )
+
+    def __init__(
+        self,
+        path: str = None,
+        batch_size: int = None,
+        flush_interval: float = None,
+        cache_ttl: float = None,
+        cache_size: int = None,
+    ):
+        self.path = path or os.environ.get("REPORTS_DB_PATH", "reports.db")
+        self.batch_size = batch_size or int(os.environ.get("REPORTS_DB_BATCH_SIZE", 64))
+        self.flush_interval = (
+            float(os.environ.get("REPORTS_DB_FLUSH_INTERVAL", 0.05))
+            if flush_interval is None
+            else flush_interval
+        )
+        self.cache = TTLCache(
+            float(os.environ.get("REPORTS_DB_CACHE_TTL", 5)) if cache_ttl is None else cache_ttl,
+            cache_size or int(os.environ.get("REPORTS_DB_CACHE_SIZE", 4096)),
+        )
+        # the connection is only used from this thread, so fsyncs and lock waits don't
+        # block the event loop
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="regps-reports-db")
+        self._conn = None
+        self._pending = []
+        self._queued = 0
+        self._committed = 0
+        self._waiters = []
+        self._flusher = None
+        self._wakeup = None
+        self._flush_now = False
+        # [reads in flight, invalidations since] per cache key being read
+        self._reading = {}
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+        return self._conn
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _write(self, sql: str, params: tuple, *invalidate):
+        self._pending.append((sql, params))
+        self._queued += 1
+        for key in invalidate:
+            self.cache.pop(key)
+            if key in self._reading:
+                self._reading[key][1] += 1
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        elif len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        """
+        Commit the pending writes every flush_interval seconds, or as soon as batch_size
+        are pending, until none are left. A batch that fails to commit is put back in
+        front of the queue and retried, and the reads and flushes waiting for it get
+        the error.
+        """
+        while self._pending:
+            if len(self._pending) < self.batch_size and not self._flush_now:
+                self._wakeup = asyncio.Event()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._wakeup = None
+            self._flush_now = False
+            batch, self._pending = self._pending, []
+            try:
+                await self._run(self._commit, batch)
+            except Exception as e:
+                logger.error(f"reports db: commit of {len(batch)} writes failed, retrying: {e}")
+                self._pending[:0] = batch
+                self._notify(error=e)
+                await asyncio.sleep(self.flush_interval)
+                continue
+            self._committed = self._queued - len(self._pending)
+            self._notify()
+
+    def _notify(self, error: Exception = None):
+        waiting = []
+        for target, waiter in self._waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            elif target <= self._committed:
+                waiter.set_result(None)
+            else:
+                waiting.append((target, waiter))
+        self._waiters = waiting
+
+    def _commit(self, batch):
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            for sql, params in batch:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    async def _wait_committed(self, now: bool = False):
+        """
+        Wait until the writes queued so far are committed. Reads wait for the next
+        periodic commit rather than forcing one, so writes keep being batched while
+        status polls come in; flush() and close() commit right away.
+        """
+        if not self._pending and (self._flusher is None or self._flusher.done()):
+            return
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((self._queued, waiter))
+        if now:
+            self._flush_now = True
+            if self._wakeup is not None:
+                self._wakeup.set()
+        await waiter
+
+    def _fetchall(self, sql: str, params: tuple):
+        return self._connection().execute(sql, params).fetchall()
+
+    async def _read(self, sql: str, params: tuple):
+        await self._wait_committed()
+        return await self._run(self._fetchall, sql, params)
+
+    async def _read_cached(self, key, sql: str, params: tuple, load):
+        """
+        Read through the cache. The result is only cached when no write invalidated key
+        while the query ran, as it may predate that write.
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        reading = self._reading.setdefault(key, [0, 0])
+        reading[0] += 1
+        invalidations = reading[1]
+        try:
+            value = load(await self._read(sql, params))
+        finally:
+            reading[0] -= 1
+            if not reading[0]:
+                del self._reading[key]
+        if reading[1] == invalidations:
+            self.cache.set(key, value)
+        return value
+
+    async def register_aid(self, aid, lei):
+        self._write(
+            "INSERT INTO aids (aid, lei) VALUES (?, ?) "
+            "ON CONFLICT(aid) DO UPDATE SET lei = excluded.lei",
+            (aid, lei),
+            ("lei", aid),
+        )
+        self.cache.set(("lei", aid), (lei,))
+
+    async def get_lei(self, aid):
+        def load(rows):
+            if not rows:
+                raise KeyError(aid)
+            return (rows[0][0],)
+
+        cached = await self._read_cached(
+            ("lei", aid), "SELECT lei FROM aids WHERE aid = ?", (aid,), load
+        )
+        return cached[0]
+
+    async def add_digest(self, lei, dig):
+        self._write(
+            "INSERT OR IGNORE INTO lei_digests (lei, dig) VALUES (?, ?)", (lei, dig)
+        )
+        self.cache.set(("dig", lei, dig), True)
+
+    async def add_report(self, aid, lei, dig, report):
+        self._write(
+            "INSERT INTO reports (aid, lei, dig, report) VALUES (?, ?, ?, ?)",
+            (aid, lei, dig, json.dumps(report)),
+            ("aid", aid),
+            ("lei_reports", lei),
+        )
+        self._write(self.BUMP_VERSION, ("aid", aid))
+        self._write(self.BUMP_VERSION, ("lei", lei))
+        await self.add_digest(lei, dig)
+
+    async def drop_reports(self, aid):
+        self._write(
+            "UPDATE reports SET dropped = 1 WHERE aid = ? AND dropped = 0",
+            (aid,),
+            ("aid", aid),
+        )
+        self._write(self.BUMP_VERSION, ("aid", aid))
+
+    @staticmethod
+    def _load_reports(rows):
+        return [json.loads(row[0]) for row in rows]
+
+    async def get_reports_for_aid(self, aid):
+        return await self._read_cached(
+            ("aid", aid),
+            "SELECT report FROM reports WHERE aid = ? AND dropped = 0 ORDER BY seq",
+            (aid,),
+            self._load_reports,
+        )
+
+    async def get_reports_for_lei(self, lei):
+        return await self._read_cached(
+            ("lei_reports", lei),
+            "SELECT report FROM reports WHERE lei = ? ORDER BY seq",
+            (lei,),
+            self._load_reports,
+        )
+
+    async def has_digest(self, lei, dig):
+        # digests are never removed, so only positive lookups are cached
+        if self.cache.get(("dig", lei, dig)):
+            return True
+        rows = await self._read(
+            "SELECT 1 FROM lei_digests WHERE lei = ? AND dig = ?", (lei, dig)
+        )
+        if rows:
+            self.cache.set(("dig", lei, dig), True)
+        return bool(rows)
+
+    async def has_digests(self, lei, digs):
+        found = {dig for dig in digs if self.cache.get(("dig", lei, dig))}
+        missing = [dig for dig in set(digs) if dig not in found]
+        # in batches below SQLite's host parameter limit
+        for i in range(0, len(missing), 500):
+            batch = missing[i:i + 500]
+            rows = await self._read(
+                f"SELECT dig FROM lei_digests WHERE lei = ? AND dig IN ({', '.join('?' * len(batch))})",
+                (lei, *batch),
+            )
+            for (dig,) in rows:
+                self.cache.set(("dig", lei, dig), True)
+                found.add(dig)
+        return found
+
+    async def get_upload(self, aid, dig):
+        rows = await self._read(
+            "SELECT report FROM reports WHERE aid = ? AND dig = ? AND dropped = 0 "
+            "ORDER BY seq DESC LIMIT 1",
+            (aid, dig),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    async def get_report_page(self, scope, key, after=0, limit=None):
+        if scope == "aid":
+            sql = "SELECT seq, report FROM reports WHERE aid = ? AND dropped = 0 AND seq > ? ORDER BY seq LIMIT ?"
+        else:
+            sql = "SELECT seq, report FROM reports WHERE lei = ? AND seq > ? ORDER BY seq LIMIT ?"
+        rows = await self._read(sql, (key, after, -1 if limit is None else limit))
+        return [(seq, json.loads(report)) for seq, report in rows]
+
+    async def get_version(self, scope, key):
+        rows = await self._read(
+            "SELECT version FROM versions WHERE scope = ? AND key = ?", (scope, key)
+        )
+        return rows[0][0] if rows else 0
+
+    async def flush(self):
+        await self._wait_committed(now=True)
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            if self._flusher is not None:
+                self._flusher.cancel()
+            await self._run(self._close_connection)
+            self._executor.shutdown(wait=False)
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RedisReportsStore(ReportsStore):
+    """
+    Redis store shared by all workers and nodes. Uses a hash for aid -> lei, a set of
+    digests per LEI, sorted sets of reports, scored by sequence number, per AID and
+    per LEI, and a hash of completed uploads (dig -> report) per AID. Writes are pipelined.
+    """
+
+    def __init__(self, client=None, url: str = None, prefix: str = None):
+        if client is None:
+            from redis import asyncio as aioredis
+
+            client = aioredis.Redis.from_url(
+                url or os.environ.get("REPORTS_DB_REDIS_URL", "redis://localhost:6379/0"),
+                max_connections=int(os.environ.get("REPORTS_DB_REDIS_MAX_CONNECTIONS", 50)),
+            )
+        self.client = client
+        self.prefix = prefix or os.environ.get("REPORTS_DB_REDIS_PREFIX", "regps")
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    async def register_aid(self, aid, lei):
+        await self.client.hset(self._key("aid_lei"), aid, json.dumps(lei))
+
+    async def get_lei(self, aid):
+        lei = await self.client.hget(self._key("aid_lei"), aid)
+        if lei is None:
+            raise KeyError(aid)
+        return json.loads(lei)
+
+    async def add_digest(self, lei, dig):
+        await self.client.sadd(self._key("lei_digests", lei), dig)
+
+    async def add_report(self, aid, lei, dig, report):
+        seq = await self.client.incr(self._key("seq"))
+        member = json.dumps([seq, report])
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._key("aid_reports", aid), {member: seq})
+            pipe.zadd(self._key("lei_reports", lei), {member: seq})
+            pipe.sadd(self._key("lei_digests", lei), dig)
+            pipe.hset(self._key("uploads", aid), dig, json.dumps(report))
+            pipe.hincrby(self._key("versions"), f"aid:{aid}", 1)
+            pipe.hincrby(self._key("versions"), f"lei:{lei}", 1)
+            await pipe.execute()
+
+    async def drop_reports(self, aid):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key("aid_reports", aid))
+            pipe.delete(self._key("uploads", aid))
+            pipe.hincrby(self._key("versions"), f"aid:{aid}", 1)
+            await pipe.execute()
+
+    async def get_reports_for_aid(self, aid):
+        return [report for _, report in await self.get_report_page("aid", aid)]
+
+    async def get_reports_for_lei(self, lei):
+        return [report for _, report in await self.get_report_page("lei", lei)]
+
+    async def has_digest(self, lei, dig):
+        return bool(await self.client.sismember(self._key("lei_digests", lei), dig))
+
+    async def has_digests(self, lei, digs):
+        digs = list(dict.fromkeys(digs))
+        if not digs:
+            return set()
+        members = await self.client.smismember(self._key("lei_digests", lei), digs)
+        return {dig for dig, member in zip(digs, members) if member}
+
+    async def get_upload(self, aid, dig):
+        report = await self.client.hget(self._key("uploads", aid), dig)
+        return None if report is None else json.loads(report)
+
+    async def get_report_page(self, scope, key, after=0, limit=None):
+        if limit is None:
+            members = await self.client.zrangebyscore(
+                self._key(f"{scope}_reports", key), f"({after}", "+inf"
+            )
+        else:
+            members = await self.client.zrangebyscore(
+                self._key(f"{scope}_reports", key), f"({after}", "+inf", start=0, num=limit
+            )
+        return [tuple(json.loads(member)) for member in members]
+
+    async def get_version(self, scope, key):
+        version = await self.client.hget(self._key("versions"), f"{scope}:{key}")
+        return int(version) if version is not None else 0
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,43 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the call and
+    the others await its result instead of making their own. Nothing is cached, the key
+    is forgotten as soon as the call completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """
+        Returns the result of fn(), or of the call already in flight for key. A caller
+        being cancelled doesn't cancel the call for the others.
+        """
+        loop = asyncio.get_running_loop()
+        task = self._calls.get(key)
+        if task is None or task.get_loop() is not loop:
+            self.calls += 1
+            task = loop.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # retrieved here so an exception nobody awaited anymore isn't logged
+            task.exception()
+
+    def pending(self, key) -> bool:
+        return key in self._calls
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._calls)}
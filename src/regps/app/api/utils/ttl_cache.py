@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a time to live in seconds.
+    Keeps hit, miss and eviction counters.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024, timer=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.timer = timer
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires <= self.timer():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """
+        The live value of key, without counting a hit or miss or refreshing its LRU order.
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= self.timer():
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self.timer()
+
+    def __len__(self):
+        return len(self._data)
@@ -8,12 +8,12 @@ regulation portal servicecommand line interface
 
 import argparse
 
-# from regps.app import service
+from regps.app import server
 
 d = "Runs regulation portal service\n"
 d += "\tExample:\nregps\n"
 parser = argparse.ArgumentParser(description=d)
-# parser.set_defaults(handler=lambda args: launch(args))
+parser.set_defaults(handler=lambda args: launch(args))
 parser.add_argument(
     "-V",
     "--version",
@@ -21,10 +21,8 @@ parser.add_argument(
     version="0.0.1",
     help="Prints out version of script runner.",
 )
-parser.add_argument(
-    "-p",
-    "--port",
-    action="store",
-    default=4902,
-    help="Local port number the HTTP server listens on. Default is 4902.",
-)
+server.add_arguments(parser)
+
+
+def launch(args):
+    server.serve(args)
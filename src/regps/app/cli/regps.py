@@ -7,7 +7,6 @@ regps.app.cli.commands module
 
 import logging
 import multicommand
-import regps.app.fastapi_app as fastapi_app
 from regps import __version__
 from regps.app.cli import commands
 
@@ -23,16 +22,18 @@ def main():
 
     try:
         logging.info(
-            "******* Starting regulation portal service for %s listening: http/%s "
+            "******* Starting regulation portal service listening: http/%s:%s "
             ".******",
-            args.http,
+            args.host,
+            args.port,
         )
 
-        fastapi_app.main()
+        args.handler(args)
 
         logging.info(
-            "******* Ended reg portal service %s listening: http/%s" ".******",
-            args.http,
+            "******* Ended reg portal service listening: http/%s:%s" ".******",
+            args.host,
+            args.port,
         )
 
     except Exception as ex:
@@ -1,6 +1,10 @@
+import asyncio
+import json
 import os
+from contextlib import aclosing, asynccontextmanager
 from regps.app.api.signed_headers_verifier import logger, VerifySignedHeaders
 from fastapi import (
+    BackgroundTasks,
     FastAPI,
     Header,
     HTTPException,
@@ -9,18 +13,26 @@ from fastapi import (
     Response,
     Query
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from regps.app.api.utils.pydantic_models import (
     LoginRequest,
     LoginResponse,
     CheckLoginResponse,
     UploadResponse, PresentRevocationRequest, PresentRevocationResponse, AddRootOfTrustRequest, AddRootOfTrustResponse,
+    UploadStatusBatchRequest, LoginBatchRequest, AddRootOfTrustBatchRequest,
 )
 from regps.app.api.exceptions import (
     VerifierServiceException, VerifySignedHeadersException,
 )
 from regps.app.api.controllers import APIController
+from regps.app.api.status_broker import UploadStatusBroker
+from regps.app.api.utils.logging_config import (
+    LoggingContextMiddleware,
+    Preview,
+    configure_logging,
+)
+from regps.app.api.utils.metrics import REGISTRY, MetricsMiddleware, cache_collector
 from regps.app.api.utils.reports_db import ReportsDB
 from regps.app.api.utils.swagger_examples import (
     check_login_examples,
@@ -28,15 +40,44 @@ from regps.app.api.utils.swagger_examples import (
     check_upload_examples,
 )
 
+configure_logging()
+
+api_controller = APIController()
+verify_signed_headers = VerifySignedHeaders(api_controller)
+reports_db = ReportsDB()
+status_broker = UploadStatusBroker()
+REGISTRY.add_collector(cache_collector(api_controller.cache_stats))
+
+# Default for the upload route's wait query param. When false, uploads return 202 with a
+# status URL as soon as the filer accepts the body and the result is confirmed in the background.
+UPLOAD_WAIT_FOR_CONFIRMATION = os.getenv("UPLOAD_WAIT_FOR_CONFIRMATION", "true").lower() in ("true", "1")
+FILER_UPLOAD_BACKGROUND_DEADLINE = float(os.getenv("FILER_UPLOAD_BACKGROUND_DEADLINE", 300))
+# Status streams send a keep-alive comment after this many idle seconds and are closed
+# after the timeout, clients reconnect with since=<last seq>.
+UPLOAD_STATUS_HEARTBEAT = float(os.getenv("UPLOAD_STATUS_HEARTBEAT", 15))
+UPLOAD_STATUS_STREAM_TIMEOUT = float(os.getenv("UPLOAD_STATUS_STREAM_TIMEOUT", 300))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the upstream connection pools on startup and close them and the reports db on shutdown.
+    """
+    api_controller.open()
+    yield
+    await status_broker.aclose()
+    await api_controller.aclose()
+    await reports_db.close()
+
+
 app = FastAPI(
     title="Regulator portal service api",
     description="Regulator web portal service api",
     version="1.0.0",
+    lifespan=lifespan,
 )
-
-api_controller = APIController()
-verify_signed_headers = VerifySignedHeaders(api_controller)
-reports_db = ReportsDB()
+app.add_middleware(LoggingContextMiddleware, router=app.router)
+app.add_middleware(MetricsMiddleware, router=app.router)
 
 
 @app.get("/ping")
@@ -47,24 +88,70 @@ async def ping():
     return "Pong"
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit, miss and eviction counters of the authorization and key state caches.
+    """
+    return api_controller.cache_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics of this worker: route and upstream latencies, in-flight requests,
+    upstream errors, upload bytes and cache hit ratios.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/login", response_model=LoginResponse)
 async def login(response: Response, data: LoginRequest):
     """
     Given an AID and vLEI, returns information about the login
     """
     try:
-        logger.info(f"Login: sending login cred {str(data)[:50]}...")
-        resp = api_controller.login(data.said, data.vlei)
+        logger.info("Login: sending login cred %s", Preview(data, 50))
+        resp = await api_controller.login(data.said, data.vlei)
         return JSONResponse(status_code=202, content=resp)
     except VerifierServiceException as e:
         logger.error(f"Login: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"Login: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def ndjson_results(results):
+    """
+    Stream the (index, status code, body) results of a batch as NDJSON, one line per item.
+    """
+
+    async def lines():
+        # closed right away when the client goes, cancelling the calls still pending
+        async with aclosing(results):
+            async for index, status_code, result in results:
+                yield json.dumps({"index": index, "status_code": status_code, "result": result}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/login/batch")
+async def login_batch(data: LoginBatchRequest):
+    """
+    Logs in a batch of AIDs and vLEIs, verified concurrently. Streams one NDJSON line per
+    credential as its verification completes, with its index in the request, status
+    code and the login response or error.
+    """
+    logger.info("LoginBatch: sending %s login creds", len(data))
+    return ndjson_results(
+        api_controller.fan_out(
+            [lambda item=item: api_controller.login(item.said, item.vlei) for item in data]
+        )
+    )
+
+
 @app.post("/present_revocation", response_model=PresentRevocationResponse)
 async def present_revocation(
         request: Request,
@@ -106,18 +193,19 @@ async def present_revocation(
     Given an AID and vLEI, returns information about the revocation
     """
     try:
-        verify_signed_headers.process_request(request, None, False)
-        logger.info(f"PresentRevocation: sending login cred {str(data)[:50]}...")
-        resp = api_controller.login(data.said, data.vlei)
+        await verify_signed_headers.process_request(request, None, False)
+        logger.info("PresentRevocation: sending login cred %s", Preview(data, 50))
+        resp = await api_controller.login(data.said, data.vlei)
+        api_controller.invalidate_login(request.headers.get("SIGNIFY-RESOURCE"))
         return JSONResponse(status_code=202, content=resp)
     except VerifierServiceException as e:
         logger.error(f"PresentRevocation: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except HTTPException as e:
         logger.error(f"PresentRevocation: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"PresentRevocation: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -133,22 +221,40 @@ async def add_root_of_trust(
     Given a vLEI, adds the root of trust to the verifier
     """
     try:
-        logger.info(f"AddRootOfTrust: sending add root of trust request {str(data)[:50]}...")
-        resp = api_controller.add_root_of_trust(data.aid, data.vlei, data.oobi)
+        logger.info("AddRootOfTrust: sending add root of trust request %s", Preview(data, 50))
+        resp = await api_controller.add_root_of_trust(data.aid, data.vlei, data.oobi)
         return JSONResponse(status_code=202, content=resp)
     except VerifierServiceException as e:
         logger.error(f"AddRootOfTrust: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except HTTPException as e:
         logger.error(f"AddRootOfTrust: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"AddRootOfTrust: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/add_root_of_trust/batch")
+async def add_root_of_trust_batch(data: AddRootOfTrustBatchRequest):
+    """
+    Adds a batch of roots of trust to the verifier concurrently. Streams one NDJSON line
+    per root of trust as it completes, with its index in the request, status code and
+    the verifier response or error.
+    """
+    logger.info("AddRootOfTrustBatch: sending %s add root of trust requests", len(data))
+    return ndjson_results(
+        api_controller.fan_out(
+            [
+                lambda item=item: api_controller.add_root_of_trust(item.aid, item.vlei, item.oobi)
+                for item in data
+            ]
+        )
+    )
+
+
 @app.get("/checklogin/{aid}", response_model=CheckLoginResponse)
 async def check_login_route(
         request: Request,
@@ -200,17 +306,17 @@ async def check_login_route(
     Given an AID returns information about the login
     """
     try:
-        logger.info(f"CheckLogin: sending aid {aid}")
-        verify_signed_headers.process_request(request, aid, False)
-        resp = api_controller.check_login(aid)
+        logger.debug("CheckLogin: sending aid %s", aid)
+        await verify_signed_headers.process_request(request, aid, False)
+        resp = await api_controller.check_login(aid)
         lei = resp.get("lei")
         aid = resp.get("aid")
-        reports_db.register_aid(aid, lei)
+        await reports_db.register_aid(aid, lei)
         return JSONResponse(status_code=200, content=resp)
     except (VerifierServiceException, VerifySignedHeadersException) as e:
         logger.error(f"CheckLogin: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"CheckLogin: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -221,6 +327,7 @@ async def check_login_route(
 async def upload_route(
         request: Request,
         response: Response,
+        background_tasks: BackgroundTasks,
         aid: str = Path(
             ...,
             description="AID",
@@ -273,40 +380,97 @@ async def upload_route(
                 }
             }
         ),
+        wait: bool = Query(
+            UPLOAD_WAIT_FOR_CONFIRMATION,
+            description="Wait for the filer to confirm the upload. "
+                        "If false, returns 202 with a status URL once the filer accepts the report.",
+        ),
 ):
     """
     Given an AID and DIG, returns information about the upload
     """
     try:
-        verify_signed_headers.process_request(request, aid)
-        raw = await request.body()
-        form = await request.form()
-        upload = form.get("upload")
-        report = await upload.read()
-        logger.info(
-            f"Upload: request for {aid} {dig} {raw} {request.headers.get('Content-Type')}"
-        )
-        resp = api_controller.upload(
-            aid, dig, report, request.headers.get("Content-Type"), raw
+        await verify_signed_headers.process_request(request, aid)
+        # retried uploads are answered before the body is read
+        completed = await reports_db.get_completed_upload(aid, dig)
+        if completed is not None:
+            logger.info("Upload: %s %s already completed, returning stored report", aid, dig)
+            return JSONResponse(status_code=200, content=completed)
+        if status_broker.watching(aid, dig):
+            logger.info("Upload: %s %s already accepted and being confirmed", aid, dig)
+            status_url = str(request.url_for("check_upload_route", aid=aid, dig=dig))
+            return JSONResponse(
+                status_code=202,
+                content={"submitter": aid, "dig": dig, "status": "accepted", "status_url": status_url},
+                headers={"Location": status_url},
+            )
+        contype = request.headers.get("Content-Type")
+        logger.info("Upload: request for %s %s %s", aid, dig, contype)
+        resp = await api_controller.upload(
+            aid, dig, contype, request.stream(), request.headers.get("Content-Length"), wait
         )
+        body = resp.json()
 
         if resp.status_code >= 400:
-            logger.info(f"Upload failed {resp.json()}")
+            logger.info("Upload failed %s", Preview(resp))
+        elif not wait and resp.status_code == 202:
+            logger.info("Upload: accepted upload for %s %s, confirming in background", aid, dig)
+            await reports_db.register_digest(aid, dig)
+            await publish_status(aid, dig, "accepted")
+            background_tasks.add_task(track_upload, aid, dig)
+            status_url = str(request.url_for("check_upload_route", aid=aid, dig=dig))
+            content = {**body, "status_url": status_url}
+            return JSONResponse(status_code=202, content=content, headers={"Location": status_url})
         else:
             logger.info(
-                f"Upload: completed upload for {aid} {dig} with code {resp.status_code}"
+                "Upload: completed upload for %s %s with code %s", aid, dig, resp.status_code
             )
-            reports_db.add_report(aid, dig, resp.json())
-        return JSONResponse(status_code=resp.status_code, content=resp.json())
+            await reports_db.add_report(aid, dig, body)
+            await publish_status(aid, dig, "report", body)
+        return JSONResponse(status_code=resp.status_code, content=body)
     except HTTPException as e:
         logger.error(f"Upload: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"Upload: Unknown Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def publish_status(aid: str, dig: str, status: str, report=None):
+    """
+    Push an upload status transition to the AID's and LEI's status streams.
+    """
+    event = {"aid": aid, "dig": dig, "status": status}
+    if report is not None:
+        event["report"] = report
+    status_broker.publish(aid, await reports_db.get_lei(aid), event)
+
+
+async def confirm_upload(aid: str, dig: str):
+    """
+    Background confirmation for uploads accepted without waiting.
+    """
+    try:
+        resp = await api_controller.wait_for_upload(aid, dig, FILER_UPLOAD_BACKGROUND_DEADLINE)
+        if resp.status_code == 200:
+            logger.info("Upload: confirmed upload for %s %s", aid, dig)
+            await reports_db.add_report(aid, dig, resp.json())
+            await publish_status(aid, dig, "report", resp.json())
+        else:
+            logger.info("Upload: could not confirm upload for %s %s: %s", aid, dig, resp.status_code)
+            await publish_status(aid, dig, "unconfirmed")
+    except Exception as e:
+        logger.error(f"Upload: confirmation Exception: {e}")
+
+
+async def track_upload(aid: str, dig: str):
+    """
+    Confirm the upload through the status broker, so there is one poll loop per digest.
+    """
+    await asyncio.shield(status_broker.watch(aid, dig, lambda: confirm_upload(aid, dig)))
+
+
 @app.get("/upload/{aid}/{dig}")
 async def check_upload_route(
         request: Request,
@@ -368,24 +532,103 @@ async def check_upload_route(
     Check upload status by aid and dig.
     """
     try:
-        verify_signed_headers.process_request(request, aid)
-        if not reports_db.authorized_to_check_status(aid, dig):
+        await verify_signed_headers.process_request(request, aid)
+        if not await reports_db.authorized_to_check_status(aid, dig):
             raise HTTPException(status_code=401, detail=f"AID {aid} is not authorized to check status for digest {dig}")
-        resp = api_controller.check_upload(aid, dig)
+        resp = await api_controller.check_upload(aid, dig)
         return JSONResponse(status_code=200, content=resp)
     except VerifierServiceException as e:
         logger.error(f"CheckUpload: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except HTTPException as e:
         logger.error(f"CheckUpload: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"CheckUpload: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/uploads/{aid}/status")
+async def check_uploads_route(
+        request: Request,
+        response: Response,
+        data: UploadStatusBatchRequest,
+        aid: str = Path(
+            ...,
+            description="AID",
+            openapi_examples={
+                "default": {
+                    "summary": "Default AID",
+                    "value": check_upload_examples["request"]["aid"],
+                }
+            },
+        ),
+        signature: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signature",
+                    "value": upload_examples["request"]["headers"]["signature"],
+                }
+            }
+        ),
+        signature_input: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signature_input",
+                    "value": upload_examples["request"]["headers"]["signature_input"],
+                }
+            }
+        ),
+        signify_resource: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signify_resource",
+                    "value": upload_examples["request"]["headers"]["signify_resource"],
+                }
+            }
+        ),
+        signify_timestamp: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signify_timestamp",
+                    "value": upload_examples["request"]["headers"]["signify_timestamp"],
+                }
+            }
+        ),
+):
+    """
+    Check the upload status of several digests at once. The signed headers are verified
+    once for the batch and the statuses are fetched from the filer concurrently. Every
+    digest gets its own status code, in the order they were requested.
+    """
+    try:
+        await verify_signed_headers.process_request(request, aid)
+        digs = list(dict.fromkeys(data.digests))
+        authorized = await reports_db.authorized_digests(aid, digs)
+        statuses = await api_controller.check_uploads(aid, [dig for dig in digs if dig in authorized])
+        results = []
+        for dig in digs:
+            status_code, status = statuses.get(dig) or (
+                401,
+                f"AID {aid} is not authorized to check status for digest {dig}",
+            )
+            results.append({"dig": dig, "status_code": status_code, "status": status})
+        return JSONResponse(status_code=200, content=results)
+    except VerifierServiceException as e:
+        logger.error(f"CheckUploads: Exception: {e}")
+        response.status_code = e.status_code
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
+    except HTTPException as e:
+        logger.error(f"CheckUploads: Exception: {e}")
+        response.status_code = e.status_code
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
+    except Exception as e:
+        logger.error(f"CheckUploads: Exception: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/admin/upload_statuses/{aid}")
 async def get_upload_statuses_admin(
         request: Request,
@@ -448,22 +691,47 @@ async def get_upload_statuses_admin(
     Check upload status by aid and dig.
     """
     try:
-        verify_signed_headers.process_request(request, aid)
-        resp = api_controller.get_upload_statuses_admin(aid, lei)
+        await verify_signed_headers.process_request(request, aid)
+        resp = await api_controller.get_upload_statuses_admin(aid, lei)
         return JSONResponse(status_code=200, content=resp)
     except VerifierServiceException as e:
         logger.error(f"CheckUpload: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except HTTPException as e:
         logger.error(f"CheckUpload: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"CheckUpload: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def reports_page_response(
+        request: Request, aid: str, scope: str, limit: int, cursor: str, since: int
+):
+    """
+    Page of the AID's (scope "aid") or LEI's (scope "lei") reports. The list version is
+    returned as a weak ETag so unchanged polls get 304 Not Modified.
+    """
+    if cursor is not None:
+        try:
+            after = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor}")
+    else:
+        after = since or 0
+    version = await reports_db.get_reports_version(aid, scope)
+    etag = f'W/"{version}:{after}:{limit or 0}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    reports, last_seq, more = await reports_db.get_reports_page(aid, scope, after, limit)
+    headers = {"ETag": etag, "X-Last-Seq": str(last_seq)}
+    if more:
+        headers["X-Next-Cursor"] = str(last_seq)
+    return JSONResponse(status_code=202, content=reports, headers=headers)
+
+
 @app.get("/status/{aid}")
 async def status_route(
         request: Request,
@@ -510,18 +778,30 @@ async def status_route(
                 }
             }
         ),
+        limit: int = Query(
+            None,
+            ge=1,
+            description="Max number of reports to return. The next page starts at the X-Next-Cursor header.",
+        ),
+        cursor: str = Query(
+            None, description="X-Next-Cursor value returned by the previous page."
+        ),
+        since: int = Query(
+            None,
+            ge=0,
+            description="Only return reports added after this sequence number (X-Last-Seq of a previous poll).",
+        ),
 ):
     """
     Check upload status by aid.
     """
     try:
-        verify_signed_headers.process_request(request, aid)
-        resp = reports_db.get_reports_for_aid(aid)
-        return JSONResponse(status_code=202, content=resp)
+        await verify_signed_headers.process_request(request, aid)
+        return await reports_page_response(request, aid, "aid", limit, cursor, since)
     except HTTPException as e:
         logger.error(f"Status: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"Status: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -573,26 +853,217 @@ async def status_for_lei_route(
                 }
             }
         ),
+        limit: int = Query(
+            None,
+            ge=1,
+            description="Max number of reports to return. The next page starts at the X-Next-Cursor header.",
+        ),
+        cursor: str = Query(
+            None, description="X-Next-Cursor value returned by the previous page."
+        ),
+        since: int = Query(
+            None,
+            ge=0,
+            description="Only return reports added after this sequence number (X-Last-Seq of a previous poll).",
+        ),
 ):
     """
     Check upload status by aid.
     """
     try:
-        verify_signed_headers.process_request(request, aid)
-        resp = reports_db.get_reports_for_lei(aid)
-        return JSONResponse(status_code=202, content=resp)
+        await verify_signed_headers.process_request(request, aid)
+        return await reports_page_response(request, aid, "lei", limit, cursor, since)
     except VerifierServiceException as e:
         logger.error(f"Status: Exception: {e}")
         response.status_code = e.status_code
-        return JSONResponse(content=e.detail, status_code=e.status_code)
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
+    except HTTPException as e:
+        logger.error(f"Status: Exception: {e}")
+        response.status_code = e.status_code
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
     except Exception as e:
         logger.error(f"Status: Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def status_stream_response(request: Request, aid: str, scope: str, since: int):
+    """
+    Subscribe to the AID's (scope "aid") or LEI's (scope "lei") status transitions and
+    stream them as server-sent events, after replaying the reports added since the given
+    sequence number.
+    """
+    key = aid if scope == "aid" else await reports_db.get_lei(aid)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + UPLOAD_STATUS_STREAM_TIMEOUT
+        # subscribed before the replay so no transition is missed, and only once the
+        # response streams so a client gone before that doesn't leave its queue behind
+        queue = status_broker.subscribe(scope, key)
+        try:
+            if since is not None:
+                reports, last_seq, _ = await reports_db.get_reports_page(aid, scope, since)
+                for report in reports:
+                    yield sse_event("report", {"status": "report", "report": report})
+                yield sse_event("sync", {"last_seq": last_seq})
+            async for event in status_broker.events(scope, key, UPLOAD_STATUS_HEARTBEAT, queue):
+                if event is not None:
+                    yield sse_event(event["status"], event)
+                if loop.time() >= expires or await request.is_disconnected():
+                    break
+                if event is None:
+                    yield ": keep-alive\n\n"
+        finally:
+            status_broker.unsubscribe(scope, key, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/status/{aid}/stream")
+async def status_stream_route(
+        request: Request,
+        response: Response,
+        aid: str = Path(
+            ...,
+            description="AID",
+            openapi_examples={
+                "default": {
+                    "summary": "Default AID",
+                    "value": check_upload_examples["request"]["aid"],
+                }
+            },
+        ),
+        signature: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signature for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signature"],
+                }
+            }
+        ),
+        signature_input: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signature_input for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signature_input"],
+                }
+            }
+        ),
+        signify_resource: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signify_resource for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signify_resource"],
+                }
+            }
+        ),
+        signify_timestamp: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signify_timestamp for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signify_timestamp"],
+                }
+            }
+        ),
+        since: int = Query(
+            None,
+            ge=0,
+            description="Replay the reports added after this sequence number (X-Last-Seq) before streaming.",
+        ),
+):
+    """
+    Server-sent events stream of the upload status transitions of the AID.
+    """
+    try:
+        await verify_signed_headers.process_request(request, aid)
+        return await status_stream_response(request, aid, "aid", since)
+    except HTTPException as e:
+        logger.error(f"StatusStream: Exception: {e}")
+        response.status_code = e.status_code
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
+    except Exception as e:
+        logger.error(f"StatusStream: Exception: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/report/status/lei/{aid}/stream")
+async def status_for_lei_stream_route(
+        request: Request,
+        response: Response,
+        aid: str = Path(
+            ...,
+            description="AID",
+            openapi_examples={
+                "default": {
+                    "summary": "Default AID. Must have logged into the verifier with a role credential specifying the LEI.",
+                    "value": check_upload_examples["request"]["aid"],
+                }
+            },
+        ),
+        signature: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signature for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signature"],
+                }
+            }
+        ),
+        signature_input: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signature_input for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signature_input"],
+                }
+            }
+        ),
+        signify_resource: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signify_resource for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signify_resource"],
+                }
+            }
+        ),
+        signify_timestamp: str = Header(
+            openapi_examples={
+                "default": {
+                    "summary": "Default signify_timestamp for signed headers.",
+                    "value": upload_examples["request"]["headers"]["signify_timestamp"],
+                }
+            }
+        ),
+        since: int = Query(
+            None,
+            ge=0,
+            description="Replay the reports added after this sequence number (X-Last-Seq) before streaming.",
+        ),
+):
+    """
+    Server-sent events stream of the upload status transitions of the AID's LEI.
+    """
+    try:
+        await verify_signed_headers.process_request(request, aid)
+        return await status_stream_response(request, aid, "lei", since)
+    except HTTPException as e:
+        logger.error(f"StatusStream: Exception: {e}")
+        response.status_code = e.status_code
+        return JSONResponse(content=e.detail, status_code=e.status_code, headers=e.headers)
+    except Exception as e:
+        logger.error(f"StatusStream: Exception: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # TODO: Remove this endpoint when we will have DB. IT's only for tests
 @app.post("/status/{aid}/drop")
-def clear_status_route(
+async def clear_status_route(
         request: Request,
         aid: str = Path(
             ...,
@@ -608,8 +1079,8 @@ def clear_status_route(
     """
     Drop upload status for specified AID. For the test purposes
     """
-    verify_signed_headers.process_request(request, aid)
-    reports_db.drop_status(aid)
+    await verify_signed_headers.process_request(request, aid)
+    await reports_db.drop_status(aid)
     resp = {"status": "success", "aid": aid}
     return JSONResponse(status_code=202, content=resp)
 
@@ -630,15 +1101,20 @@ if os.getenv("ENABLE_CORS", "true").lower() in ("true", "1"):
             "signature-input",
             "signify-resource",
             "signify-timestamp",
+            "etag",
+            "x-last-seq",
+            "x-next-cursor",
         ],
     )
 
 
 def main():
     logger.info("Starting Reg-Pilot-API")
-    import uvicorn
+    import argparse
+    from regps.app import server
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = server.add_arguments(argparse.ArgumentParser(description="Runs regulation portal service"))
+    server.serve(parser.parse_args())
 
 
 if __name__ == "__main__":
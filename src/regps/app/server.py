@@ -0,0 +1,157 @@
+import logging
+import os
+
+from regps.app.api.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+APP = "regps.app.fastapi_app:app"
+
+
+def default_workers() -> int:
+    """
+    REGPS_WORKERS, otherwise a single worker: caches, the replay guard, status streams,
+    the upload memory budget and metrics are per worker process, so more workers are
+    opted into explicitly.
+    """
+    return int(os.environ.get("REGPS_WORKERS", 1))
+
+
+def add_arguments(parser):
+    """
+    Server options shared by `reg-pilot-api start` and `python fastapi_app.py`.
+    """
+    parser.add_argument(
+        "--host",
+        action="store",
+        default=os.environ.get("REGPS_HOST", "0.0.0.0"),
+        help="Interface the HTTP server binds to. Default is 0.0.0.0.",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        action="store",
+        type=int,
+        default=int(os.environ.get("REGPS_PORT", 8000)),
+        help="Local port number the HTTP server listens on. Default is 8000.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        default=None,
+        help="Number of worker processes. Default is 1.",
+    )
+    parser.add_argument(
+        "--server",
+        choices=["uvicorn", "gunicorn"],
+        default=os.environ.get("REGPS_SERVER", "uvicorn"),
+        help="Run uvicorn directly or gunicorn managing uvicorn workers. Default is uvicorn.",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=["auto", "asyncio", "uvloop"],
+        default=os.environ.get("REGPS_LOOP", "auto"),
+        help="Event loop implementation, auto uses uvloop when installed. Default is auto.",
+    )
+    parser.add_argument(
+        "--http",
+        choices=["auto", "h11", "httptools"],
+        default=os.environ.get("REGPS_HTTP", "auto"),
+        help="HTTP protocol implementation, auto uses httptools when installed. Default is auto.",
+    )
+    parser.add_argument(
+        "--backlog",
+        action="store",
+        type=int,
+        default=int(os.environ.get("REGPS_BACKLOG", 2048)),
+        help="Max number of pending connections. Default is 2048.",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        action="store",
+        type=int,
+        default=int(os.environ.get("REGPS_KEEP_ALIVE", 5)),
+        help="Seconds to keep idle client connections open. Default is 5.",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        action="store",
+        type=int,
+        default=int(os.environ["REGPS_LIMIT_CONCURRENCY"]) if "REGPS_LIMIT_CONCURRENCY" in os.environ else None,
+        help="Max concurrent connections and tasks per worker before answering 503. Default is unlimited.",
+    )
+    parser.add_argument(
+        "--no-access-log",
+        dest="access_log",
+        action="store_false",
+        default=os.environ.get("REGPS_ACCESS_LOG", "true").lower() in ("true", "1"),
+        help="Do not log every request.",
+    )
+    return parser
+
+
+def serve(args):
+    configure_logging()
+    workers = args.workers or default_workers()
+    # inherited by the workers, which size their per-process caches by it
+    os.environ["REGPS_WORKERS"] = str(workers)
+    logger.info(
+        f"starting {args.server} on {args.host}:{args.port} with {workers} workers "
+        f"(loop {args.loop}, http {args.http})"
+    )
+    if workers > 1 and os.environ.get("REPORTS_DB_BACKEND", "memory").lower() == "memory":
+        logger.warning(
+            "running several workers with the in-memory reports db, each worker sees only its own reports"
+        )
+    if args.server == "gunicorn":
+        run_gunicorn(args, workers)
+    else:
+        run_uvicorn(args, workers)
+
+
+def run_uvicorn(args, workers: int):
+    import uvicorn
+
+    uvicorn.run(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        access_log=args.access_log,
+    )
+
+
+def run_gunicorn(args, workers: int):
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {
+            "loop": args.loop,
+            "http": args.http,
+            "limit_concurrency": args.limit_concurrency,
+        }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", Worker)
+            self.cfg.set("backlog", args.backlog)
+            self.cfg.set("keepalive", args.keep_alive)
+            if args.access_log:
+                self.cfg.set("accesslog", "-")
+
+        def load(self):
+            from regps.app.fastapi_app import app
+
+            return app
+
+    Application().run()
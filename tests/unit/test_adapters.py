@@ -0,0 +1,252 @@
+import asyncio
+
+import httpx
+
+from regps.app.adapters.resilience import CircuitBreaker, LatencyTracker
+from regps.app.api.exceptions import UpstreamUnavailableException
+from regps.app.adapters.verifier_service_adapter import (
+    VerifierServiceAdapter,
+    FilerServiceAdapter,
+)
+
+
+def test_adapter_reuses_pooled_client():
+    AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(request.url.path)
+        return httpx.Response(200, json={"aid": AID, "lei": "875500ELOZEL05BVXV37"})
+
+    async def run():
+        adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+        client = adapter.client.client
+        res_1 = await adapter.check_login_request(AID)
+        res_2 = await adapter.check_login_request(AID)
+        assert adapter.client.client is client
+        await adapter.aclose()
+        assert client.is_closed
+        return res_1, res_2
+
+    res_1, res_2 = asyncio.run(run())
+    assert res_1.status_code == 200
+    assert res_2.json()["aid"] == AID
+    assert seen == [f"/authorizations/{AID}", f"/authorizations/{AID}"]
+
+
+def test_adapter_pool_limits_from_env(monkeypatch):
+    monkeypatch.setenv("FILER_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("FILER_TIMEOUT", "2.5")
+    adapter = FilerServiceAdapter()
+    assert adapter.client.limits.max_connections == 7
+    assert adapter.client.timeout.read == 2.5
+
+
+def filer_adapter(monkeypatch, statuses, calls):
+    monkeypatch.setenv("FILER_UPLOAD_POLL_INITIAL_DELAY", "0.01")
+    monkeypatch.setenv("FILER_UPLOAD_POLL_MAX_DELAY", "0.02")
+    monkeypatch.setenv("FILER_UPLOAD_POLL_DEADLINE", "1")
+
+    def handler(request: httpx.Request):
+        calls.append(request.method)
+        if request.method == "POST":
+            return httpx.Response(200, json={"msg": "received"})
+        status = statuses.pop(0) if statuses else 404
+        if status == 200:
+            return httpx.Response(200, json={"status": "verified"})
+        return httpx.Response(status, json={"msg": "not found"})
+
+    return FilerServiceAdapter(transport=httpx.MockTransport(handler))
+
+
+def test_upload_request_polls_until_confirmed(monkeypatch):
+    calls = []
+    adapter = filer_adapter(monkeypatch, [404, 404, 404, 200], calls)
+    res = asyncio.run(adapter.upload_request("aid", "sha256-dig", "multipart/form-data", b"report"))
+    assert res.status_code == 200
+    assert res.json()["status"] == "verified"
+    assert calls == ["GET", "POST", "GET", "GET", "GET"]
+
+
+def test_upload_request_stops_at_deadline(monkeypatch):
+    calls = []
+    adapter = filer_adapter(monkeypatch, [], calls)
+    adapter.poll_deadline = 0.05
+    res = asyncio.run(adapter.upload_request("aid", "sha256-dig", "multipart/form-data", b"report"))
+    assert res.status_code == 404
+    assert calls.count("GET") < 10
+
+
+def test_upload_request_without_wait_returns_accepted(monkeypatch):
+    calls = []
+    adapter = filer_adapter(monkeypatch, [404], calls)
+    res = asyncio.run(
+        adapter.upload_request("aid", "sha256-dig", "multipart/form-data", b"report", wait=False)
+    )
+    assert res.status_code == 202
+    assert res.json()["status"] == "accepted"
+    assert calls == ["GET", "POST"]
+
+
+def test_breaker_opens_on_upstream_failures(monkeypatch):
+    AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    monkeypatch.setenv("VERIFIER_BREAKER_FAILURES", "3")
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        return httpx.Response(503, json={"msg": "down"})
+
+    async def run():
+        adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+        statuses = [(await adapter.check_login_request(AID)).status_code for _ in range(3)]
+        try:
+            await adapter.check_login_request(AID)
+        except UpstreamUnavailableException as e:
+            return statuses, e, adapter.client.breaker
+        raise AssertionError("breaker did not open")
+
+    statuses, e, breaker = asyncio.run(run())
+    assert statuses == [503, 503, 503]
+    assert len(calls) == 3
+    assert breaker.state == "open"
+    assert e.status_code == 503
+    assert e.headers["Retry-After"] == "30"
+
+
+def test_breaker_half_open_closes_on_success():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, timer=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 11
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.trips == 1
+
+
+def test_bulkhead_rejects_when_queue_full(monkeypatch):
+    monkeypatch.setenv("FILER_MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("FILER_MAX_QUEUE", "1")
+    release = None
+
+    async def handler(request: httpx.Request):
+        await release.wait()
+        return httpx.Response(200, json={"status": "verified"})
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        adapter = FilerServiceAdapter(transport=httpx.MockTransport(handler))
+        running = asyncio.create_task(adapter.check_upload_request("aid", "dig-1"))
+        queued = asyncio.create_task(adapter.check_upload_request("aid", "dig-2"))
+        await asyncio.sleep(0.01)
+        try:
+            await adapter.check_upload_request("aid", "dig-3")
+            rejected = False
+        except UpstreamUnavailableException:
+            rejected = True
+        release.set()
+        return rejected, [(await t).status_code for t in (running, queued)]
+
+    rejected, statuses = asyncio.run(run())
+    assert rejected
+    assert statuses == [200, 200]
+
+
+def test_read_timeout_follows_latency(monkeypatch):
+    monkeypatch.setenv("VERIFIER_TIMEOUT", "30")
+    monkeypatch.setenv("VERIFIER_TIMEOUT_MIN_SAMPLES", "10")
+    client = VerifierServiceAdapter().client
+    assert client.read_timeout("check_login") == 30
+    tracker = client.latencies.setdefault("check_login", LatencyTracker())
+    for _ in range(10):
+        tracker.observe(0.5)
+    assert client.read_timeout("check_login") == 1.5
+    for _ in range(10):
+        tracker.observe(0.01)
+    # never below TIMEOUT_MIN
+    assert client.read_timeout("check_login") == 1.5
+    tracker.samples.clear()
+    for _ in range(10):
+        tracker.observe(0.01)
+    assert client.read_timeout("check_login") == 1.0
+
+
+def test_uploads_keep_the_configured_timeout(monkeypatch):
+    monkeypatch.setenv("FILER_TIMEOUT", "30")
+    monkeypatch.setenv("FILER_TIMEOUT_MIN_SAMPLES", "10")
+    read_timeouts = {}
+
+    def handler(request: httpx.Request):
+        read_timeouts.setdefault(request.method, []).append(request.extensions["timeout"]["read"])
+        if request.method == "POST":
+            return httpx.Response(202, json={"msg": "received"})
+        return httpx.Response(404, json={"msg": "not found"})
+
+    async def run():
+        adapter = FilerServiceAdapter(transport=httpx.MockTransport(handler))
+        for _ in range(12):
+            await adapter.upload_request("aid", "sha256-dig", "multipart/form-data", b"report", wait=False)
+        return adapter.client
+
+    client = asyncio.run(run())
+    # fast status checks tighten their timeout, uploads whatever their size keep TIMEOUT
+    assert read_timeouts["GET"][-1] == 1.0
+    assert set(read_timeouts["POST"]) == {30}
+    assert "upload" not in client.latencies
+
+
+def test_breaker_recovers_when_latency_rises_above_derived_timeout(monkeypatch):
+    monkeypatch.setenv("VERIFIER_TIMEOUT", "2")
+    monkeypatch.setenv("VERIFIER_TIMEOUT_MIN", "0.05")
+    monkeypatch.setenv("VERIFIER_TIMEOUT_MIN_SAMPLES", "5")
+    monkeypatch.setenv("VERIFIER_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("VERIFIER_BREAKER_RESET", "0")
+    latency = [0.001]
+
+    async def handler(request: httpx.Request):
+        read = request.extensions["timeout"]["read"]
+        if latency[0] > read:
+            await asyncio.sleep(read)
+            raise httpx.ReadTimeout("timed out", request=request)
+        await asyncio.sleep(latency[0])
+        return httpx.Response(200, json={"aid": "aid"})
+
+    async def run():
+        adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+        for _ in range(10):
+            await adapter.check_login_request("aid")
+        assert adapter.client.read_timeout("check_login") == 0.05
+        latency[0] = 0.2
+        outcomes = []
+        for _ in range(6):
+            try:
+                outcomes.append((await adapter.check_login_request("aid")).status_code)
+            except UpstreamUnavailableException:
+                outcomes.append(503)
+        return outcomes, adapter.client
+
+    outcomes, client = asyncio.run(run())
+    assert outcomes[0] == 503
+    assert outcomes[-3:] == [200, 200, 200]
+    assert client.breaker.state == "closed"
+    assert client.read_timeout("check_login") > 0.2
+
+
+def test_timeout_raises_unavailable():
+    def handler(request: httpx.Request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    async def run():
+        adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+        try:
+            await adapter.check_login_request("aid")
+        except UpstreamUnavailableException as e:
+            return e, adapter.client.breaker.failures
+
+    e, failures = asyncio.run(run())
+    assert e.status_code == 503
+    assert failures == 1
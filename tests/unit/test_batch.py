@@ -0,0 +1,225 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from regps.app import fastapi_app
+from regps.app.adapters.verifier_service_adapter import FilerServiceAdapter, VerifierServiceAdapter
+from regps.app.api.controllers import APIController
+from regps.app.api.utils.pydantic_models import BATCH_MAX
+from regps.app.api.utils.reports_db import ReportsDB
+from regps.app.api.utils.reports_store import MemoryReportsStore
+
+AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+LEI = "875500ELOZEL05BVXV37"
+SIGNED_HEADERS = {
+    "signature": "signature",
+    "signature-input": "signature-input",
+    "signify-resource": AID,
+    "signify-timestamp": "2025-01-21T22:19:03.646000+00:00",
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    The app with signed headers accepted and a fresh reports db.
+    """
+
+    async def process_request(request, aid, verify_for_upload=True):
+        return {"aid": aid, "msg": "Signature Valid"}
+
+    monkeypatch.setattr(fastapi_app.verify_signed_headers, "process_request", process_request)
+    monkeypatch.setattr(fastapi_app, "reports_db", ReportsDB(MemoryReportsStore()))
+    return TestClient(fastapi_app.app)
+
+
+def filer_statuses(request: httpx.Request):
+    dig = request.url.path.rsplit("/", 1)[-1]
+    if dig == "sha256-missing":
+        return httpx.Response(404, json={"msg": "not found"})
+    return httpx.Response(200, json={"dig": dig, "status": "verified"})
+
+
+def test_batch_upload_status_checks_are_bounded():
+    running = []
+    peak = []
+
+    async def handler(request: httpx.Request):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        dig = request.url.path.rsplit("/", 1)[-1]
+        if dig == "sha256-missing":
+            return httpx.Response(404, json={"msg": "not found"})
+        return httpx.Response(200, json={"dig": dig, "status": "verified"})
+
+    controller = APIController()
+    controller.filer_adapter = FilerServiceAdapter(transport=httpx.MockTransport(handler))
+    controller.upload_status_batch_concurrency = 3
+    digs = [f"sha256-{i}" for i in range(10)] + ["sha256-missing"]
+
+    statuses = asyncio.run(controller.check_uploads(AID, digs))
+    assert statuses["sha256-4"] == (200, {"dig": "sha256-4", "status": "verified"})
+    assert statuses["sha256-missing"] == (404, {"msg": "not found"})
+    assert len(statuses) == 11
+    assert max(peak) == 3
+
+
+def test_upload_status_batch_route(client, monkeypatch):
+    monkeypatch.setattr(
+        fastapi_app.api_controller,
+        "filer_adapter",
+        FilerServiceAdapter(transport=httpx.MockTransport(filer_statuses)),
+    )
+
+    async def register():
+        await fastapi_app.reports_db.register_aid(AID, LEI)
+        for dig in ("sha256-a", "sha256-b", "sha256-missing"):
+            await fastapi_app.reports_db.register_digest(AID, dig)
+
+    asyncio.run(register())
+    digests = ["sha256-b", "sha256-other", "sha256-missing", "sha256-a", "sha256-b"]
+    res = client.post(f"/uploads/{AID}/status", headers=SIGNED_HEADERS, json={"digests": digests})
+    assert res.status_code == 200
+    # one item per digest in request order, each with its own status
+    assert res.json() == [
+        {"dig": "sha256-b", "status_code": 200, "status": {"dig": "sha256-b", "status": "verified"}},
+        {
+            "dig": "sha256-other",
+            "status_code": 401,
+            "status": f"AID {AID} is not authorized to check status for digest sha256-other",
+        },
+        {"dig": "sha256-missing", "status_code": 404, "status": {"msg": "not found"}},
+        {"dig": "sha256-a", "status_code": 200, "status": {"dig": "sha256-a", "status": "verified"}},
+    ]
+
+
+@pytest.mark.parametrize("count", [0, 101])
+def test_upload_status_batch_size_validated(client, count):
+    digests = [f"sha256-{i}" for i in range(count)]
+    res = client.post(f"/uploads/{AID}/status", headers=SIGNED_HEADERS, json={"digests": digests})
+    assert res.status_code == 422
+
+
+def test_batch_logins_fan_out_under_the_limit():
+    running = []
+    peak = []
+
+    async def handler(request: httpx.Request):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        said = request.url.path.rsplit("/", 1)[-1]
+        if said == "bad":
+            return httpx.Response(401, json={"msg": "invalid credential"})
+        return httpx.Response(202, json={"aid": "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu", "said": said})
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+    controller.batch_concurrency = 4
+    saids = [f"said{i}" for i in range(12)] + ["bad"]
+
+    async def run():
+        calls = [lambda said=said: controller.login(said, "vlei") for said in saids]
+        return [result async for result in controller.fan_out(calls)]
+
+    results = asyncio.run(run())
+    assert sorted(index for index, _, _ in results) == list(range(13))
+    by_index = {index: (status_code, body) for index, status_code, body in results}
+    assert by_index[3] == (202, {"aid": "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu", "said": "said3"})
+    assert by_index[12] == (401, {"msg": "invalid credential"})
+    assert max(peak) == 4
+
+
+def test_batch_stream_closed_by_client_cancels_pending_calls():
+    started = []
+    cancelled = []
+
+    async def call(delay):
+        started.append(delay)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return {"delay": delay}
+
+    controller = APIController()
+    controller.batch_concurrency = 2
+
+    async def run():
+        response = fastapi_app.ndjson_results(
+            controller.fan_out([lambda delay=delay: call(delay) for delay in (0, 10, 10, 10)])
+        )
+        lines = response.body_iterator
+        first = await lines.__anext__()
+        # the client goes away after the first line
+        await lines.aclose()
+        await asyncio.sleep(0)
+        # not left to the garbage collector or loop shutdown
+        assert cancelled == [10, 10]
+        return first
+
+    first = asyncio.run(run())
+    assert first == '{"index": 0, "status_code": 202, "result": {"delay": 0}}\n'
+
+
+def verifier(request: httpx.Request):
+    said = request.url.path.rsplit("/", 1)[-1]
+    if said == "bad":
+        return httpx.Response(401, json={"msg": "invalid credential"})
+    return httpx.Response(202, json={"aid": AID, "said": said})
+
+
+def ndjson(res):
+    assert res.headers["content-type"] == "application/x-ndjson"
+    assert res.text.endswith("\n")
+    return sorted((json.loads(line) for line in res.text.splitlines()), key=lambda item: item["index"])
+
+
+def test_login_batch_route_streams_ndjson(client, monkeypatch):
+    monkeypatch.setattr(
+        fastapi_app.api_controller,
+        "verifier_adapter",
+        VerifierServiceAdapter(transport=httpx.MockTransport(verifier)),
+    )
+    res = client.post(
+        "/login/batch",
+        json=[{"said": "said0", "vlei": "vlei"}, {"said": "bad", "vlei": "vlei"}, {"said": "said2", "vlei": "vlei"}],
+    )
+    assert res.status_code == 200
+    # a failed item is reported in its line, the others still complete
+    assert ndjson(res) == [
+        {"index": 0, "status_code": 202, "result": {"aid": AID, "said": "said0"}},
+        {"index": 1, "status_code": 401, "result": {"msg": "invalid credential"}},
+        {"index": 2, "status_code": 202, "result": {"aid": AID, "said": "said2"}},
+    ]
+
+
+def test_add_root_of_trust_batch_route_streams_ndjson(client, monkeypatch):
+    monkeypatch.setattr(
+        fastapi_app.api_controller,
+        "verifier_adapter",
+        VerifierServiceAdapter(transport=httpx.MockTransport(verifier)),
+    )
+    res = client.post(
+        "/add_root_of_trust/batch",
+        json=[{"aid": "rot0", "vlei": "vlei", "oobi": "oobi"}, {"aid": "bad", "vlei": "vlei", "oobi": "oobi"}],
+    )
+    assert res.status_code == 200
+    assert ndjson(res) == [
+        {"index": 0, "status_code": 202, "result": {"aid": AID, "said": "rot0"}},
+        {"index": 1, "status_code": 401, "result": {"msg": "invalid credential"}},
+    ]
+
+
+@pytest.mark.parametrize("count", [0, BATCH_MAX + 1])
+@pytest.mark.parametrize("path", ["/login/batch", "/add_root_of_trust/batch"])
+def test_batch_size_validated(client, path, count):
+    item = {"said": "said", "aid": "aid", "vlei": "vlei", "oobi": "oobi"}
+    assert client.post(path, json=[item] * count).status_code == 422
@@ -0,0 +1,160 @@
+import asyncio
+
+import httpx
+import pytest
+
+from regps.app.adapters.verifier_service_adapter import FilerServiceAdapter, VerifierServiceAdapter
+from regps.app.api.controllers import APIController
+from regps.app.api.exceptions import VerifierServiceException
+from regps.app.api.utils.single_flight import SingleFlight
+from regps.app.api.utils.ttl_cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expiry_and_lru_eviction():
+    timer = FakeTimer()
+    cache = TTLCache(ttl=10, maxsize=2, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+    assert cache.get("a") == 1
+    timer.now = 2
+    assert cache.get("b") is None
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    # "b" is the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 4, "misses": 2, "evictions": 1}
+
+
+def test_check_login_is_cached_until_invalidated():
+    AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    responses = [
+        httpx.Response(401, json={"msg": "AID not logged in"}),
+        httpx.Response(200, json={"aid": AID, "lei": "875500ELOZEL05BVXV37"}),
+        httpx.Response(200, json={"aid": AID, "lei": "875500ELOZEL05BVXV37"}),
+    ]
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        return responses[len(calls) - 1]
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+    controller.login_negative_ttl = 0
+
+    async def run():
+        with pytest.raises(VerifierServiceException):
+            await controller.check_login(AID)
+        # the negative result has expired, so the verifier is asked again
+        assert (await controller.check_login(AID))["aid"] == AID
+        assert (await controller.check_login(AID))["aid"] == AID
+        assert len(calls) == 2
+        controller.invalidate_login(AID)
+        await controller.check_login(AID)
+        assert len(calls) == 3
+
+    asyncio.run(run())
+    assert controller.cache_stats()["check_login"]["hits"] == 1
+
+
+def test_check_login_not_cached_while_revocation_is_processed():
+    AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    now = [0.0]
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"aid": AID, "lei": "875500ELOZEL05BVXV37"})
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+    controller.revocations = TTLCache(30, timer=lambda: now[0])
+
+    async def run():
+        await controller.check_login(AID)
+        # /present_revocation accepted, the verifier is still processing it
+        controller.invalidate_login(AID)
+        await controller.check_login(AID)
+        await controller.check_login(AID)
+        assert len(calls) == 3
+        # past the grace period logins are cached again
+        now[0] = 31
+        await controller.check_login(AID)
+        await controller.check_login(AID)
+        assert len(calls) == 4
+
+    asyncio.run(run())
+
+
+def test_check_login_ttl_is_short_with_several_workers(monkeypatch):
+    monkeypatch.delenv("CHECK_LOGIN_CACHE_TTL", raising=False)
+    monkeypatch.delenv("REGPS_WORKERS", raising=False)
+    assert APIController().login_cache.ttl == 60
+    # a revocation only invalidates the cache of one worker
+    monkeypatch.setenv("REGPS_WORKERS", "4")
+    assert APIController().login_cache.ttl == 5
+    monkeypatch.setenv("CHECK_LOGIN_CACHE_TTL", "30")
+    assert APIController().login_cache.ttl == 30
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"aid": AID, "lei": "875500ELOZEL05BVXV37"})
+
+    controller = APIController()
+    transport = httpx.MockTransport(handler)
+    controller.verifier_adapter = VerifierServiceAdapter(transport=transport)
+    controller.filer_adapter = FilerServiceAdapter(transport=transport)
+
+    async def run():
+        logins = await asyncio.gather(*(controller.check_login(AID) for _ in range(5)))
+        uploads = await asyncio.gather(
+            *(controller.check_upload(AID, dig) for dig in ("sha256-a", "sha256-a", "sha256-b"))
+        )
+        return logins, uploads
+
+    logins, uploads = asyncio.run(run())
+    assert all(login["aid"] == AID for login in logins)
+    assert len(uploads) == 3
+    assert sorted(calls) == sorted(
+        [f"/authorizations/{AID}", f"/reports/{AID}/sha256-a", f"/reports/{AID}/sha256-b"]
+    )
+    assert controller.in_flight.stats() == {"calls": 3, "shared": 5, "in_flight": 0}
+
+
+def test_single_flight_shares_failures_and_survives_cancelled_caller():
+    started = []
+
+    async def fail():
+        started.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("k", fail))
+        second = asyncio.create_task(flight.do("k", fail))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(ValueError):
+            await second
+        assert not flight.pending("k")
+
+    asyncio.run(run())
+    assert started == [1]
@@ -0,0 +1,125 @@
+import asyncio
+
+import fastapi
+import httpx
+import pytest
+from starlette.datastructures import Headers
+
+from regps.app.adapters.verifier_service_adapter import VerifierServiceAdapter
+from regps.app.api.controllers import APIController
+from regps.app.api.exceptions import VerifierServiceException
+from regps.app.api.key_state import KeyStateCache
+from regps.app.api.signed_headers_verifier import VerifySignedHeaders
+
+# AID whose KEL is in credential.cesr and the signify-ts signed headers for GET /checklogin/{AID}
+AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+KEYID = "BAIGwtGP4CFwVqXiU9bspN5_eoWpPfNh9qChkK6FtDAu"
+HEADERS = {
+    "SIGNATURE": 'indexed="?0";signify="0BAo0wmWUJRG6a_-kmdeYWRhVdjifc9Dp7cEWxpFpLp4fUf114pb7Qec3r43uqGWfQdu33ci5PTDFgcIiDjsDPMI"',
+    "SIGNATURE-INPUT": 'signify=("@method" "@path" "signify-resource" "signify-timestamp");created=1737497943;keyid="BAIGwtGP4CFwVqXiU9bspN5_eoWpPfNh9qChkK6FtDAu";alg="ed25519"',
+    "SIGNIFY-RESOURCE": AID,
+    "SIGNIFY-TIMESTAMP": "2025-01-21T22:19:03.646000+00:00",
+}
+
+
+def signed_request(method="GET", path=f"/checklogin/{AID}"):
+    scope = dict(type="http", headers=Headers(HEADERS).raw, method=method, path=path)
+    return fastapi.Request(scope)
+
+
+def test_verify_signature_from_kel_key_state():
+    with open("./data/credential.cesr", "r") as cfile:
+        vlei_ecr = cfile.read()
+    key_states = KeyStateCache()
+    assert key_states.verify(AID, KEYID, "sig", "ser") is None
+
+    key_states.update_from_kel(AID, vlei_ecr)
+    aid, sig, ser = VerifySignedHeaders.handle_headers(signed_request())
+    assert key_states.verify(aid, KEYID, sig, ser) is True
+    aid, sig, ser = VerifySignedHeaders.handle_headers(signed_request(method="POST"))
+    assert key_states.verify(aid, KEYID, sig, ser) is False
+    # a key that is not in the cached key state is a miss, e.g. after a rotation
+    assert key_states.verify(aid, "BPoZo2b3r--lPBpURvEDyjyDkS65xBEpmpQhHQvrwlBE", sig, ser) is None
+    key_states.close()
+
+
+def test_key_state_only_seeded_from_trusted_sources(monkeypatch):
+    monkeypatch.setenv("SIGNED_HEADERS_VERIFICATION", "local")
+    with open("./data/credential.cesr", "r") as cfile:
+        vlei_ecr = cfile.read()
+
+    def handler(request: httpx.Request):
+        if request.url.path.startswith("/oobi/"):
+            return httpx.Response(200, content=vlei_ecr.encode())
+        return httpx.Response(202, json={"aid": AID, "said": "said"})
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+
+    async def run():
+        # a presentation accepted for processing doesn't seed key state
+        await controller.login("said", vlei_ecr)
+        assert len(controller.key_states.keys) == 0
+        controller.verifier_adapter.key_state_oobi_url = "http://witness/oobi/{aid}"
+        assert await controller.resolve_key_state(AID)
+
+    asyncio.run(run())
+    # only the resolved AID, not the issuers whose KELs came along
+    assert len(controller.key_states.keys) == 1
+    controller.key_states.close()
+
+
+def test_local_verification_only_calls_verifier_on_miss(monkeypatch):
+    monkeypatch.setenv("SIGNED_HEADERS_VERIFICATION", "local")
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        return httpx.Response(202, json={"msg": "Signature Valid"})
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+    controller.login_cache.set(AID, (200, {"aid": AID}))
+    verify_signed_headers = VerifySignedHeaders(controller)
+
+    async def run():
+        await verify_signed_headers.process_request(signed_request(), AID, False)
+        await verify_signed_headers.process_request(signed_request(), AID, False)
+
+    asyncio.run(run())
+    assert calls == [f"/request/verify/{AID}"]
+    controller.key_states.close()
+
+
+def test_revoked_aid_falls_back_to_verifier(monkeypatch):
+    monkeypatch.setenv("SIGNED_HEADERS_VERIFICATION", "local")
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        if len(calls) > 2:
+            return httpx.Response(401, json={"msg": "Credential revoked"})
+        return httpx.Response(202, json={"msg": "Signature Valid"})
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+    verify_signed_headers = VerifySignedHeaders(controller)
+
+    async def run():
+        # key state learned, but not trusted without an authorized login
+        await verify_signed_headers.process_request(signed_request(), AID, False)
+        await verify_signed_headers.process_request(signed_request(), AID, False)
+        assert len(calls) == 2
+        controller.login_cache.set(AID, (200, {"aid": AID}))
+        await verify_signed_headers.process_request(signed_request(), AID, False)
+        assert len(calls) == 2
+        # /present_revocation
+        controller.invalidate_login(AID)
+        assert controller.key_states.get(AID) is None
+        with pytest.raises(VerifierServiceException) as e:
+            await verify_signed_headers.process_request(signed_request(), AID, False)
+        assert e.value.status_code == 401
+
+    asyncio.run(run())
+    assert len(calls) == 3
+    controller.key_states.close()
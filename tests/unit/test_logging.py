@@ -0,0 +1,47 @@
+import io
+import json
+import logging
+
+import httpx
+
+from regps.app.api.utils.logging_config import (
+    Preview,
+    configure_logging,
+    flush_logging,
+    parse_sample_rates,
+    request_sampled,
+)
+
+
+def test_preview_is_size_capped():
+    assert str(Preview("abc", 5)) == "abc"
+    assert str(Preview(b"x" * 1000, 4)) == "xxxx...(1000 bytes)"
+    res = httpx.Response(200, json={"status": "verified"})
+    assert str(Preview(res)) == '200 {"status":"verified"}'
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("/upload/{aid}/{dig}=0.1, /status/{aid}=0") == {
+        "/upload/{aid}/{dig}": 0.1,
+        "/status/{aid}": 0.0,
+    }
+
+
+def test_json_output_and_sampling(monkeypatch):
+    monkeypatch.setenv("LOG_QUEUE", "false")
+    out = io.StringIO()
+    configure_logging(level="DEBUG", fmt="json", stream=out)
+    logger = logging.getLogger("regps.test")
+    try:
+        logger.debug("sampled %s", Preview("body"), extra={"aid": "EAID"})
+        token = request_sampled.set(False)
+        logger.info("dropped")
+        logger.error("kept")
+        request_sampled.reset(token)
+    finally:
+        flush_logging()
+        configure_logging()
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r["msg"] for r in records] == ["sampled body", "kept"]
+    assert records[0]["aid"] == "EAID"
+    assert records[0]["level"] == "DEBUG"
@@ -0,0 +1,31 @@
+from fastapi.testclient import TestClient
+
+from regps.app.api.utils.metrics import Registry
+
+
+def test_histogram_and_counter_exposition():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    errors = registry.counter("errors_total", "Errors", ("status",))
+    latency.observe(0.05, route="/a")
+    latency.observe(0.5, route="/a")
+    latency.observe(5, route="/a")
+    errors.inc(status=503)
+    errors.inc(status=503)
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="1"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="/a"} 3' in text
+    assert 'errors_total{status="503"} 2' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def test_metrics_route_labels_templates():
+    from regps.app import fastapi_app
+
+    with TestClient(fastapi_app.app) as client:
+        assert client.get("/ping").status_code == 200
+        text = client.get("/metrics").text
+    assert 'regps_http_request_duration_seconds_count{method="GET",route="/ping",status="200"}' in text
+    assert 'regps_cache_hit_ratio{cache="check_login"}' in text
@@ -0,0 +1,71 @@
+import asyncio
+
+import fastapi
+import httpx
+import pytest
+from starlette.datastructures import Headers
+
+from regps.app.adapters.verifier_service_adapter import VerifierServiceAdapter
+from regps.app.api.controllers import APIController
+from regps.app.api.exceptions import VerifierServiceException, VerifySignedHeadersException
+from regps.app.api.replay_guard import ReplayGuard
+from regps.app.api.signed_headers_verifier import VerifySignedHeaders
+
+# signify-ts signed headers for GET /checklogin/{AID}
+AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+HEADERS = {
+    "SIGNATURE": 'indexed="?0";signify="0BAo0wmWUJRG6a_-kmdeYWRhVdjifc9Dp7cEWxpFpLp4fUf114pb7Qec3r43uqGWfQdu33ci5PTDFgcIiDjsDPMI"',
+    "SIGNATURE-INPUT": 'signify=("@method" "@path" "signify-resource" "signify-timestamp");created=1737497943;keyid="BAIGwtGP4CFwVqXiU9bspN5_eoWpPfNh9qChkK6FtDAu";alg="ed25519"',
+    "SIGNIFY-RESOURCE": AID,
+    "SIGNIFY-TIMESTAMP": "2025-01-21T22:19:03.646000+00:00",
+}
+
+
+def signed_request():
+    scope = dict(type="http", headers=Headers(HEADERS).raw, method="GET", path=f"/checklogin/{AID}")
+    return fastapi.Request(scope)
+
+
+def test_replayed_and_stale_signatures_rejected_before_verifier():
+    created = 1737497943
+    statuses = [503, 202]
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        return httpx.Response(statuses.pop(0), json={"msg": "Signature Valid"})
+
+    controller = APIController()
+    controller.verifier_adapter = VerifierServiceAdapter(transport=httpx.MockTransport(handler))
+    now = [created + 10]
+    guard = ReplayGuard(window=60, timer=lambda: now[0])
+    verify_signed_headers = VerifySignedHeaders(controller, guard)
+
+    async def run():
+        # a failed verification frees the signature for a retry
+        with pytest.raises(VerifierServiceException):
+            await verify_signed_headers.process_request(signed_request(), AID, False)
+        await verify_signed_headers.process_request(signed_request(), AID, False)
+        with pytest.raises(VerifySignedHeadersException, match="already used"):
+            await verify_signed_headers.process_request(signed_request(), AID, False)
+        now[0] = created + 61
+        with pytest.raises(VerifySignedHeadersException, match="time window"):
+            await verify_signed_headers.process_request(signed_request(), AID, False)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_replay_guard_expires_windows_and_bounds_memory():
+    now = [1000.0]
+    guard = ReplayGuard(window=10, max_entries=2, timer=lambda: now[0])
+    assert guard.check("a", 1000) is None
+    assert guard.check("a", 1000) == "replayed"
+    assert guard.check("b", 989) == "stale"
+    assert guard.check("b", 1001) is None
+    assert guard.check("c", 1002) is None
+    # past max_entries the oldest signature of the window is forgotten
+    assert len(guard) == 2 and guard.check("a", 1000) is None
+    now[0] = 1030
+    assert guard.check("d", 1030) is None
+    assert len(guard) == 1
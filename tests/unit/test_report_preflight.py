@@ -0,0 +1,96 @@
+import asyncio
+import io
+import zipfile
+from hashlib import sha256
+
+import pytest
+
+from regps.app.api import report_preflight
+from regps.app.api.exceptions import ReportValidationException
+from regps.app.api.report_preflight import ZipPreflight
+from regps.app.api.upload_stream import MultipartDigestTap
+
+BOUNDARY = "----regpsboundary"
+CONTYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def make_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def preflight(report, chunk=1000, keep=None):
+    check = ZipPreflight()
+    if keep is not None:
+        check.keep = keep
+    view = memoryview(report)
+    for i in range(0, len(report), chunk):
+        check.feed(view[i:i + chunk])
+    return check.finish()
+
+
+@pytest.mark.parametrize("path", ["./data/report.zip", "./data/signed_report.zip"])
+def test_sample_reports_pass(path):
+    with open(path, "rb") as f:
+        assert preflight(f.read())
+
+
+def test_central_directory_read_from_the_kept_tail():
+    entries = {"META-INF/reports.json": "{}"}
+    entries.update({f"reports/{i:05d}.csv": bytes([i % 256]) * 100 for i in range(2000)})
+    report = make_zip(entries, zipfile.ZIP_STORED)
+    # the central directory is about 125 KB
+    assert len(preflight(report, keep=64 * 1024 + 22 + 130000)) == 2001
+    with pytest.raises(ReportValidationException, match="central directory is too large"):
+        preflight(report, keep=64 * 1024 + 22)
+
+
+def test_not_a_zip_rejected_on_first_chunk():
+    check = ZipPreflight()
+    with pytest.raises(ReportValidationException, match="must be a zip"):
+        check.feed(b"%PDF-1.7 not a report")
+
+
+@pytest.mark.parametrize(
+    "entries, msg",
+    [
+        ({"META-INF/reports.json": "{}", "bomb.bin": b"\0" * (20 * 1024 * 1024)}, "compression ratio"),
+        ({"reports/report.json": "{}"}, "manifest"),
+        ({"META-INF/reports.json": "{}", "../evil.csv": "x"}, "unsafe path"),
+    ],
+)
+def test_bad_reports_rejected(entries, msg):
+    with pytest.raises(ReportValidationException, match=msg):
+        preflight(make_zip(entries))
+
+
+def test_oversized_report_rejected_while_streaming(monkeypatch):
+    monkeypatch.setattr(report_preflight, "REPORT_MAX_BYTES", 2000)
+    with open("./data/signed_report.zip", "rb") as f:
+        report = f.read()
+    with pytest.raises(ReportValidationException) as e:
+        preflight(report)
+    assert e.value.status_code == 413
+
+
+def test_tap_holds_back_report_failing_preflight():
+    report = make_zip({"reports/report.json": "{}"})
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="upload"; filename="report.zip"\r\n'
+        "Content-Type: application/zip\r\n\r\n"
+    ).encode() + report + f"\r\n--{BOUNDARY}--\r\n".encode()
+    tap = MultipartDigestTap(CONTYPE, f"sha256-{sha256(report).hexdigest()}", preflight=True)
+
+    async def chunks():
+        for i in range(0, len(body), 100):
+            yield body[i:i + 100]
+
+    async def run():
+        return [chunk async for chunk in tap.stream(chunks())]
+
+    with pytest.raises(ReportValidationException, match="manifest"):
+        asyncio.run(run())
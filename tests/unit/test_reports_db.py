@@ -1,24 +1,55 @@
+import asyncio
+import sqlite3
+
+import pytest
+
 from regps.app.api.utils.reports_db import ReportsDB
+from regps.app.api.utils.reports_store import (
+    MemoryReportsStore,
+    ReportsStore,
+    SqliteReportsStore,
+    RedisReportsStore,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def reports_db(request, tmp_path):
+    if request.param == "sqlite":
+        db = ReportsDB(SqliteReportsStore(path=str(tmp_path / "reports.db")))
+    elif request.param == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        db = ReportsDB(RedisReportsStore(client=fakeredis.FakeAsyncRedis()))
+    else:
+        db = ReportsDB(MemoryReportsStore())
+    yield db
+    asyncio.run(db.close())
 
 
-def test_check_report_status_authorization():
+def test_check_report_status_authorization(reports_db):
+    asyncio.run(_test_check_report_status_authorization(reports_db))
+
+
+async def _test_check_report_status_authorization(reports_db):
     aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
     lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
     report_1 = "report 1"
     dig_1 = "sha256-moiuhLFBf9afnHJDfaffg4ehgh"
     report_2 = "report 2"
     dig_2 = "sha256-fer4grniuojnfaNHBBcaaUh89h"
-    reports_db = ReportsDB()
-    reports_db.register_aid(aid, lei)
-    reports_db.add_report(aid, dig_1, report_1)
-    reports_db.add_report(aid, dig_2, report_2)
-    assert reports_db.authorized_to_check_status(aid, dig_1)
-    assert reports_db.authorized_to_check_status(aid, dig_2)
-    assert len(reports_db.get_reports_for_aid(aid)) == 2
-    assert len(reports_db.get_reports_for_lei(aid)) == 2
+    await reports_db.register_aid(aid, lei)
+    await reports_db.add_report(aid, dig_1, report_1)
+    await reports_db.add_report(aid, dig_2, report_2)
+    assert await reports_db.authorized_to_check_status(aid, dig_1)
+    assert await reports_db.authorized_to_check_status(aid, dig_2)
+    assert len(await reports_db.get_reports_for_aid(aid)) == 2
+    assert len(await reports_db.get_reports_for_lei(aid)) == 2
+
+
+def test_check_report_status_authorization_2_aids_from_the_same_lei(reports_db):
+    asyncio.run(_test_check_report_status_authorization_2_aids_from_the_same_lei(reports_db))
 
 
-def test_check_report_status_authorization_2_aids_from_the_same_lei():
+async def _test_check_report_status_authorization_2_aids_from_the_same_lei(reports_db):
     aid_1 = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
     aid_2 = "UNBOUb8dadh98hnansudHD0jndbuh8hnd"
     lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
@@ -26,22 +57,25 @@ def test_check_report_status_authorization_2_aids_from_the_same_lei():
     dig_1 = "sha256-moiuhLFBf9afnHJDfaffg4ehgh"
     report_2 = "report 2"
     dig_2 = "sha256-fer4grniuojnfaNHBBcaaUh89h"
-    reports_db = ReportsDB()
-    reports_db.register_aid(aid_1, lei)
-    reports_db.register_aid(aid_2, lei)
-    reports_db.add_report(aid_1, dig_1, report_1)
-    reports_db.add_report(aid_2, dig_2, report_2)
-    assert reports_db.authorized_to_check_status(aid_1, dig_1)
-    assert reports_db.authorized_to_check_status(aid_1, dig_2)
-    assert reports_db.authorized_to_check_status(aid_2, dig_1)
-    assert reports_db.authorized_to_check_status(aid_2, dig_2)
-    assert len(reports_db.get_reports_for_aid(aid_1)) == 1
-    assert len(reports_db.get_reports_for_aid(aid_2)) == 1
-    assert len(reports_db.get_reports_for_lei(aid_1)) == 2
-    assert len(reports_db.get_reports_for_lei(aid_2)) == 2
-
-
-def test_check_report_status_authorization_2_aids_from_different_lei():
+    await reports_db.register_aid(aid_1, lei)
+    await reports_db.register_aid(aid_2, lei)
+    await reports_db.add_report(aid_1, dig_1, report_1)
+    await reports_db.add_report(aid_2, dig_2, report_2)
+    assert await reports_db.authorized_to_check_status(aid_1, dig_1)
+    assert await reports_db.authorized_to_check_status(aid_1, dig_2)
+    assert await reports_db.authorized_to_check_status(aid_2, dig_1)
+    assert await reports_db.authorized_to_check_status(aid_2, dig_2)
+    assert len(await reports_db.get_reports_for_aid(aid_1)) == 1
+    assert len(await reports_db.get_reports_for_aid(aid_2)) == 1
+    assert len(await reports_db.get_reports_for_lei(aid_1)) == 2
+    assert len(await reports_db.get_reports_for_lei(aid_2)) == 2
+
+
+def test_check_report_status_authorization_2_aids_from_different_lei(reports_db):
+    asyncio.run(_test_check_report_status_authorization_2_aids_from_different_lei(reports_db))
+
+
+async def _test_check_report_status_authorization_2_aids_from_different_lei(reports_db):
     aid_1 = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
     aid_2 = "UNBOUb8dadh98hnansudHD0jndbuh8hnd"
     lei_1 = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
@@ -50,16 +84,202 @@ def test_check_report_status_authorization_2_aids_from_different_lei():
     dig_1 = "sha256-moiuhLFBf9afnHJDfaffg4ehgh"
     report_2 = "report 2"
     dig_2 = "sha256-fer4grniuojnfaNHBBcaaUh89h"
-    reports_db = ReportsDB()
-    reports_db.register_aid(aid_1, lei_1)
-    reports_db.register_aid(aid_2, lei_2)
-    reports_db.add_report(aid_1, dig_1, report_1)
-    reports_db.add_report(aid_2, dig_2, report_2)
-    assert reports_db.authorized_to_check_status(aid_1, dig_1)
-    assert not reports_db.authorized_to_check_status(aid_1, dig_2)
-    assert not reports_db.authorized_to_check_status(aid_2, dig_1)
-    assert reports_db.authorized_to_check_status(aid_2, dig_2)
-    assert len(reports_db.get_reports_for_aid(aid_1)) == 1
-    assert len(reports_db.get_reports_for_aid(aid_2)) == 1
-    assert len(reports_db.get_reports_for_lei(aid_1)) == 1
-    assert len(reports_db.get_reports_for_lei(aid_2)) == 1
\ No newline at end of file
+    await reports_db.register_aid(aid_1, lei_1)
+    await reports_db.register_aid(aid_2, lei_2)
+    await reports_db.add_report(aid_1, dig_1, report_1)
+    await reports_db.add_report(aid_2, dig_2, report_2)
+    assert await reports_db.authorized_to_check_status(aid_1, dig_1)
+    assert not await reports_db.authorized_to_check_status(aid_1, dig_2)
+    assert not await reports_db.authorized_to_check_status(aid_2, dig_1)
+    assert await reports_db.authorized_to_check_status(aid_2, dig_2)
+    assert len(await reports_db.get_reports_for_aid(aid_1)) == 1
+    assert len(await reports_db.get_reports_for_aid(aid_2)) == 1
+    assert len(await reports_db.get_reports_for_lei(aid_1)) == 1
+    assert len(await reports_db.get_reports_for_lei(aid_2)) == 1
+
+def test_reports_pages_and_versions(reports_db):
+    asyncio.run(_test_reports_pages_and_versions(reports_db))
+
+
+async def _test_reports_pages_and_versions(reports_db):
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
+    await reports_db.register_aid(aid, lei)
+    assert await reports_db.get_reports_version(aid) == 0
+    for i in range(5):
+        await reports_db.add_report(aid, f"sha256-dig{i}", {"n": i})
+    version = await reports_db.get_reports_version(aid)
+    assert version > 0
+
+    reports, last_seq, more = await reports_db.get_reports_page(aid, limit=2)
+    assert reports == [{"n": 0}, {"n": 1}] and more
+    reports, last_seq, more = await reports_db.get_reports_page(aid, after=last_seq, limit=2)
+    assert reports == [{"n": 2}, {"n": 3}] and more
+    reports, last_seq, more = await reports_db.get_reports_page(aid, after=last_seq, limit=2)
+    assert reports == [{"n": 4}] and not more
+    reports, since, more = await reports_db.get_reports_page(aid, "lei", after=last_seq)
+    assert reports == [] and since == last_seq and not more
+    assert await reports_db.get_reports_version(aid) == version
+
+    await reports_db.add_report(aid, "sha256-dig5", {"n": 5})
+    assert await reports_db.get_reports_version(aid) != version
+    reports, _, _ = await reports_db.get_reports_page(aid, "lei", after=since)
+    assert reports == [{"n": 5}]
+
+    version = await reports_db.get_reports_version(aid)
+    await reports_db.drop_status(aid)
+    assert await reports_db.get_reports_version(aid) != version
+    assert (await reports_db.get_reports_page(aid))[0] == []
+    assert len((await reports_db.get_reports_page(aid, "lei"))[0]) == 6
+
+
+def test_completed_uploads_index(reports_db):
+    asyncio.run(_test_completed_uploads_index(reports_db))
+
+
+async def _test_completed_uploads_index(reports_db):
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    other = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
+    await reports_db.register_aid(aid, lei)
+    await reports_db.register_aid(other, lei)
+    await reports_db.register_digest(aid, "sha256-dig0")
+    # accepted but not completed
+    assert await reports_db.get_completed_upload(aid, "sha256-dig0") is None
+    await reports_db.add_report(aid, "sha256-dig0", {"status": "failed"})
+    # not final, a retry goes to the filer for the current status
+    assert await reports_db.get_completed_upload(aid, "sha256-dig0") is None
+    await reports_db.add_report(aid, "sha256-dig0", {"status": "verified"})
+    assert await reports_db.get_completed_upload(aid, "sha256-dig0") == {"status": "verified"}
+    assert await reports_db.get_completed_upload(other, "sha256-dig0") is None
+    await reports_db.drop_status(aid)
+    assert await reports_db.get_completed_upload(aid, "sha256-dig0") is None
+
+
+def test_authorized_digests_in_one_lookup(reports_db):
+    asyncio.run(_test_authorized_digests_in_one_lookup(reports_db))
+
+
+async def _test_authorized_digests_in_one_lookup(reports_db):
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    other = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    await reports_db.register_aid(aid, "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf")
+    await reports_db.register_aid(other, "875500ELOZEL05BVXV37")
+    digs = [f"sha256-dig{i}" for i in range(1200)]
+    for dig in digs[::2]:
+        await reports_db.register_digest(aid, dig)
+    await reports_db.register_digest(other, "sha256-other")
+    # batched past the SQLite IN limit
+    assert await reports_db.authorized_digests(aid, digs + ["sha256-other"]) == set(digs[::2])
+    assert await reports_db.authorized_digests(aid, []) == set()
+
+
+def test_sqlite_reports_survive_restart(tmp_path):
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
+    dig = "sha256-moiuhLFBf9afnHJDfaffg4ehgh"
+    path = str(tmp_path / "reports.db")
+
+    async def write():
+        reports_db = ReportsDB(SqliteReportsStore(path=path))
+        await reports_db.register_aid(aid, lei)
+        await reports_db.add_report(aid, dig, {"status": "verified"})
+        await reports_db.close()
+
+    async def read():
+        reports_db = ReportsDB(SqliteReportsStore(path=path))
+        assert await reports_db.authorized_to_check_status(aid, dig)
+        assert await reports_db.get_reports_for_aid(aid) == [{"status": "verified"}]
+        assert await reports_db.get_reports_for_lei(aid) == [{"status": "verified"}]
+        await reports_db.drop_status(aid)
+        assert await reports_db.get_reports_for_aid(aid) == []
+        assert len(await reports_db.get_reports_for_lei(aid)) == 1
+        await reports_db.close()
+
+    asyncio.run(write())
+    asyncio.run(read())
+
+
+def test_sqlite_writes_batched_across_reads_and_retried(tmp_path):
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
+    store = SqliteReportsStore(path=str(tmp_path / "reports.db"), flush_interval=0.05)
+    commit = store._commit
+    batches = []
+
+    def flaky_commit(batch):
+        batches.append(len(batch))
+        if len(batches) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        commit(batch)
+
+    store._commit = flaky_commit
+    reports_db = ReportsDB(store)
+
+    async def run():
+        await reports_db.register_aid(aid, lei)
+        reads = []
+        for i in range(3):
+            await reports_db.add_report(aid, f"sha256-dig{i}", {"status": "verified"})
+            reads.append(asyncio.create_task(reports_db.get_reports_for_aid(aid)))
+        # the reads wait for the commit instead of each forcing one, and get its error
+        for read in reads:
+            with pytest.raises(sqlite3.OperationalError):
+                await read
+        # the failed batch is retried, not dropped
+        assert len(await reports_db.get_reports_for_aid(aid)) == 3
+        await reports_db.close()
+
+    asyncio.run(run())
+    assert batches == [13, 13]
+
+
+def test_sqlite_read_not_cached_over_racing_write(tmp_path):
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
+    store = SqliteReportsStore(path=str(tmp_path / "reports.db"))
+    reports_db = ReportsDB(store)
+    read = store._read
+
+    async def racing_read(sql, params):
+        rows = await read(sql, params)
+        # a write lands after the query ran but before its result is cached
+        if len(rows) == 1:
+            await reports_db.add_report(aid, "sha256-dig2", {"status": "verified"})
+        return rows
+
+    async def run():
+        await reports_db.register_aid(aid, lei)
+        await reports_db.add_report(aid, "sha256-dig1", {"status": "verified"})
+        store._read = racing_read
+        assert len(await reports_db.get_reports_for_aid(aid)) == 1
+        assert len(await reports_db.get_reports_for_aid(aid)) == 2
+        assert len(await reports_db.get_reports_for_lei(aid)) == 2
+        await reports_db.close()
+
+    asyncio.run(run())
+
+
+def test_reports_store_is_abstract():
+    with pytest.raises(TypeError):
+        ReportsStore()
+
+
+def test_redis_reports_shared_between_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+    aid = "jnhh8f7h79nufb97hbw3fieBHJBgg7uhn"
+    lei = "j9h7ufehhcWBUTDVWYH98h9bfyaebgGBFfsa3wFf"
+    dig = "sha256-moiuhLFBf9afnHJDfaffg4ehgh"
+
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_1 = ReportsDB(RedisReportsStore(client=fakeredis.FakeAsyncRedis(server=server)))
+        worker_2 = ReportsDB(RedisReportsStore(client=fakeredis.FakeAsyncRedis(server=server)))
+        await worker_1.register_aid(aid, lei)
+        await worker_1.add_report(aid, dig, {"status": "verified"})
+        assert await worker_2.authorized_to_check_status(aid, dig)
+        assert await worker_2.get_reports_for_lei(aid) == [{"status": "verified"}]
+        await worker_1.close()
+        await worker_2.close()
+
+    asyncio.run(run())
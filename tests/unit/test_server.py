@@ -0,0 +1,28 @@
+import argparse
+
+from regps.app import server
+
+
+def test_default_workers(monkeypatch):
+    monkeypatch.delenv("REGPS_WORKERS", raising=False)
+    monkeypatch.setenv("REPORTS_DB_BACKEND", "memory")
+    assert server.default_workers() == 1
+    # state kept per worker makes more workers opt in, whatever the reports db
+    monkeypatch.setenv("REPORTS_DB_BACKEND", "redis")
+    monkeypatch.setattr(server.os, "cpu_count", lambda: 8)
+    assert server.default_workers() == 1
+    monkeypatch.setenv("REGPS_WORKERS", "3")
+    assert server.default_workers() == 3
+
+
+def test_start_options():
+    parser = server.add_arguments(argparse.ArgumentParser())
+    args = parser.parse_args(
+        ["-p", "9000", "-w", "4", "--server", "gunicorn", "--http", "httptools", "--limit-concurrency", "500"]
+    )
+    assert args.port == 9000
+    assert args.workers == 4
+    assert args.server == "gunicorn"
+    assert args.http == "httptools"
+    assert args.limit_concurrency == 500
+    assert args.loop == "auto"
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from regps.app import fastapi_app
+from regps.app.api.utils.reports_db import ReportsDB
+from regps.app.api.utils.reports_store import MemoryReportsStore
+
+AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+LEI = "875500ELOZEL05BVXV37"
+SIGNED_HEADERS = {
+    "signature": "signature",
+    "signature-input": "signature-input",
+    "signify-resource": AID,
+    "signify-timestamp": "2025-01-21T22:19:03.646000+00:00",
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """
+    The app with signed headers accepted and a reports db holding 5 reports of AID.
+    """
+
+    async def process_request(request, aid, verify_for_upload=True):
+        return {"aid": aid, "msg": "Signature Valid"}
+
+    monkeypatch.setattr(fastapi_app.verify_signed_headers, "process_request", process_request)
+    monkeypatch.setattr(fastapi_app, "reports_db", ReportsDB(MemoryReportsStore()))
+
+    async def add_reports():
+        await fastapi_app.reports_db.register_aid(AID, LEI)
+        for i in range(5):
+            await add_report(i)
+
+    asyncio.run(add_reports())
+    return TestClient(fastapi_app.app)
+
+
+async def add_report(i):
+    await fastapi_app.reports_db.add_report(AID, f"sha256-dig{i}", {"dig": f"sha256-dig{i}"})
+
+
+def get_status(client, **params):
+    headers = dict(SIGNED_HEADERS)
+    etag = params.pop("etag", None)
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    return client.get(f"/status/{AID}", headers=headers, params=params)
+
+
+def test_status_pages_follow_next_cursor(client):
+    digs = []
+    params = {"limit": 2}
+    for _ in range(3):
+        res = get_status(client, **params)
+        assert res.status_code == 202
+        digs += [report["dig"] for report in res.json()]
+        if "X-Next-Cursor" not in res.headers:
+            break
+        params["cursor"] = res.headers["X-Next-Cursor"]
+    assert digs == [f"sha256-dig{i}" for i in range(5)]
+    # the last page has no next cursor
+    assert "X-Next-Cursor" not in res.headers
+    assert get_status(client, limit=2, cursor="nope").status_code == 400
+
+
+def test_status_etag_until_reports_change(client):
+    res = get_status(client, limit=10)
+    etag = res.headers["ETag"]
+    assert etag.startswith('W/"')
+    unchanged = get_status(client, limit=10, etag=etag)
+    assert unchanged.status_code == 304
+    assert unchanged.headers["ETag"] == etag
+
+    asyncio.run(add_report(5))
+    changed = get_status(client, limit=10, etag=etag)
+    assert changed.status_code == 202
+    assert changed.headers["ETag"] != etag
+    assert len(changed.json()) == 6
+    # polling since the last seen report only returns the new one
+    since = get_status(client, since=res.headers["X-Last-Seq"])
+    assert [report["dig"] for report in since.json()] == ["sha256-dig5"]
+
+
+def test_status_stream_subscribes_only_while_streaming(client):
+    scope = dict(type="http", headers=[], method="GET", path=f"/status/{AID}/stream")
+
+    async def run():
+        request = Request(scope)
+        response = await fastapi_app.status_stream_response(request, AID, "aid", 0)
+        # a client gone before the response streams leaves nothing subscribed
+        assert fastapi_app.status_broker.subscriber_count("aid", AID) == 0
+        events = response.body_iterator
+        assert (await events.__anext__()).startswith("event: report")
+        assert fastapi_app.status_broker.subscriber_count("aid", AID) == 1
+        await events.aclose()
+        assert fastapi_app.status_broker.subscriber_count("aid", AID) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+import asyncio
+
+from regps.app.api.status_broker import UploadStatusBroker
+
+
+def test_single_poll_loop_per_digest():
+    async def run():
+        broker = UploadStatusBroker()
+        polls = []
+        release = asyncio.Event()
+
+        async def poll():
+            polls.append(1)
+            await release.wait()
+            return "verified"
+
+        waiters = [
+            asyncio.ensure_future(asyncio.shield(broker.watch("aid", "dig", poll)))
+            for _ in range(5)
+        ]
+        await asyncio.sleep(0)
+        assert broker.in_flight() == 1
+        release.set()
+        assert await asyncio.gather(*waiters) == ["verified"] * 5
+        assert polls == [1]
+        await asyncio.sleep(0)
+        assert broker.in_flight() == 0
+
+    asyncio.run(run())
+
+
+def test_publish_fans_out_to_aid_and_lei_subscribers():
+    async def run():
+        broker = UploadStatusBroker(queue_size=2)
+        by_aid = broker.subscribe("aid", "aid_1")
+        by_lei = broker.subscribe("lei", "lei_1")
+        other = broker.subscribe("aid", "aid_2")
+        for i in range(3):
+            broker.publish("aid_1", "lei_1", {"status": "report", "n": i})
+        assert [by_aid.get_nowait()["n"] for _ in range(2)] == [1, 2]
+        assert by_lei.qsize() == 2
+        assert other.empty()
+
+        events = broker.events("lei", "lei_1", heartbeat=0.01, queue=by_lei)
+        assert (await events.__anext__())["n"] == 1
+        assert (await events.__anext__())["n"] == 2
+        assert await events.__anext__() is None
+        await events.aclose()
+        assert broker.subscriber_count("lei", "lei_1") == 0
+
+    asyncio.run(run())
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+from hashlib import sha256
+
+import httpx
+import pytest
+
+from regps.app.adapters.verifier_service_adapter import FilerServiceAdapter
+from regps.app.api import digest_verifier, upload_stream
+from regps.app.api.controllers import APIController
+from regps.app.api.exceptions import DigestVerificationFailedException, UploadCapacityException
+from regps.app.api.upload_stream import MultipartDigestTap, UploadMemoryBudget
+
+BOUNDARY = "----regpsboundary"
+CONTYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart_body(report: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="upload"; filename="report.zip"\r\n'
+        "Content-Type: application/zip\r\n\r\n"
+    ).encode() + report + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def chunked(body: bytes, size: int = 1000):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+async def collect(tap, body):
+    return b"".join([chunk async for chunk in tap.stream(chunked(body))])
+
+
+def test_stream_forwards_same_bytes_and_verifies_digest():
+    with open("./data/report.zip", "rb") as f:
+        report = f.read()
+    dig = f"sha256-{sha256(report).hexdigest()}"
+    body = multipart_body(report)
+    tap = MultipartDigestTap(CONTYPE, dig)
+    forwarded = asyncio.run(collect(tap, body))
+    assert forwarded == body
+    assert tap.size == len(report)
+
+
+def test_stream_holds_back_body_when_digest_fails():
+    with open("./data/report.zip", "rb") as f:
+        report = f.read()
+    dig = f"sha256-{sha256(b'another report').hexdigest()}"
+    body = multipart_body(report)
+    tap = MultipartDigestTap(CONTYPE, dig)
+    forwarded = []
+
+    async def run():
+        async for chunk in tap.stream(chunked(body)):
+            forwarded.append(chunk)
+
+    with pytest.raises(DigestVerificationFailedException):
+        asyncio.run(run())
+    assert len(b"".join(forwarded)) < len(body)
+
+
+def test_stream_forwards_request_chunks_without_copies():
+    with open("./data/signed_report.zip", "rb") as f:
+        report = f.read()
+    body = multipart_body(report)
+    chunks = [body[i:i + 4096] for i in range(0, len(body), 4096)]
+    tap = MultipartDigestTap(CONTYPE, f"sha256-{sha256(report).hexdigest()}")
+    fed = []
+    feed = tap.hasher.feed
+    tap.hasher.feed = lambda data: fed.append(data) or feed(data)
+
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def run():
+        return [chunk async for chunk in tap.stream(source())]
+
+    forwarded = asyncio.run(run())
+    assert all(sent is chunk for sent, chunk in zip(forwarded, chunks))
+    assert all(isinstance(data, memoryview) for data in fed)
+    assert sum(len(data) for data in fed) == len(report)
+
+
+def test_stream_hashes_large_report_in_threads(monkeypatch):
+    monkeypatch.setattr(digest_verifier, "DIGEST_THREAD_MIN_BYTES", 4096)
+    report = bytes(range(256)) * 1000
+    dig = f"sha512-{hashlib.sha512(report).hexdigest()}"
+    body = multipart_body(report)
+    tap = MultipartDigestTap(CONTYPE, dig)
+    forwarded = asyncio.run(collect(tap, body))
+    assert forwarded == body
+    assert tap.size == len(report)
+
+
+def test_stream_requires_multipart():
+    with pytest.raises(DigestVerificationFailedException):
+        MultipartDigestTap("application/zip", "sha256-abc")
+
+
+def test_streamed_upload_reaches_filer():
+    with open("./data/signed_report.zip", "rb") as f:
+        report = f.read()
+    dig = f"sha256-{sha256(report).hexdigest()}"
+    body = multipart_body(report)
+    received = {}
+
+    async def handler(request: httpx.Request):
+        if request.method == "POST":
+            received["body"] = await request.aread()
+            received["length"] = request.headers.get("Content-Length")
+            return httpx.Response(200, json={"msg": "received"})
+        if "body" in received:
+            return httpx.Response(200, json={"status": "verified"})
+        return httpx.Response(404, json={"msg": "not found"})
+
+    adapter = FilerServiceAdapter(transport=httpx.MockTransport(handler))
+    tap = MultipartDigestTap(CONTYPE, dig)
+    res = asyncio.run(
+        adapter.upload_request("aid", dig, CONTYPE, tap.stream(chunked(body, 64 * 1024)), True, len(body))
+    )
+    assert res.status_code == 200
+    assert received["body"] == body
+    assert received["length"] == str(len(body))
+
+
+def filer_controller(received):
+    async def handler(request: httpx.Request):
+        if request.method == "POST":
+            received["body"] = await request.aread()
+            received["length"] = request.headers.get("Content-Length")
+            return httpx.Response(200, json={"msg": "received"})
+        if "body" in received:
+            return httpx.Response(200, json={"status": "verified"})
+        return httpx.Response(404, json={"msg": "not found"})
+
+    controller = APIController()
+    controller.filer_adapter = FilerServiceAdapter(transport=httpx.MockTransport(handler))
+    return controller
+
+
+def test_spooled_upload_spills_to_disk_and_reaches_filer(monkeypatch):
+    monkeypatch.setattr(upload_stream, "UPLOAD_MODE", "spool")
+    monkeypatch.setattr(upload_stream, "UPLOAD_SPOOL_MEMORY", 4096)
+    with open("./data/signed_report.zip", "rb") as f:
+        report = f.read()
+    body = multipart_body(report)
+    received = {}
+    controller = filer_controller(received)
+
+    res = asyncio.run(
+        controller.upload("aid", f"sha256-{sha256(report).hexdigest()}", CONTYPE, chunked(body), None)
+    )
+    assert res.status_code == 200
+    assert received["body"] == body
+    assert received["length"] == str(len(body))
+    assert controller.upload_budget.reserved == 0
+
+    received.clear()
+    with pytest.raises(DigestVerificationFailedException):
+        asyncio.run(
+            controller.upload("aid", f"sha256-{sha256(b'other').hexdigest()}", CONTYPE, chunked(body), None)
+        )
+    # the report failed verification before the filer was called
+    assert received == {}
+
+
+def test_upload_releases_budget_and_spool_before_polling(monkeypatch):
+    monkeypatch.setattr(upload_stream, "UPLOAD_MODE", "spool")
+    monkeypatch.setattr(upload_stream, "UPLOAD_SPOOL_MEMORY", 4096)
+    with open("./data/signed_report.zip", "rb") as f:
+        report = f.read()
+    body = multipart_body(report)
+    received = {}
+    controller = filer_controller(received)
+    spools = []
+    polled = []
+    close = upload_stream.UploadSpool.close
+    monkeypatch.setattr(upload_stream.UploadSpool, "close", lambda self: (spools.append(self), close(self)))
+
+    async def wait_for_upload(aid, dig, deadline=None):
+        polled.append((controller.upload_budget.reserved, len(spools)))
+        return httpx.Response(200, json={"status": "verified"})
+
+    controller.filer_adapter.wait_for_upload = wait_for_upload
+    res = asyncio.run(
+        controller.upload("aid", f"sha256-{sha256(report).hexdigest()}", CONTYPE, chunked(body), None)
+    )
+    assert res.status_code == 200
+    assert received["body"] == body
+    # nothing was reserved and the spool was closed while the filer was polled
+    assert polled == [(0, 1)]
+
+    polled.clear()
+    received.clear()
+    res = asyncio.run(
+        controller.upload("aid", f"sha256-{sha256(report).hexdigest()}", CONTYPE, chunked(body), None, wait=False)
+    )
+    assert res.status_code == 202
+    assert polled == []
+
+
+def test_upload_budget_rejects_when_used_up():
+    budget = UploadMemoryBudget(1000)
+    with budget.reserve(600):
+        with pytest.raises(UploadCapacityException) as e:
+            with budget.reserve(600):
+                pass
+        with budget.reserve(400):
+            assert budget.reserved == 1000
+    assert e.value.status_code == 503
+    assert e.value.headers["Retry-After"] == "5"
+    # a single upload larger than the budget is still admitted when nothing else runs
+    with budget.reserve(5000):
+        assert budget.reserved == 5000
+    assert budget.reserved == 0
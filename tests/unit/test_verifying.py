@@ -3,8 +3,9 @@ from starlette.datastructures import Headers
 
 from regps.app.api.exceptions import DigestVerificationFailedException
 from regps.app.api import signed_headers_verifier
+from regps.app.api.signed_headers_verifier import cached_signature_input, signature_input
 import pytest
-from hashlib import sha256
+from hashlib import new, sha256
 from regps.app.api.digest_verifier import verify_digest
 
 
@@ -88,4 +89,48 @@ def test_verify_forwarded_cig():
     assert (
         sig
         == "0BAo0wmWUJRG6a_-kmdeYWRhVdjifc9Dp7cEWxpFpLp4fUf114pb7Qec3r43uqGWfQdu33ci5PTDFgcIiDjsDPMI"
-    )
\ No newline at end of file
+    )
+
+
+def test_signature_input_template_cached_across_created_times():
+    AID = "EC3Rm0f9aQiZz2hxZOIup5Soyu6x_aA5996LP-eN6hBu"
+    headers = {
+        "SIGNATURE": 'indexed="?0";signify="0BAo0wmWUJRG6a_-kmdeYWRhVdjifc9Dp7cEWxpFpLp4fUf114pb7Qec3r43uqGWfQdu33ci5PTDFgcIiDjsDPMI"',
+        "SIGNATURE-INPUT": 'signify=("@method" "@path" "signify-resource" "signify-timestamp");created=1737497943;keyid="BAIGwtGP4CFwVqXiU9bspN5_eoWpPfNh9qChkK6FtDAu";alg="ed25519"',
+        "SIGNIFY-RESOURCE": AID,
+        "SIGNIFY-TIMESTAMP": "2025-01-21T22:19:03.646000+00:00",
+    }
+
+    def request(headers):
+        scope = dict(type="http", headers=Headers(headers).raw, method="GET", path=f"/checklogin/{AID}")
+        return fastapi.Request(scope)
+
+    cached_signature_input.cache_clear()
+    _, _, ser = signed_headers_verifier.VerifySignedHeaders.handle_headers(request(headers))
+    later = dict(headers)
+    later["SIGNATURE-INPUT"] = headers["SIGNATURE-INPUT"].replace("1737497943", "1737497999")
+    _, _, other = signed_headers_verifier.VerifySignedHeaders.handle_headers(request(later))
+    assert other == ser.replace("created=1737497943", "created=1737497999")
+    assert cached_signature_input.cache_info().hits == 1
+    assert cached_signature_input.cache_info().currsize == 1
+
+    # a created lookalike inside a quoted parameter falls back to a full parse
+    quoted = 'signify=("@method");nonce=";created=1";created=5;alg="ed25519"'
+    template, created = signature_input(quoted)
+    assert created == 5
+    assert template.serialize(request(headers), created).endswith(
+        '"@signature-params: (@method);created=5;nonce=;created=1;alg=ed25519"'
+    )
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "sha512", "blake2b", "SHA3_256"])
+def test_digest_algorithms(algorithm):
+    BASE_STR = "fefUBIUhdo9032bfHf0UNONF0kubni9HnF22L0KD2".encode()
+    dig = new(algorithm.lower(), BASE_STR).hexdigest()
+    assert verify_digest(BASE_STR, f"{algorithm}-{dig}") is True
+    assert verify_digest(BASE_STR + b"x", f"{algorithm}-{dig}") is False
+
+
+def test_digest_unknown_algorithm():
+    with pytest.raises(DigestVerificationFailedException, match="not supported"):
+        verify_digest(b"report", "md5-1bc29b36f623ba82aaf6724fd3b16718")